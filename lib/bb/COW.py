@@ -1,7 +1,7 @@
 # ex:ts=4:sw=4:sts=4:et
 # -*- tab-width: 4; c-basic-offset: 4; indent-tabs-mode: nil -*-
 #
-# This is a copy on write dictionary and set which abuses classes to try and be nice and fast.
+# This is a copy on write dictionary and set built from shared layers of plain dicts.
 #
 # Copyright (C) 2006 Tim Amsell
 #
@@ -38,167 +38,254 @@ ImmutableTypes = (
     basestring
 )
 
-MUTABLE = "__mutable__"
+class _Deleted(object):
+    """Marker for deleted keys which survives pickling as the same object"""
+    __slots__ = ()
+
+    def __reduce__(self):
+        return "_deleted"
+
+_deleted = _Deleted()
+
+class _Warn(object):
+    """
+    Where warnings about slow operations go. COWDictBase and COWSetBase
+    are instances, so this lets __warn__ still be assigned on them.
+    """
+    def __get__(self, obj, cls):
+        return cls._warnto
+
+    def __set__(self, obj, value):
+        type(obj)._warnto = value
+
+# Bumped by every write to a COWDict which has been copied, as the write
+# may change what flattened views built from it should contain
+_generation = 0
+
+class COWDict(object):
+    """
+    Copy on write dictionary.
+
+    Each instance holds a dict of its own writes, the dicts of the copies
+    it descends from up to maxdepth levels, and the COWDict above those
+    as its base. Lookups search them most recent first, so a copy keeps
+    seeing keys later written to the original unless it has written or
+    deleted them itself, just like the class hierarchy the metaclass
+    implementation used to build. Beyond maxdepth levels the base is
+    searched through a flattened view of it and everything above it,
+    which is rebuilt after a COWDict that has been copied is written to.
+    """
+    __slots__ = ("_local", "_layers", "_base", "_level", "_copied", "_flat", "_flatgen")
+
+    __warn__ = _Warn()
+    _warnto = False
+    __marker__ = _deleted
+    __getmarker__ = []
+    maxdepth = 8
+
+    def __init__(self):
+        self._local = {}
+        self._layers = ()
+        self._base = None
+        self._level = 0
+        self._copied = False
+        self._flat = None
 
-class COWMeta(type):
-    pass
+    def __getstate__(self):
+        return (self._local, self._layers, self._base, self._level, self._copied)
 
-class COWDictMeta(COWMeta):
-    __warn__ = False
-    __hasmutable__ = False
-    __marker__ = tuple()
+    def __setstate__(self, state):
+        self._local, self._layers, self._base, self._level, self._copied = state
+        self._flat = None
 
-    def __str__(cls):
-        # FIXME: I have magic numbers!
-        return "<COWDict Level: %i Current Keys: %i>" % (cls.__count__, len(cls.__dict__) - 3)
+    def __str__(self):
+        return "<COWDict Level: %i Current Keys: %i>" % (self._level, len(self._local))
     __repr__ = __str__
 
-    def cow(cls):
-        class C(cls):
-            __count__ = cls.__count__ + 1
-        return C
+    def cow(self):
+        self._copied = True
+        new = self.__class__.__new__(self.__class__)
+        new._local = {}
+        if len(self._layers) < self.maxdepth:
+            new._layers = (self._local,) + self._layers
+            new._base = self._base
+        else:
+            new._layers = ()
+            new._base = self
+        new._level = self._level + 1
+        new._copied = False
+        new._flat = None
+        return new
     copy = cow
     __call__ = cow
 
-    def __setitem__(cls, key, value):
-        if not isinstance(value, ImmutableTypes):
-            if not isinstance(value, COWMeta):
-                cls.__hasmutable__ = True
-            key += MUTABLE
-        setattr(cls, key, value)
-
-    def __getmutable__(cls, key, readonly=False):
-        nkey = key + MUTABLE
-        try:
-            return cls.__dict__[nkey]
-        except KeyError:
-            pass
+    def _changed(self):
+        global _generation
+        _generation += 1
 
-        value = getattr(cls, nkey)
-        if readonly:
+    def _flattened(self):
+        """
+        Return the merged contents of this COWDict and everything it
+        descends from, deleted keys included as markers.
+        """
+        if self._flat is not None and self._flatgen == _generation:
+            return self._flat
+
+        merged = {}
+        if self._base is not None:
+            merged.update(self._base._flattened())
+        for layer in reversed(self._layers):
+            merged.update(layer)
+        merged.update(self._local)
+        self._flat = merged
+        self._flatgen = _generation
+        return merged
+
+    def _lookup(self, key):
+        if key in self._local:
+            return self._local[key], True
+        for layer in self._layers:
+            if key in layer:
+                return layer[key], False
+        if self._base is None:
+            return self.__marker__, True
+        return self._base._flattened().get(key, self.__marker__), False
+
+    def __setitem__(self, key, value):
+        if self._copied:
+            self._changed()
+        self._local[key] = value
+
+    def __getmutable__(self, key, readonly=False):
+        value, local = self._lookup(key)
+        if local or readonly or value is self.__marker__:
             return value
+        return self._copyvalue(key, value)
 
-        if not cls.__warn__ is False and not isinstance(value, COWMeta):
-            print("Warning: Doing a copy because %s is a mutable type." % key, file=cls.__warn__)
+    def _copyvalue(self, key, value):
+        if not self.__warn__ is False and not isinstance(value, COWDict):
+            print("Warning: Doing a copy because %s is a mutable type." % key, file=self.__warn__)
         try:
             value = value.copy()
         except AttributeError as e:
             value = copy.copy(value)
-        setattr(cls, nkey, value)
+        if self._copied:
+            self._changed()
+        self._local[key] = value
         return value
 
-    __getmarker__ = []
-    def __getreadonly__(cls, key, default=__getmarker__):
+    def __getreadonly__(self, key, default=__getmarker__):
         """\
         Get a value (even if mutable) which you promise not to change.
         """
-        return cls.__getitem__(key, default, True)
-
-    def __getitem__(cls, key, default=__getmarker__, readonly=False):
-        try:
-            try:
-                value = getattr(cls, key)
-            except AttributeError:
-                value = cls.__getmutable__(key, readonly)
+        return self.__getitem__(key, default, True)
 
-            # This is for values which have been deleted
-            if value is cls.__marker__:
-                raise AttributeError("key %s does not exist." % key)
+    def __getitem__(self, key, default=__getmarker__, readonly=False):
+        value, local = self._lookup(key)
 
-            return value
-        except AttributeError as e:
-            if not default is cls.__getmarker__:
+        # This is for values which have been deleted
+        if value is self.__marker__:
+            if not default is self.__getmarker__:
                 return default
+            raise KeyError("key %s does not exist." % key)
 
-            raise KeyError(str(e))
+        # Mutable values from the original are copied before being handed
+        # out so changes stay local to this copy
+        if not local and not readonly and not isinstance(value, ImmutableTypes):
+            value = self._copyvalue(key, value)
 
-    def __delitem__(cls, key):
-        cls.__setitem__(key, cls.__marker__)
+        return value
 
-    def __revertitem__(cls, key):
-        if not cls.__dict__.has_key(key):
-            key += MUTABLE
-        delattr(cls, key)
+    def __delitem__(self, key):
+        if self._copied:
+            self._changed()
+        self._local[key] = self.__marker__
 
-    def __contains__(cls, key):
-        return cls.has_key(key)
+    def __revertitem__(self, key):
+        if self._copied:
+            self._changed()
+        del self._local[key]
 
-    def has_key(cls, key):
-        value = cls.__getreadonly__(key, cls.__marker__)
-        if value is cls.__marker__:
-            return False
-        return True
+    def __contains__(self, key):
+        return self.has_key(key)
 
-    def iter(cls, type, readonly=False):
-        for key in dir(cls):
-            if key.startswith("__"):
-                continue
+    def has_key(self, key):
+        return self._lookup(key)[0] is not self.__marker__
+
+    def __len__(self):
+        return len(self._keys())
 
-            if key.endswith(MUTABLE):
-                key = key[:-len(MUTABLE)]
+    def _keys(self):
+        seen = {}
+        if self._base is not None:
+            seen.update(self._base._flattened())
+        for layer in reversed(self._layers):
+            seen.update(layer)
+        seen.update(self._local)
+        return [k for k, v in seen.iteritems() if v is not self.__marker__]
 
+    def iter(self, type, readonly=False):
+        for key in self._keys():
             if type == "keys":
                 yield key
-
-            try:
-                if readonly:
-                    value = cls.__getreadonly__(key)
-                else:
-                    value = cls[key]
-            except KeyError:
                 continue
 
+            if readonly:
+                value = self.__getreadonly__(key)
+            else:
+                value = self[key]
+
             if type == "values":
                 yield value
             if type == "items":
                 yield (key, value)
-        raise StopIteration()
-
-    def iterkeys(cls):
-        return cls.iter("keys")
-    def itervalues(cls, readonly=False):
-        if not cls.__warn__ is False and cls.__hasmutable__ and readonly is False:
-            print("Warning: If you arn't going to change any of the values call with True.", file=cls.__warn__)
-        return cls.iter("values", readonly)
-    def iteritems(cls, readonly=False):
-        if not cls.__warn__ is False and cls.__hasmutable__ and readonly is False:
-            print("Warning: If you arn't going to change any of the values call with True.", file=cls.__warn__)
-        return cls.iter("items", readonly)
-
-class COWSetMeta(COWDictMeta):
-    def __str__(cls):
-        # FIXME: I have magic numbers!
-        return "<COWSet Level: %i Current Keys: %i>" % (cls.__count__, len(cls.__dict__) -3)
+
+    def __iter__(self):
+        return self.iterkeys()
+
+    def iterkeys(self):
+        return self.iter("keys")
+    def itervalues(self, readonly=False):
+        return self.iter("values", readonly)
+    def iteritems(self, readonly=False):
+        return self.iter("items", readonly)
+
+class COWSet(COWDict):
+    """
+    Copy on write set, sharing the layered storage of COWDict.
+    """
+    __slots__ = ()
+
+    def __str__(self):
+        return "<COWSet Level: %i Current Keys: %i>" % (self._level, len(self._local))
     __repr__ = __str__
 
-    def cow(cls):
-        class C(cls):
-            __count__ = cls.__count__ + 1
-        return C
+    def add(self, value):
+        if self._copied:
+            self._changed()
+        self._local[value] = value
 
-    def add(cls, value):
-        COWDictMeta.__setitem__(cls, repr(hash(value)), value)
+    def remove(self, value):
+        if self._copied:
+            self._changed()
+        self._local[value] = self.__marker__
 
-    def remove(cls, value):
-        COWDictMeta.__delitem__(cls, repr(hash(value)))
+    def __contains__(self, value):
+        return self.has_key(value)
+    __in__ = __contains__
 
-    def __in__(cls, value):
-        return COWDictMeta.has_key(repr(hash(value)))
+    def __iter__(self):
+        return self.itervalues(True)
 
-    def iterkeys(cls):
+    def iterkeys(self):
         raise TypeError("sets don't have keys")
 
-    def iteritems(cls):
+    def iteritems(self):
         raise TypeError("sets don't have 'items'")
 
-# These are the actual classes you use!
-class COWDictBase(object):
-    __metaclass__ = COWDictMeta
-    __count__ = 0
-
-class COWSetBase(object):
-    __metaclass__ = COWSetMeta
-    __count__ = 0
+# These are the empty roots that new COW dicts and sets are copied from
+COWDictBase = COWDict()
+COWSetBase = COWSet()
 
 if __name__ == "__main__":
     import sys
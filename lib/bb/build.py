@@ -313,7 +313,7 @@ exit $?
 
     try:
         with open(os.devnull, 'r+') as stdin:
-            bb.process.run(cmd, shell=False, stdin=stdin, log=logfile)
+            bb.process.run(cmd, shell=False, stdin=stdin, log=logfile, tail=65536)
     except bb.process.CmdError:
         logfn = d.getVar('BB_LOGFILE', True)
         raise FuncFailed(func, logfn)
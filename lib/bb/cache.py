@@ -30,6 +30,11 @@
 
 
 import os
+import gc
+import fcntl
+import struct
+import marshal
+import binascii
 import logging
 from collections import defaultdict
 import bb.utils
@@ -583,8 +588,11 @@ class Cache(object):
         if not self.has_cache:
             return
 
+        indexfile = getCacheFile(self.cachedir, RecipeIndex.indexfile, self.data_hash)
         if self.cacheclean:
             logger.debug(2, "Cache is clean, not saving.")
+            if not RecipeIndex.readable(indexfile):
+                RecipeIndex.write_from_cache(indexfile, self.depends_cache)
             return
 
         file_dict = {}
@@ -612,6 +620,8 @@ class Cache(object):
                     cache_class_name = cache_class.__name__
                     file_dict[cache_class_name].close()
 
+        RecipeIndex.write_from_cache(indexfile, self.depends_cache)
+
         del self.depends_cache
 
     @staticmethod
@@ -680,6 +690,224 @@ class Cache(object):
             raise
 
 
+class RecipeIndexInfo(object):
+    """
+    The part of CoreRecipeInfo which answers questions about the recipes
+    themselves (names, versions, build and runtime providers, inherited
+    classes) without any task or dependency data
+    """
+    __slots__ = ('pn', 'pe', 'pv', 'pr', 'defaultpref', 'provides',
+                 'rprovides', 'packages', 'packages_dynamic', 'inherits',
+                 'skipped', 'skipreason')
+
+    def __init__(self, info):
+        self.pn = info.pn
+        self.provides = info.provides
+        self.skipped = info.skipped
+        self.skipreason = info.skipreason
+        if info.skipped:
+            self.rprovides = info.rprovides
+            self.pe = self.pv = self.pr = self.defaultpref = self.inherits = None
+            self.packages = self.packages_dynamic = []
+        else:
+            # The recipe's and its packages' RPROVIDES together, as
+            # CoreRecipeInfo.add_cacheData() adds them to rproviders
+            self.rprovides = list(info.rprovides)
+            for package in info.packages:
+                for rprovide in info.rprovides_pkg[package]:
+                    if rprovide not in self.rprovides:
+                        self.rprovides.append(rprovide)
+            self.pe = info.pe
+            self.pv = info.pv
+            self.pr = info.pr
+            self.defaultpref = info.defaultpref
+            self.packages = info.packages
+            self.packages_dynamic = info.packages_dynamic
+            self.inherits = info.inherits
+
+    def __getstate__(self):
+        return tuple(getattr(self, key) for key in self.__slots__)
+
+    def __setstate__(self, state):
+        for key, value in zip(self.__slots__, state):
+            setattr(self, key, value)
+
+    def add_cacheData(self, cachedata, fn):
+        cachedata.pkg_fn[fn] = self.pn
+        cachedata.pkg_pn[self.pn].append(fn)
+        cachedata.pkg_pepvpr[fn] = (self.pe, self.pv, self.pr)
+        cachedata.pkg_dp[fn] = self.defaultpref
+
+        provides = [self.pn]
+        for provide in self.provides:
+            if provide not in provides:
+                provides.append(provide)
+        cachedata.fn_provides[fn] = provides
+
+        for provide in provides:
+            cachedata.providers[provide].append(fn)
+            if provide not in cachedata.pn_provides[self.pn]:
+                cachedata.pn_provides[self.pn].append(provide)
+
+        for package in self.packages:
+            cachedata.packages[package].append(fn)
+
+        for rprovide in self.rprovides:
+            cachedata.rproviders[rprovide].append(fn)
+
+        for package in self.packages_dynamic:
+            cachedata.packages_dynamic[package].append(fn)
+
+        cachedata.universe_target.append(self.pn)
+        cachedata.inherits[fn] = self.inherits
+
+class RecipeIndex(object):
+    """
+    A small index of the recipe cache, written next to it whenever the
+    cache is saved. For each recipe file it keeps what is needed to check
+    the entry is still valid and a RecipeIndexInfo per variant, so tools
+    which only list recipes, versions, providers or appends can load it
+    in a fraction of the time the full cache takes.
+    """
+    indexfile = "bb_cache_index.dat"
+    # Bumped whenever RecipeIndexInfo changes
+    index_version = 2
+
+    def __init__(self, data, data_hash):
+        self.entries = {}
+        self.cachefile = None
+        self.changed = False
+
+        cachedir = data.getVar("CACHE", True)
+        if not cachedir:
+            return
+        self.cachefile = getCacheFile(cachedir, self.indexfile, data_hash)
+        try:
+            with open(self.cachefile, "rb") as f:
+                p = pickle.Unpickler(f)
+                if p.load() != self.header():
+                    return
+                self.entries = p.load()
+        except (IOError, OSError, EOFError, ValueError, pickle.UnpicklingError):
+            self.entries = {}
+
+    @classmethod
+    def header(cls):
+        return (__cache_version__, bb.__version__, cls.index_version)
+
+    @classmethod
+    def readable(cls, cachefile):
+        """
+        Whether cachefile is an index this version of bitbake can load
+        """
+        try:
+            with open(cachefile, "rb") as f:
+                return pickle.Unpickler(f).load() == cls.header()
+        except (IOError, OSError, EOFError, ValueError, pickle.UnpicklingError):
+            return False
+
+    @staticmethod
+    def make_entry(fn, infos):
+        """
+        Build the index entry for recipe file fn from its parsed or cached
+        (virtualfn, info_array) pairs. Returns None if it should not be
+        kept, like Cache.add_info() would not keep it.
+        """
+        core = [(virtualfn, info_array[0]) for virtualfn, info_array in infos]
+        for virtualfn, info in core:
+            if info.nocache or (not info.skipped and 'SRCREVINACTION' in info.pv):
+                return None
+            if virtualfn == fn:
+                base = info
+        checkfiles = []
+        if hasattr(base, 'file_checksums'):
+            for fl in base.file_checksums.itervalues():
+                checkfiles.extend(fl.split())
+        return (base.timestamp, base.file_depends, base.appends, checkfiles,
+                [(virtualfn, RecipeIndexInfo(info)) for virtualfn, info in core])
+
+    def valid(self, fn, appends):
+        """
+        Return the (virtualfn, RecipeIndexInfo) pairs for fn if its entry
+        is still valid, applying the same checks as Cache.cacheValidUpdate()
+        """
+        if fn not in self.entries:
+            return None
+        timestamp, depends, oldappends, checkfiles, recipes = self.entries[fn]
+        if bb.parse.cached_mtime_noerror(fn) != timestamp or appends != oldappends:
+            return None
+        for f, old_mtime in depends or []:
+            if bb.parse.cached_mtime_noerror(f) != old_mtime:
+                return None
+        for f in checkfiles:
+            if not os.path.exists(f):
+                return None
+        return recipes
+
+    def outdated(self, limit):
+        """
+        Whether more than limit of the recipes indexed are out of date,
+        judging by what the index recorded for them. This needs no file
+        collection, but new recipes and changed appends are only seen by
+        valid() once the files have been collected.
+        """
+        count = 0
+        for fn, entry in self.entries.iteritems():
+            if not bb.parse.cached_mtime_noerror(fn):
+                # Removed, it won't need parsing
+                continue
+            if self.valid(fn, entry[2]) is None:
+                count += 1
+                if count > limit:
+                    return True
+        return False
+
+    def add(self, fn, infos):
+        """
+        Index freshly parsed infos for fn and return its recipes
+        """
+        entry = self.make_entry(fn, infos)
+        if entry:
+            self.entries[fn] = entry
+            self.changed = True
+            return entry[4]
+        return [(virtualfn, RecipeIndexInfo(info_array[0])) for virtualfn, info_array in infos]
+
+    def save(self):
+        if not self.cachefile or not self.changed:
+            return
+        self.write(self.cachefile, self.entries)
+        self.changed = False
+
+    @staticmethod
+    def write(cachefile, entries):
+        tmpfile = "%s.%s" % (cachefile, os.getpid())
+        with open(tmpfile, "wb") as f:
+            p = pickle.Pickler(f, pickle.HIGHEST_PROTOCOL)
+            p.dump(RecipeIndex.header())
+            p.dump(entries)
+        os.rename(tmpfile, cachefile)
+
+    @classmethod
+    def write_from_cache(cls, cachefile, depends_cache):
+        """
+        Write the index for everything in a Cache's depends_cache
+        """
+        variants = defaultdict(list)
+        for virtualfn, info_array in depends_cache.iteritems():
+            if isinstance(info_array[0], CoreRecipeInfo):
+                variants[Cache.virtualfn2realfn(virtualfn)[0]].append((virtualfn, info_array))
+        entries = {}
+        for fn, infos in variants.iteritems():
+            if fn not in depends_cache:
+                continue
+            if len(infos) != len(depends_cache[fn][0].variants):
+                continue
+            entry = cls.make_entry(fn, infos)
+            if entry:
+                entries[fn] = entry
+        cls.write(cachefile, entries)
+
 def init(cooker):
     """
     The Objective: Cache the minimum amount of data possible yet get to the
@@ -729,12 +957,38 @@ class MultiProcessCache(object):
     BitBake multi-process cache implementation
 
     Used by the codeparser & file checksum caches
+
+    The cache is stored as a base file plus an append-only log of
+    records. Parser processes append the entries they added to the log
+    without reading or rewriting the base file; readers replay the log on
+    top of the base. The log is folded back into the base only once it has
+    grown past a fraction of the base size.
+
+    The log starts with a header carrying a random generation token, so a
+    reader can tell that the log was compacted and recreated since it last
+    looked. Each record is length-prefixed, so a record which fails to load
+    does not stop the replay of the records after it.
+
+    The base is written with marshal, which loads several times faster
+    than pickle, unless the data holds objects only pickle can store.
     """
 
+    # Compact the log into the base file once it exceeds this fraction
+    # of the size of the base file
+    compact_ratio = 0.25
+
+    base_magic = "BBMPCBASE"
+    log_magic = "BBMPCLOG"
+    log_header_len = len(log_magic) + 16
+    log_record = struct.Struct(">I")
+
     def __init__(self):
         self.cachefile = None
         self.cachedata = self.create_cachedata()
         self.cachedata_extras = self.create_cachedata()
+        self.logpos = 0
+        self.logtoken = None
+        self.stalebase = False
 
     def init_cache(self, d):
         cachedir = (d.getVar("PERSISTENT_DIR", True) or
@@ -745,22 +999,98 @@ class MultiProcessCache(object):
         self.cachefile = os.path.join(cachedir, self.__class__.cache_file_name)
         logger.debug(1, "Using cache in '%s'", self.cachefile)
 
-        glf = bb.utils.lockfile(self.cachefile + ".lock")
+        glf = bb.utils.lockfile(self.cachefile + ".lock", shared=True)
 
+        # The collector would otherwise keep scanning the many containers
+        # being loaded, which takes longer than the loading itself
+        gcenabled = gc.isenabled()
+        gc.disable()
         try:
-            with open(self.cachefile, "rb") as f:
-                p = pickle.Unpickler(f)
-                data, version = p.load()
-        except:
+            data = self.load_base()
+            # A missing or out of date base still leaves the log usable
+            self.stalebase = data is None
+            if data is None:
+                data = self.create_cachedata()
+            self.load_log(data)
+        finally:
+            if gcenabled:
+                gc.enable()
             bb.utils.unlockfile(glf)
-            return
 
-        bb.utils.unlockfile(glf)
+        self.cachedata = data
+
+    def load_base(self):
+        try:
+            with open(self.cachefile, "rb") as f:
+                if f.read(len(self.base_magic)) == self.base_magic:
+                    version, data = marshal.load(f)
+                else:
+                    f.seek(0)
+                    p = pickle.Unpickler(f)
+                    data, version = p.load()
+        except:
+            return None
 
         if version != self.__class__.CACHE_VERSION:
+            return None
+
+        return data
+
+    def read_log_header(self, f):
+        header = f.read(self.log_header_len)
+        if len(header) != self.log_header_len or not header.startswith(self.log_magic):
+            return None
+        return header
+
+    def load_log(self, data, offset=0):
+        """
+        Replay the records in the log file from offset onwards on top of
+        data. If the log is not the one offset refers to (it has been
+        compacted and recreated since), the whole log is replayed. Records
+        which fail to load are skipped; a truncated trailing record (from an
+        interrupted writer) ends the replay. Sets logpos to the end of the
+        last complete record.
+        """
+        self.logpos = 0
+        try:
+            f = open(self.cachefile + ".log", "rb")
+        except IOError:
             return
 
-        self.cachedata = data
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            header = self.read_log_header(f)
+            if header is None:
+                if size:
+                    logger.debug(1, "Ignoring '%s.log' with an unknown header", self.cachefile)
+                return
+
+            if header != self.logtoken or offset < self.log_header_len:
+                offset = self.log_header_len
+            self.logtoken = header
+            self.logpos = offset
+            f.seek(offset)
+
+            while True:
+                prefix = f.read(self.log_record.size)
+                if len(prefix) < self.log_record.size:
+                    break
+                length = self.log_record.unpack(prefix)[0]
+                if length > size - f.tell():
+                    break
+                record = f.read(length)
+                self.logpos = f.tell()
+
+                try:
+                    version, extradata = pickle.loads(record)
+                except Exception:
+                    logger.debug(1, "Ignoring corrupt record in '%s.log'", self.cachefile)
+                    continue
+
+                if version != self.__class__.CACHE_VERSION:
+                    continue
+
+                self.merge_data(extradata, data)
 
     def internSet(self, items):
         new = set()
@@ -780,25 +1110,64 @@ class MultiProcessCache(object):
         if not self.cachefile:
             return
 
+        if not any(self.cachedata_extras):
+            return
+
+        record = pickle.dumps([self.__class__.CACHE_VERSION, self.cachedata_extras], -1)
+        record = self.log_record.pack(len(record)) + record
+
+        # The shared lock keeps compaction out while we append; appenders
+        # serialise among themselves on the log file itself
         glf = bb.utils.lockfile(self.cachefile + ".lock", shared=True)
+        try:
+            with open(self.cachefile + ".log", "ab") as f:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+                start = os.fstat(f.fileno()).st_size
+                if not start:
+                    record = self.log_magic + binascii.hexlify(os.urandom(8)) + record
+                    self.remove_legacy_extras()
+                # A single write so that readers never see a partial record
+                # unless the writer dies in the middle of the syscall
+                try:
+                    if os.write(f.fileno(), record) != len(record):
+                        raise IOError("Short write to '%s.log'" % self.cachefile)
+                except (OSError, IOError):
+                    f.truncate(start)
+                    raise
+        finally:
+            bb.utils.unlockfile(glf)
 
-        i = os.getpid()
-        lf = None
-        while not lf:
-            lf = bb.utils.lockfile(self.cachefile + ".lock." + str(i), retry=False)
-            if not lf or os.path.exists(self.cachefile + "-" + str(i)):
-                if lf:
-                    bb.utils.unlockfile(lf)
-                    lf = None
-                i = i + 1
-                continue
+    def remove_legacy_extras(self):
+        """
+        Remove the cachefile-<n> extras files and their lock files which
+        versions of bitbake before the log format left behind
+        """
+        cachedir = os.path.dirname(self.cachefile)
+        prefix = os.path.basename(self.cachefile)
+        for name in os.listdir(cachedir):
+            for legacy in (prefix + "-", prefix + ".lock."):
+                if name.startswith(legacy) and name[len(legacy):].isdigit():
+                    bb.utils.remove(os.path.join(cachedir, name))
+
+    def exchange_extras(self, d):
+        """
+        Publish the entries added by this process to the log so sibling
+        processes can use them, then pick up anything the siblings have
+        published since we last looked.
+        """
+        if not self.cachefile:
+            return
 
-            with open(self.cachefile + "-" + str(i), "wb") as f:
-                p = pickle.Pickler(f, -1)
-                p.dump([self.cachedata_extras, self.__class__.CACHE_VERSION])
+        self.save_extras(d)
+        self.merge_data(self.cachedata_extras, self.cachedata)
+        for extras in self.cachedata_extras:
+            extras.clear()
 
-        bb.utils.unlockfile(lf)
-        bb.utils.unlockfile(glf)
+        glf = bb.utils.lockfile(self.cachefile + ".lock", shared=True)
+        try:
+            self.load_log(self.cachedata, self.logpos)
+        finally:
+            bb.utils.unlockfile(glf)
 
     def merge_data(self, source, dest):
         for j in range(0,len(dest)):
@@ -806,42 +1175,58 @@ class MultiProcessCache(object):
                 if h not in dest[j]:
                     dest[j][h] = source[j][h]
 
-    def save_merge(self, d):
+    def needs_compaction(self):
+        if self.stalebase:
+            return True
+        try:
+            with open(self.cachefile + ".log", "rb") as f:
+                logsize = os.fstat(f.fileno()).st_size
+                if logsize and self.read_log_header(f) is None:
+                    # Not a log we can replay, start a new one
+                    return True
+        except IOError:
+            return False
+        try:
+            basesize = os.path.getsize(self.cachefile)
+        except OSError:
+            return True
+        return logsize > basesize * self.compact_ratio
+
+    def save_merge(self, d, force=False):
         if not self.cachefile:
             return
 
+        if not force and not self.needs_compaction():
+            return
+
         glf = bb.utils.lockfile(self.cachefile + ".lock")
 
+        gcenabled = gc.isenabled()
+        gc.disable()
         try:
-            with open(self.cachefile, "rb") as f:
-                p = pickle.Unpickler(f)
-                data, version = p.load()
-        except (IOError, EOFError):
-            data, version = None, None
-
-        if version != self.__class__.CACHE_VERSION:
-            data = self.create_cachedata()
-
-        for f in [y for y in os.listdir(os.path.dirname(self.cachefile)) if y.startswith(os.path.basename(self.cachefile) + '-')]:
-            f = os.path.join(os.path.dirname(self.cachefile), f)
-            try:
-                with open(f, "rb") as fd:
-                    p = pickle.Unpickler(fd)
-                    extradata, version = p.load()
-            except (IOError, EOFError):
-                extradata, version = self.create_cachedata(), None
-
-            if version != self.__class__.CACHE_VERSION:
-                continue
-
-            self.merge_data(extradata, data)
-            os.unlink(f)
-
-        self.compress_keys(data)
-
-        with open(self.cachefile, "wb") as f:
-            p = pickle.Pickler(f, -1)
-            p.dump([data, self.__class__.CACHE_VERSION])
-
-        bb.utils.unlockfile(glf)
-
+            data = self.load_base()
+            if data is None:
+                data = self.create_cachedata()
+            self.load_log(data)
+
+            self.compress_keys(data)
+
+            # Write the new base alongside and rename it into place so that
+            # a reader never sees a partially written file
+            with open(self.cachefile + ".new", "wb") as f:
+                try:
+                    dumped = marshal.dumps((self.__class__.CACHE_VERSION, data), 2)
+                except ValueError:
+                    p = pickle.Pickler(f, -1)
+                    p.dump([data, self.__class__.CACHE_VERSION])
+                else:
+                    f.write(self.base_magic)
+                    f.write(dumped)
+                    del dumped
+            os.rename(self.cachefile + ".new", self.cachefile)
+            bb.utils.remove(self.cachefile + ".log")
+            self.stalebase = False
+        finally:
+            if gcenabled:
+                gc.enable()
+            bb.utils.unlockfile(glf)
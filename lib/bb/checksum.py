@@ -81,7 +81,7 @@ class FileChecksumCache(MultiProcessCache):
 
     def merge_data(self, source, dest):
         for h in source[0]:
-            if h in dest:
+            if h in dest[0]:
                 (smtime, _) = source[0][h]
                 (dmtime, _) = dest[0][h]
                 if smtime > dmtime:
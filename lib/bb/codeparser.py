@@ -2,6 +2,8 @@ import ast
 import codegen
 import logging
 import os.path
+import hashlib
+import time
 import bb.utils, bb.data
 from itertools import chain
 from pysh import pyshyacc, pyshlex, sherrors
@@ -33,9 +35,17 @@ def check_indent(codestr):
     return codestr
 
 
+def code_digest(codestr):
+    """Content-addressed key for the parse result of a piece of code"""
+    return intern(hashlib.md5(str(codestr)).hexdigest())
+
 class CodeParserCache(MultiProcessCache):
     cache_file_name = "bb_codeparser.dat"
-    CACHE_VERSION = 3
+    CACHE_VERSION = 4
+
+    # Minimum interval in seconds between publishing parse results to
+    # sibling parser processes
+    exchange_interval = 1.0
 
     def __init__(self):
         MultiProcessCache.__init__(self)
@@ -43,6 +53,25 @@ class CodeParserCache(MultiProcessCache):
         self.shellcache = self.cachedata[1]
         self.pythoncacheextras = self.cachedata_extras[0]
         self.shellcacheextras = self.cachedata_extras[1]
+        self.lastexchange = time.time()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.stats = {"python": [0, 0], "shell": [0, 0]}
+
+    def hit(self, kind):
+        self.stats[kind][0] += 1
+
+    def miss(self, kind):
+        self.stats[kind][1] += 1
+
+    def log_stats(self):
+        for kind in sorted(self.stats):
+            hits, misses = self.stats[kind]
+            total = hits + misses
+            if total:
+                logger.debug(1, "Codeparser %s cache: %d lookups, %d hits (%.1f%%)",
+                             kind, total, hits, 100.0 * hits / total)
 
     def init_cache(self, d):
         MultiProcessCache.init_cache(self, d)
@@ -51,6 +80,13 @@ class CodeParserCache(MultiProcessCache):
         self.pythoncache = self.cachedata[0]
         self.shellcache = self.cachedata[1]
 
+    def exchange_extras(self, d):
+        now = time.time()
+        if now - self.lastexchange < self.exchange_interval:
+            return
+        self.lastexchange = now
+        MultiProcessCache.exchange_extras(self, d)
+
     def compress_keys(self, data):
         # When the dicts are originally created, python calls intern() on the set keys
         # which significantly improves memory usage. Sadly the pickle/unpickle process
@@ -79,6 +115,10 @@ def parser_cache_init(d):
 
 def parser_cache_save(d):
     codeparsercache.save_extras(d)
+    codeparsercache.log_stats()
+
+def parser_cache_exchange(d):
+    codeparsercache.exchange_extras(d)
 
 def parser_cache_savemerge(d):
     codeparsercache.save_merge(d)
@@ -157,18 +197,21 @@ class PythonParser():
         self.unhandled_message = "while parsing %s, %s" % (name, self.unhandled_message)
 
     def parse_python(self, node):
-        h = hash(str(node))
+        h = code_digest(node)
 
         if h in codeparsercache.pythoncache:
+            codeparsercache.hit("python")
             self.references = codeparsercache.pythoncache[h]["refs"]
             self.execs = codeparsercache.pythoncache[h]["execs"]
             return
 
         if h in codeparsercache.pythoncacheextras:
+            codeparsercache.hit("python")
             self.references = codeparsercache.pythoncacheextras[h]["refs"]
             self.execs = codeparsercache.pythoncacheextras[h]["execs"]
             return
 
+        codeparsercache.miss("python")
 
         code = compile(check_indent(str(node)), "<string>", "exec",
                        ast.PyCF_ONLY_AST)
@@ -198,16 +241,20 @@ class ShellParser():
         commands it executes.
         """
 
-        h = hash(str(value))
+        h = code_digest(value)
 
         if h in codeparsercache.shellcache:
+            codeparsercache.hit("shell")
             self.execs = codeparsercache.shellcache[h]["execs"]
             return self.execs
 
         if h in codeparsercache.shellcacheextras:
+            codeparsercache.hit("shell")
             self.execs = codeparsercache.shellcacheextras[h]["execs"]
             return self.execs
 
+        codeparsercache.miss("shell")
+
         try:
             tokens, _ = pyshyacc.parse(value, eof=True, debug=False)
         except pyshlex.NeedMore:
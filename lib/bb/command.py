@@ -284,6 +284,18 @@ class CommandsAsync:
         command.finishAsyncCommand()
     generateDepTreeEvent.needcache = True
 
+    def generateDepTreeItems(self, command, params):
+        """
+        Generate a series of events containing the dependency information
+        in batches
+        """
+        pkgs_to_build = params[0]
+        task = params[1]
+
+        command.cooker.generateDepTreeItemsEvents(pkgs_to_build, task)
+        command.finishAsyncCommand()
+    generateDepTreeItems.needcache = True
+
     def generateDotGraph(self, command, params):
         """
         Dump dependency information to disk as .dot files
@@ -418,75 +418,85 @@ class BBCooker:
     
     ######## WARNING : this function requires cache_extra to be enabled ########
 
-    def generateTaskDepTreeData(self, pkgs_to_build, task):
+    def generateTaskDepTreeItems(self, pkgs_to_build, task):
         """
-        Create a dependency graph of pkgs_to_build including reverse dependency
-        information.
+        Create a dependency graph of pkgs_to_build, yielded one record at a
+        time as (kind, key, value) so that it can be written out or sent on
+        without holding the whole graph. kind is one of the keys of the
+        dictionary generateTaskDepTreeData() returns:
+
+          ("pn", pn, {"filename": fn, "version": version})
+          ("tdepends", "pn.task", ["deppn.deptask", ...])
+          ("depends", pn, [target, ...])
+          ("rdepends-pn", pn, [target, ...])
+          ("rdepends-pkg", package, [rdepend, ...])
+          ("rrecs-pkg", package, [rrecommend, ...])
+          ("packages", package, {"pn": pn, "filename": fn, "version": version})
+
+        A recipe's "pn" record comes before any other record about it.
         """
         runlist, taskdata = self.prepareTreeData(pkgs_to_build, task)
         rq = bb.runqueue.RunQueue(self, self.data, self.recipecache, taskdata, runlist)
         rq.rqdata.prepare()
+        rqdata = rq.rqdata
 
-        seen_fnids = []
-        depend_tree = {}
-        depend_tree["depends"] = {}
-        depend_tree["tdepends"] = {}
-        depend_tree["pn"] = {}
-        depend_tree["rdepends-pn"] = {}
-        depend_tree["packages"] = {}
-        depend_tree["rdepends-pkg"] = {}
-        depend_tree["rrecs-pkg"] = {}
+        seen_pns = set()
+        seen_fnids = set()
+        seen_packages = set()
+        fnid_pn = {}
+        for fnid in set(rqdata.runq_fnid):
+            fnid_pn[fnid] = self.recipecache.pkg_fn[taskdata.fn_index[fnid]]
 
-        for task in xrange(len(rq.rqdata.runq_fnid)):
-            taskname = rq.rqdata.runq_task[task]
-            fnid = rq.rqdata.runq_fnid[task]
+        for task in xrange(len(rqdata.runq_fnid)):
+            fnid = rqdata.runq_fnid[task]
             fn = taskdata.fn_index[fnid]
-            pn = self.recipecache.pkg_fn[fn]
+            pn = fnid_pn[fnid]
             version  = "%s:%s-%s" % self.recipecache.pkg_pepvpr[fn]
-            if pn not in depend_tree["pn"]:
-                depend_tree["pn"][pn] = {}
-                depend_tree["pn"][pn]["filename"] = fn
-                depend_tree["pn"][pn]["version"] = version
-            for dep in rq.rqdata.runq_depends[task]:
-                depfn = taskdata.fn_index[rq.rqdata.runq_fnid[dep]]
-                deppn = self.recipecache.pkg_fn[depfn]
-                dotname = "%s.%s" % (pn, rq.rqdata.runq_task[task])
-                if not dotname in depend_tree["tdepends"]:
-                    depend_tree["tdepends"][dotname] = []
-                depend_tree["tdepends"][dotname].append("%s.%s" % (deppn, rq.rqdata.runq_task[dep]))
-            if fnid not in seen_fnids:
-                seen_fnids.append(fnid)
-                packages = []
+            if pn not in seen_pns:
+                seen_pns.add(pn)
+                yield ("pn", pn, {"filename": fn, "version": version})
+            if rqdata.runq_depends.rowlen(task):
+                runq_task = rqdata.runq_task
+                yield ("tdepends", "%s.%s" % (pn, runq_task[task]),
+                       ["%s.%s" % (fnid_pn[rqdata.runq_fnid[dep]], runq_task[dep]) for dep in rqdata.runq_depends.iterrow(task)])
+            if fnid in seen_fnids:
+                continue
+            seen_fnids.add(fnid)
+            packages = []
 
-                depend_tree["depends"][pn] = []
-                for dep in taskdata.depids[fnid]:
-                    depend_tree["depends"][pn].append(taskdata.build_names_index[dep])
+            yield ("depends", pn, [taskdata.build_names_index[dep] for dep in taskdata.depids[fnid]])
+            yield ("rdepends-pn", pn, [taskdata.run_names_index[rdep] for rdep in taskdata.rdepids[fnid]])
 
-                depend_tree["rdepends-pn"][pn] = []
-                for rdep in taskdata.rdepids[fnid]:
-                    depend_tree["rdepends-pn"][pn].append(taskdata.run_names_index[rdep])
+            rdepends = self.recipecache.rundeps[fn]
+            for package in rdepends:
+                yield ("rdepends-pkg", package, list(rdepends[package]))
+                packages.append(package)
 
-                rdepends = self.recipecache.rundeps[fn]
-                for package in rdepends:
-                    depend_tree["rdepends-pkg"][package] = []
-                    for rdepend in rdepends[package]:
-                        depend_tree["rdepends-pkg"][package].append(rdepend)
+            rrecs = self.recipecache.runrecs[fn]
+            for package in rrecs:
+                yield ("rrecs-pkg", package, list(rrecs[package]))
+                if not package in rdepends:
                     packages.append(package)
 
-                rrecs = self.recipecache.runrecs[fn]
-                for package in rrecs:
-                    depend_tree["rrecs-pkg"][package] = []
-                    for rdepend in rrecs[package]:
-                        depend_tree["rrecs-pkg"][package].append(rdepend)
-                    if not package in packages:
-                        packages.append(package)
-
-                for package in packages:
-                    if package not in depend_tree["packages"]:
-                        depend_tree["packages"][package] = {}
-                        depend_tree["packages"][package]["pn"] = pn
-                        depend_tree["packages"][package]["filename"] = fn
-                        depend_tree["packages"][package]["version"] = version
+            for package in packages:
+                if package not in seen_packages:
+                    seen_packages.add(package)
+                    yield ("packages", package, {"pn": pn, "filename": fn, "version": version})
+
+    def generateTaskDepTreeData(self, pkgs_to_build, task):
+        """
+        Create a dependency graph of pkgs_to_build including reverse dependency
+        information.
+        """
+        depend_tree = {}
+        for kind in ("depends", "tdepends", "pn", "rdepends-pn", "packages", "rdepends-pkg", "rrecs-pkg"):
+            depend_tree[kind] = {}
+
+        for (kind, key, value) in self.generateTaskDepTreeItems(pkgs_to_build, task):
+            if kind == "tdepends":
+                depend_tree[kind].setdefault(key, []).extend(value)
+            else:
+                depend_tree[kind][key] = value
 
         return depend_tree
 
@@ -581,65 +591,80 @@ class BBCooker:
         depgraph = self.generateTaskDepTreeData(pkgs_to_build, task)
         bb.event.fire(bb.event.DepTreeGenerated(depgraph), self.data)
 
+    def generateDepTreeItemsEvents(self, pkgs_to_build, task, batchsize=1000):
+        """
+        Create a task dependency graph of pkgs_to_build.
+        Send it to the UI as a series of DepTreeItems events, each carrying
+        up to batchsize records from generateTaskDepTreeItems()
+        """
+        items = []
+        for item in self.generateTaskDepTreeItems(pkgs_to_build, task):
+            items.append(item)
+            if len(items) >= batchsize:
+                bb.event.fire(bb.event.DepTreeItems(items), self.data)
+                items = []
+        if items:
+            bb.event.fire(bb.event.DepTreeItems(items), self.data)
+
     def generateDotGraphFiles(self, pkgs_to_build, task):
         """
         Create a task dependency graph of pkgs_to_build.
         Save the result to a set of .dot files.
         """
 
-        depgraph = self.generateTaskDepTreeData(pkgs_to_build, task)
+        # Records are written out as they are generated; only the per-recipe
+        # information the later records refer back to is kept
+        pn_info = {}
+        pn_depends = {}
 
         # Prints a flattened form of package-depends below where subpackages of a package are merged into the main pn
         depends_file = file('pn-depends.dot', 'w' )
         buildlist_file = file('pn-buildlist', 'w' )
-        print("digraph depends {", file=depends_file)
-        for pn in depgraph["pn"]:
-            fn = depgraph["pn"][pn]["filename"]
-            version = depgraph["pn"][pn]["version"]
-            print('"%s" [label="%s %s\\n%s"]' % (pn, pn, version, fn), file=depends_file)
-            print("%s" % pn, file=buildlist_file)
+        pkgdepends_file = file('package-depends.dot', 'w' )
+        tdepends_file = file('task-depends.dot', 'w' )
+        for f in (depends_file, pkgdepends_file, tdepends_file):
+            print("digraph depends {", file=f)
+
+        for (kind, key, value) in self.generateTaskDepTreeItems(pkgs_to_build, task):
+            if kind == "pn":
+                pn_info[key] = value
+                print('"%s" [label="%s %s\\n%s"]' % (key, key, value["version"], value["filename"]), file=depends_file)
+                print("%s" % key, file=buildlist_file)
+            elif kind == "depends":
+                pn_depends[key] = value
+                for depend in value:
+                    print('"%s" -> "%s"' % (key, depend), file=depends_file)
+            elif kind == "rdepends-pn":
+                for rdepend in value:
+                    print('"%s" -> "%s" [style=dashed]' % (key, rdepend), file=depends_file)
+            elif kind == "packages":
+                pn = value["pn"]
+                if key == pn:
+                    print('"%s" [label="%s %s\\n%s"]' % (pn, pn, value["version"], value["filename"]), file=pkgdepends_file)
+                else:
+                    print('"%s" [label="%s(%s) %s\\n%s"]' % (key, key, pn, value["version"], value["filename"]), file=pkgdepends_file)
+                for depend in pn_depends[pn]:
+                    print('"%s" -> "%s"' % (key, depend), file=pkgdepends_file)
+            elif kind in ("rdepends-pkg", "rrecs-pkg"):
+                for rdepend in value:
+                    print('"%s" -> "%s" [style=dashed]' % (key, rdepend), file=pkgdepends_file)
+            elif kind == "tdepends":
+                (pn, taskname) = key.rsplit(".", 1)
+                info = pn_info[pn]
+                print('"%s.%s" [label="%s %s\\n%s\\n%s"]' % (pn, taskname, pn, taskname, info["version"], info["filename"]), file=tdepends_file)
+                for dep in value:
+                    print('"%s" -> "%s"' % (key, dep), file=tdepends_file)
+
         buildlist_file.close()
         logger.info("PN build list saved to 'pn-buildlist'")
-        for pn in depgraph["depends"]:
-            for depend in depgraph["depends"][pn]:
-                print('"%s" -> "%s"' % (pn, depend), file=depends_file)
-        for pn in depgraph["rdepends-pn"]:
-            for rdepend in depgraph["rdepends-pn"][pn]:
-                print('"%s" -> "%s" [style=dashed]' % (pn, rdepend), file=depends_file)
         print("}", file=depends_file)
+        depends_file.close()
         logger.info("PN dependencies saved to 'pn-depends.dot'")
-
-        depends_file = file('package-depends.dot', 'w' )
-        print("digraph depends {", file=depends_file)
-        for package in depgraph["packages"]:
-            pn = depgraph["packages"][package]["pn"]
-            fn = depgraph["packages"][package]["filename"]
-            version = depgraph["packages"][package]["version"]
-            if package == pn:
-                print('"%s" [label="%s %s\\n%s"]' % (pn, pn, version, fn), file=depends_file)
-            else:
-                print('"%s" [label="%s(%s) %s\\n%s"]' % (package, package, pn, version, fn), file=depends_file)
-            for depend in depgraph["depends"][pn]:
-                print('"%s" -> "%s"' % (package, depend), file=depends_file)
-        for package in depgraph["rdepends-pkg"]:
-            for rdepend in depgraph["rdepends-pkg"][package]:
-                print('"%s" -> "%s" [style=dashed]' % (package, rdepend), file=depends_file)
-        for package in depgraph["rrecs-pkg"]:
-            for rdepend in depgraph["rrecs-pkg"][package]:
-                print('"%s" -> "%s" [style=dashed]' % (package, rdepend), file=depends_file)
-        print("}", file=depends_file)
+        print("}", file=pkgdepends_file)
+        pkgdepends_file.close()
         logger.info("Package dependencies saved to 'package-depends.dot'")
-
-        tdepends_file = file('task-depends.dot', 'w' )
-        print("digraph depends {", file=tdepends_file)
-        for task in depgraph["tdepends"]:
-            (pn, taskname) = task.rsplit(".", 1)
-            fn = depgraph["pn"][pn]["filename"]
-            version = depgraph["pn"][pn]["version"]
-            print('"%s.%s" [label="%s %s\\n%s\\n%s"]' % (pn, taskname, pn, taskname, version, fn), file=tdepends_file)
-            for dep in depgraph["tdepends"][task]:
-                print('"%s" -> "%s"' % (task, dep), file=tdepends_file)
         print("}", file=tdepends_file)
+        tdepends_file.close()
         logger.info("Task dependencies saved to 'task-depends.dot'")
 
     def show_appends_with_no_recipes( self ):
@@ -1206,6 +1231,62 @@ class BBCooker:
 
         return True
 
+    def loadRecipeIndex(self, maxparse = 50):
+        """
+        Fill the recipe cache for read-only queries from the recipe cache
+        index instead of parsing. Only recipes, versions, build and runtime
+        providers, packages, inherits, appends and skipped recipes are
+        available afterwards, not the dependency or task data. Recipes whose
+        index entries are out of date are parsed here. Returns False, having
+        loaded nothing, if there is no index or more than maxparse recipes
+        would need parsing, in which case updateCache() is the better choice.
+        """
+        index = bb.cache.RecipeIndex(self.data, self.data_hash)
+        # Give up before the configuration and file collection work if the
+        # index can already tell it is too far out of date
+        if not index.entries or index.outdated(maxparse):
+            return False
+
+        self.parseConfiguration()
+        self.collection = CookerCollectFiles(self.recipecache.bbfile_config_priorities)
+        (filelist, masked) = self.collection.collect_bbfiles(self.data, self.event_data)
+
+        recipes = []
+        toparse = []
+        for filename in filelist:
+            appends = self.collection.get_file_appends(filename)
+            infos = index.valid(filename, appends)
+            if infos is None:
+                toparse.append((filename, appends))
+            else:
+                recipes.extend(infos)
+        if len(toparse) > maxparse:
+            return False
+
+        if toparse:
+            cfgdata = bb.data.createCopy(self.data)
+            cfgdata.renameVar("__depends", "__base_depends")
+            for filename, appends in toparse:
+                parselog.debug(1, "Parsing %s", filename)
+                try:
+                    infos = bb.cache.Cache.parse(filename, appends, cfgdata, self.caches_array)
+                except Exception:
+                    # Leave reporting the failure to a full parse
+                    return False
+                recipes.extend(index.add(filename, infos))
+            index.save()
+
+        for virtualfn, info in recipes:
+            if info.skipped:
+                self.skiplist[virtualfn] = SkippedPackage(info)
+            else:
+                info.add_cacheData(self.recipecache, virtualfn)
+
+        self.show_appends_with_no_recipes()
+        self.handlePrefProviders()
+        self.recipecache.bbfile_priority = self.collection.collection_priorities(self.recipecache.pkg_fn)
+        return True
+
     def checkPackages(self, pkgs_to_build):
 
         if len(pkgs_to_build) == 0:
@@ -1240,6 +1321,7 @@ class BBCooker:
         return
 
     def post_serve(self):
+        bb.providers.provider_cache_save(self.data)
         prserv.serv.auto_shutdown(self.data)
         bb.event.fire(CookerExit(), self.event_data)
 
@@ -1516,6 +1598,7 @@ class Parser(multiprocessing.Process):
                 if job is None:
                     break
                 result = self.parse(*job)
+                bb.codeparser.parser_cache_exchange(self.cfg)
 
             try:
                 self.results.put(result, timeout=0.25)
@@ -1583,7 +1666,9 @@ class CookerParser(object):
             def init():
                 Parser.cfg = self.cfgdata
                 multiprocessing.util.Finalize(None, bb.codeparser.parser_cache_save, args=(self.cfgdata,), exitpriority=1)
+                multiprocessing.util.Finalize(None, bb.parse.statement_cache_save, args=(self.cfgdata,), exitpriority=1)
                 multiprocessing.util.Finalize(None, bb.fetch.fetcher_parse_save, args=(self.cfgdata,), exitpriority=1)
+                multiprocessing.util.Finalize(None, bb.utils.codecache.log_stats, exitpriority=1)
 
             self.feeder_quit = multiprocessing.Queue(maxsize=1)
             self.parser_quit = multiprocessing.Queue(maxsize=self.num_processes)
@@ -1600,6 +1685,10 @@ class CookerParser(object):
 
     def shutdown(self, clean=True, force=False):
         if not self.toparse:
+            if clean:
+                # Nothing was parsed, but this still writes the recipe
+                # index if it is missing
+                self.bb_cache.sync()
             return
         if self.haveshutdown:
             return
@@ -1636,6 +1725,7 @@ class CookerParser(object):
         sync.start()
         multiprocessing.util.Finalize(None, sync.join, exitpriority=-100)
         bb.codeparser.parser_cache_savemerge(self.cooker.data)
+        bb.parse.statement_cache_savemerge(self.cooker.data)
         bb.fetch.fetcher_parse_done(self.cooker.data)
 
     def load_cached(self):
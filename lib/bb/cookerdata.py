@@ -25,13 +25,25 @@
 import os, sys
 from functools import wraps
 import logging
+import hashlib
 import bb
 from bb import data
 import bb.parse
+import bb.methodpool
+import bb.providers
 
 logger      = logging.getLogger("BitBake")
 parselog    = logging.getLogger("BitBake.Parsing")
 
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+    logger.info("Importing cPickle failed. "
+                "Falling back to a very slow implementation.")
+
+__snapshot_version__ = "3"
+
 class ConfigParameters(object):
     def __init__(self):
         self.options, targets = self.parseCommandLine()
@@ -201,6 +213,8 @@ class CookerDataBuilder(object):
         self.prefiles = cookercfg.prefile
         self.postfiles = cookercfg.postfile
         self.tracking = cookercfg.tracking
+        self.worker = worker
+        self.usesnapshot = True
 
         bb.utils.set_context(bb.utils.clean_context())
         bb.event.set_class_handlers(bb.event.clean_class_handlers())
@@ -218,6 +232,7 @@ class CookerDataBuilder(object):
 
         filtered_keys = bb.utils.approved_variables()
         bb.data.inheritFromOS(self.data, self.savedenv, filtered_keys)
+        self.filtered_env = sorted((k, cookercfg.env[k]) for k in filtered_keys if k in cookercfg.env)
         self.data.setVar("BB_ORIGENV", self.savedenv)
         
         if worker:
@@ -239,6 +254,107 @@ class CookerDataBuilder(object):
         data = self.data
         bb.parse.init_parser(data)
 
+        snapshot = None
+        loaded = None
+        if self.usesnapshot and not self.tracking and not bb.parse.ConfHandler.confFilters:
+            layerconf = self._findLayerConf(data)
+            snapshot = self._snapshotFile(layerconf)
+            key = self._snapshotKey(layerconf, prefiles, postfiles)
+            loaded = self._loadSnapshot(snapshot, key)
+
+        if loaded:
+            data, methods = loaded
+        else:
+            bb.methodpool.start_recording()
+            bb.parse.start_recording()
+            try:
+                data = self._parseConfigurationFiles(data, prefiles, postfiles)
+            finally:
+                methods = bb.methodpool.stop_recording()
+                recorded = bb.parse.stop_recording()
+            if snapshot and self._wantSnapshot(data):
+                self._saveSnapshot(snapshot, key, data, methods, recorded)
+            elif snapshot:
+                bb.utils.remove(snapshot)
+
+        self._finishConfiguration(data, methods)
+
+    def _finishConfiguration(self, data, methods):
+        # Keep the parsed files' result, as bitbake-worker would see it, apart
+        # from whatever the event handlers do with it
+        self.basedata = data
+        self.methods = methods
+        self.workerconfig = None
+        data = data.createCopy()
+
+        # Nomally we only register event handlers at the end of parsing .bb files
+        # We register any handlers we've found so far here...
+        for var in data.getVar('__BBHANDLERS') or []:
+            bb.event.register(var, data.getVar(var),  (data.getVarFlag(var, "eventmask", True) or "").split())
+
+        if data.getVar("BB_WORKERCONTEXT", False) is None:
+            bb.fetch.fetcher_init(data)
+        bb.codeparser.parser_cache_init(data)
+        bb.parse.statement_cache_init(data)
+        bb.providers.provider_cache_init(data)
+        bb.event.fire(bb.event.ConfigParsed(), data)
+
+        if data.getVar("BB_INVALIDCONF") is True:
+            data.setVar("BB_INVALIDCONF", False)
+            self.usesnapshot = False
+            self.parseConfigurationFiles(self.prefiles, self.postfiles)
+            return
+
+        bb.parse.init_parser(data)
+        data.setVar('BBINCLUDED',bb.parse.get_file_depends(data))
+        self.data = data
+        self.data_hash = data.get_hash()
+
+    def workerConfiguration(self):
+        """
+        Return the parsed configuration files' datastore and python methods
+        serialised for bitbake-worker, which loads them with
+        loadWorkerConfiguration() instead of parsing the files again
+        """
+        if self.workerconfig is None:
+            data = self.basedata.createFlatCopy()
+            self.workerconfig = pickle.dumps([data, self.methods], -1)
+        return self.workerconfig
+
+    def loadWorkerConfiguration(self, workerconfig):
+        data, methods = pickle.loads(workerconfig)
+        data.setVar("BB_WORKERCONTEXT", "1")
+        for method in methods:
+            bb.methodpool.insert_method(*method)
+        if self.tracking:
+            data.enableTracking()
+        bb.parse.init_parser(data)
+        try:
+            self._finishWorkerConfiguration(data)
+        except SyntaxError:
+            sys.exit(1)
+        except Exception:
+            logger.exception("Error parsing configuration files")
+            sys.exit(1)
+
+    def _finishWorkerConfiguration(self, data):
+        # The cooker has already dealt with BB_INVALIDCONF and owns the
+        # statement and provider caches, bitbake-worker only needs the
+        # handlers, the code parser cache for the tasks and the events.
+        # The datastore is private to this process, so no copy is taken and
+        # the configuration hash is not computed either.
+        for var in data.getVar('__BBHANDLERS') or []:
+            bb.event.register(var, data.getVar(var),  (data.getVarFlag(var, "eventmask", True) or "").split())
+
+        if data.getVar("BB_WORKERCONTEXT", False) is None:
+            bb.fetch.fetcher_init(data)
+        bb.codeparser.parser_cache_init(data)
+        bb.event.fire(bb.event.ConfigParsed(), data)
+
+        data.setVar('BBINCLUDED',bb.parse.get_file_depends(data))
+        self.data = data
+
+    def _parseConfigurationFiles(self, data, prefiles, postfiles):
         # Parse files for loading *before* bitbake.conf and any includes
         for f in prefiles:
             data = parse_config_file(f, data)
@@ -281,25 +397,144 @@ class CookerDataBuilder(object):
         for bbclass in bbclasses:
             data = _inherit(bbclass, data)
 
-        # Nomally we only register event handlers at the end of parsing .bb files
-        # We register any handlers we've found so far here...
-        for var in data.getVar('__BBHANDLERS') or []:
-            bb.event.register(var, data.getVar(var),  (data.getVarFlag(var, "eventmask", True) or "").split())
-
-        if data.getVar("BB_WORKERCONTEXT", False) is None:
-            bb.fetch.fetcher_init(data)
-        bb.codeparser.parser_cache_init(data)
-        bb.event.fire(bb.event.ConfigParsed(), data)
-
-        if data.getVar("BB_INVALIDCONF") is True:
-            data.setVar("BB_INVALIDCONF", False)
-            self.parseConfigurationFiles(self.prefiles, self.postfiles)
-            return
-
-        bb.parse.init_parser(data)
-        data.setVar('BBINCLUDED',bb.parse.get_file_depends(data))
-        self.data = data
-        self.data_hash = data.get_hash()
-
-
+        return data
+
+    # Snapshot of the parsed configuration
+    #
+    # The datastore as it stands after parsing the configuration files and
+    # INHERITs is saved to TOPDIR/cache together with the python methods the
+    # parse inserted into the global context. Later runs with the same
+    # command line options and filtered environment load it instead of
+    # parsing, provided every file the parse read is unchanged, none of the
+    # paths probed in vain for includes, inherits and BBPATH lookups has
+    # appeared, no directory holding those files and no conf/ or classes/
+    # directory on BBPATH has gained or lost entries and each file still
+    # resolves through BBPATH to the same place. Event handlers, the fetcher
+    # and ConfigParsed still run as normal on the loaded datastore.
+    #
+    # Anything python code computed while the files were parsed, through :=,
+    # ?=, INHERIT or an include of "${@...}" (such as DATE and TIME), keeps
+    # the value from when the snapshot was taken, so snapshots are only
+    # taken when the configuration sets BB_CONFIG_SNAPSHOT = "1".
+
+    def _wantSnapshot(self, data):
+        return data.getVar("BB_CONFIG_SNAPSHOT", True) == "1"
+
+    def _snapshotFile(self, layerconf):
+        if layerconf:
+            topdir = os.path.dirname(os.path.dirname(layerconf))
+        else:
+            topdir = os.getcwd()
+        name = "bb_config_snapshot.dat"
+        if self.worker:
+            name = "bb_config_snapshot_worker.dat"
+        return os.path.join(topdir, "cache", name)
+
+    def _snapshotKey(self, layerconf, prefiles, postfiles):
+        key = [bb.__version__, __snapshot_version__, sys.hexversion,
+               os.getcwd(), layerconf, list(prefiles), list(postfiles),
+               self.worker, self.filtered_env]
+        return hashlib.md5(repr(key)).hexdigest()
+
+    @staticmethod
+    def _mtime(path):
+        try:
+            return os.stat(path).st_mtime
+        except OSError:
+            return None
+
+    def _fileState(self, data, recorded):
+        """Record enough about the files parsed into data to notice changes"""
+        bbpath = data.getVar("BBPATH", True) or ""
+        searchpath = [p for p in bbpath.split(":") if p]
+
+        files = []
+        lookups = []
+        dirs = set()
+        for fn in bb.parse.get_file_depends(data).split():
+            st = os.stat(fn)
+            files.append((fn, st.st_mtime, st.st_size, bb.utils.md5_file(fn)))
+            dirs.add(os.path.dirname(fn))
+            for p in searchpath:
+                if fn.startswith(p.rstrip("/") + "/"):
+                    relfn = fn[len(p.rstrip("/")) + 1:]
+                    lookups.append((relfn, bb.utils.which(bbpath, relfn)))
+                    break
+
+        for p in searchpath:
+            dirs.update([os.path.join(p, "conf"), os.path.join(p, "classes")])
+        dirs = [(d, self._mtime(d)) for d in sorted(dirs)]
+
+        return bbpath, files, dirs, lookups, sorted(recorded.missing)
+
+    def _fileStateValid(self, state):
+        bbpath, files, dirs, lookups, missing = state
+        for fn in missing:
+            if os.path.exists(fn):
+                parselog.debug(1, "Configuration snapshot invalid, %s appeared", fn)
+                return False
+        for d, mtime in dirs:
+            if self._mtime(d) != mtime:
+                parselog.debug(1, "Configuration snapshot invalid, %s changed", d)
+                return False
+        for fn, mtime, size, md5 in files:
+            try:
+                st = os.stat(fn)
+            except OSError:
+                return False
+            if st.st_size != size:
+                parselog.debug(1, "Configuration snapshot invalid, %s changed", fn)
+                return False
+            if st.st_mtime != mtime and bb.utils.md5_file(fn) != md5:
+                parselog.debug(1, "Configuration snapshot invalid, %s changed", fn)
+                return False
+        for relfn, found in lookups:
+            if bb.utils.which(bbpath, relfn) != found:
+                parselog.debug(1, "Configuration snapshot invalid, %s now found elsewhere", relfn)
+                return False
+        return True
+
+    def _loadSnapshot(self, snapshot, key):
+        if not os.path.exists(snapshot):
+            return None
+        try:
+            with open(snapshot, "rb") as f:
+                p = pickle.Unpickler(f)
+                version, snapkey, state = p.load()
+                if version != __snapshot_version__ or snapkey != key:
+                    return None
+                if not self._fileStateValid(state):
+                    return None
+                data, methods = p.load()
+        except Exception as exc:
+            parselog.debug(1, "Unable to load configuration snapshot %s: %s", snapshot, exc)
+            return None
+
+        parselog.debug(1, "Using configuration snapshot %s", snapshot)
+        for method in methods:
+            bb.methodpool.insert_method(*method)
+
+        # The snapshot keeps the mtimes from when it was taken, files which
+        # were touched without changing are recorded with their current one
+        depends = data.getVar('__depends') or []
+        for i, (fn, mtime) in enumerate(depends):
+            depends[i] = (fn, bb.parse.cached_mtime_noerror(fn))
+        data.setVar('__depends', depends)
+
+        # The full environment isn't part of the key, use the current one
+        data.setVar("BB_ORIGENV", self.savedenv)
+        return data, methods
+
+    def _saveSnapshot(self, snapshot, key, data, methods, recorded):
+        try:
+            bb.utils.mkdirhier(os.path.dirname(snapshot))
+            state = self._fileState(data, recorded)
+            with open(snapshot + ".new", "wb") as f:
+                p = pickle.Pickler(f, -1)
+                p.dump([__snapshot_version__, key, state])
+                p.dump([data, methods])
+            os.rename(snapshot + ".new", snapshot)
+        except Exception as exc:
+            parselog.debug(1, "Unable to save configuration snapshot %s: %s", snapshot, exc)
+            bb.utils.remove(snapshot + ".new")
 
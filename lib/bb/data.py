@@ -43,7 +43,9 @@ if sys.argv[0][-5:] == "pydoc":
 else:
     path = os.path.dirname(os.path.dirname(sys.argv[0]))
 sys.path.insert(0, path)
+import weakref
 from itertools import groupby
+from StringIO import StringIO
 
 from bb import data_smart
 from bb import codeparser
@@ -259,12 +261,39 @@ def exported_vars(d):
         if value is not None:
             yield key, str(value)
 
-def emit_func(func, o=sys.__stdout__, d = init()):
-    """Emits all items in the data store in a format such that it can be sourced by a shell."""
+# (weak reference to the datastore, its revision, the text) for the last
+# datastore func_env() was asked about
+_func_env_cache = None
+
+def func_env(d):
+    """
+    Return the variables emit_func() emits ahead of the functions, as text.
+    The result is kept until the datastore is changed, so the shell
+    functions a task runs don't all expand the whole datastore again.
+    As with the datastore's own expansion cache, time-dependent ${@...}
+    values such as DATE and TIME are not evaluated again until then.
+    """
+    global _func_env_cache
+
+    revision = d.revision()
+    if _func_env_cache:
+        cached_d, cached_revision, text = _func_env_cache
+        if cached_d() is d and cached_revision == revision:
+            return text
 
+    o = StringIO()
     keys = (key for key in d.keys() if not key.startswith("__") and not d.getVarFlag(key, "func"))
     for key in keys:
         emit_var(key, o, d, False) and o.write('\n')
+    text = o.getvalue()
+
+    _func_env_cache = (weakref.ref(d), revision, text)
+    return text
+
+def emit_func(func, o=sys.__stdout__, d = init()):
+    """Emits all items in the data store in a format such that it can be sourced by a shell."""
+
+    o.write(func_env(d))
 
     emit_var(func, o, d, False) and o.write('\n')
     newdeps = bb.codeparser.ShellParser(func, logger).parse_shell(d.getVar(func, True))
@@ -28,7 +28,9 @@ BitBake build tools.
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 # Based on functions from the base bb module, Copyright 2003 Holger Schurig
 
-import copy, re, sys, traceback
+import copy, re, sys
+import bisect
+from array import array
 from collections import MutableMapping
 import logging
 import hashlib
@@ -55,30 +57,29 @@ def infer_caller_details(loginfo, parent = False, varval = True):
     # Infer caller's likely values for variable (var) and value (value), 
     # to reduce clutter in the rest of the code.
     if varval and ('variable' not in loginfo or 'detail' not in loginfo):
-        try:
-            raise Exception
-        except Exception:
-            tb = sys.exc_info()[2]
-            if parent:
-                above = tb.tb_frame.f_back.f_back
-            else:
-                above = tb.tb_frame.f_back
-            lcls = above.f_locals.items()
+        if parent:
+            above = sys._getframe(2)
+        else:
+            above = sys._getframe(1)
+        lcls = above.f_locals.items()
         for k, v in lcls:
             if k == 'value' and 'detail' not in loginfo:
                 loginfo['detail'] = v
             if k == 'var' and 'variable' not in loginfo:
                 loginfo['variable'] = v
-    # Infer file/line/function from traceback
+    # Infer file/line/function from the calling frame
     if 'file' not in loginfo:
-        depth = 3    
+        depth = 2
         if parent:
-            depth = 4
-        file, line, func, text = traceback.extract_stack(limit = depth)[0]
-        loginfo['file'] = file
-        loginfo['line'] = line
-        if func not in loginfo:
-            loginfo['func'] = func
+            depth = 3
+        frame = sys._getframe()
+        while depth and frame.f_back:
+            frame = frame.f_back
+            depth -= 1
+        loginfo['file'] = frame.f_code.co_filename
+        loginfo['line'] = frame.f_lineno
+        if 'func' not in loginfo:
+            loginfo['func'] = frame.f_code.co_name
 
 class VariableParse:
     def __init__(self, varname, d, val = None):
@@ -103,7 +104,7 @@ class VariableParse:
 
     def python_sub(self, match):
             code = match.group()[3:-1]
-            codeobj = compile(code.strip(), self.varname or "<expansion>", "eval")
+            codeobj = utils.codecache.compile(code.strip(), self.varname or "<expansion>", "eval")
 
             parser = bb.codeparser.PythonParser(self.varname, logger)
             parser.parse_python(code)
@@ -193,14 +194,116 @@ class IncludeHistory(object):
             o.write("\n")
             child.emit(o, level)
 
+class HistoryValues(object):
+    """
+    Table of the values referenced by a VariableHistory log, which maps
+    each value to a small integer id. A copy of a history gets a table on
+    top of its parent's table, seeing the parent's values up to the length
+    the parent had at the time and keeping the values it adds to itself,
+    so they go away with the copy. Values other than plain strings are
+    keyed by their type as well so 1, True and 1.0 (or 'x' and u'x') keep
+    their own entries.
+    """
+    def __init__(self, base = None):
+        self.base = base
+        # Id 0 is reserved for fields which were not supplied
+        if base is not None:
+            self.offset = len(base)
+        else:
+            self.offset = 1
+        self.values = []
+        self.ids = {}
+
+    def __len__(self):
+        return self.offset + len(self.values)
+
+    @staticmethod
+    def key(value):
+        if type(value) is str:
+            return value
+        return (type(value), value)
+
+    def find(self, key, limit = None):
+        table = self
+        while table is not None:
+            valueid = table.ids.get(key)
+            if valueid is not None and (limit is None or valueid < limit):
+                return valueid
+            limit = table.offset
+            table = table.base
+        return None
+
+    def lookup(self, value):
+        if value is None:
+            return 0
+        try:
+            return self.find(self.key(value))
+        except TypeError:
+            return None
+
+    def add(self, value):
+        if value is None:
+            return 0
+        if type(value) is str:
+            key = value
+        else:
+            key = (type(value), value)
+        valueid = self.offset + len(self.values)
+        try:
+            found = self.ids.get(key)
+            if found is None and self.base is not None:
+                found = self.base.find(key, self.offset)
+            if found is not None:
+                return found
+            self.ids[key] = valueid
+        except TypeError:
+            # Unhashable, store it without sharing
+            pass
+        self.values.append(value)
+        return valueid
+
+    def __getitem__(self, valueid):
+        if not valueid:
+            return None
+        table = self
+        while valueid < table.offset:
+            table = table.base
+        return table.values[valueid - table.offset]
+
 class VariableHistory(object):
+    """
+    Record of the operations made on each variable, kept only while
+    tracking is enabled.
+
+    Events are appended to parallel arrays of ids into a HistoryValues
+    table. A copy chains onto the log of the history it was copied from,
+    up to the length that log had at the time, and the event dicts are
+    only rebuilt when a variable's history is asked for.
+    """
+    fields = ('variable', 'op', 'file', 'line', 'func', 'flag', 'detail')
+
     def __init__(self, dataroot):
         self.dataroot = dataroot
-        self.variables = COWDictBase.copy()
+        self.values = HistoryValues()
+        self.parent = None
+        self.parentlen = 0
+        self.log = [array('I') for f in self.fields]
+        # Positions in our log of the events for each variable id, and the
+        # positions of the rows marking where the history of a variable id
+        # was cleared
+        self.index = {}
+        self.resets = {}
 
     def copy(self):
         new = VariableHistory(self.dataroot)
-        new.variables = self.variables.copy()
+        new.values = HistoryValues(self.values)
+        if len(self.log[0]) or self.resets:
+            new.parent = self
+            new.parentlen = len(self.log[0])
+        else:
+            # Nothing recorded at this level, chain straight to our parent
+            new.parent = self.parent
+            new.parentlen = self.parentlen
         return new
 
     def record(self, *kwonly, **loginfo):
@@ -217,17 +320,73 @@ class VariableHistory(object):
             loginfo['detail'] = str(loginfo['detail'])
         if 'variable' not in loginfo or 'file' not in loginfo:
             raise ValueError("record() missing variable or file.")
-        var = loginfo['variable']
 
-        if var not in self.variables:
-            self.variables[var] = []
-        self.variables[var].append(loginfo.copy())
+        valueid = self.values.add
+        get = loginfo.get
+        log = self.log
+        pos = len(log[0])
+        varid = valueid(loginfo['variable'])
+        log[0].append(varid)
+        log[1].append(valueid(loginfo['op']))
+        log[2].append(valueid(loginfo['file']))
+        log[3].append(valueid(get('line')))
+        log[4].append(valueid(get('func')))
+        log[5].append(valueid(get('flag')))
+        log[6].append(valueid(get('detail')))
+
+        if varid not in self.index:
+            self.index[varid] = array('I')
+        self.index[varid].append(pos)
+
+    def _event(self, pos):
+        log = self.log
+        values = self.values
+        event = {
+            'variable': values[log[0][pos]],
+            'op': values[log[1][pos]],
+            'file': values[log[2][pos]],
+            'line': values[log[3][pos]],
+        }
+        for i, field in ((4, 'func'), (5, 'flag'), (6, 'detail')):
+            valueid = log[i][pos]
+            if valueid:
+                event[field] = values[valueid]
+        return event
 
     def variable(self, var):
-        if var in self.variables:
-            return self.variables[var]
-        else:
-            return []
+        chunks = []
+        history = self
+        limit = len(self.log[0])
+        while history is not None:
+            # Each level has its own table so may know var by another id
+            varid = history.values.lookup(var)
+            if varid is None:
+                limit = history.parentlen
+                history = history.parent
+                continue
+            start = 0
+            reset = None
+            resets = history.resets.get(varid)
+            if resets:
+                i = bisect.bisect_left(resets, limit)
+                if i:
+                    reset = resets[i - 1]
+            positions = history.index.get(varid)
+            if positions:
+                if reset is not None:
+                    start = bisect.bisect_left(positions, reset)
+                end = bisect.bisect_left(positions, limit)
+                chunks.append((history, positions[start:end]))
+            if reset is not None:
+                break
+            limit = history.parentlen
+            history = history.parent
+
+        events = []
+        for history, positions in reversed(chunks):
+            for pos in positions:
+                events.append(history._event(pos))
+        return events
 
     def emit(self, var, oval, val, o):
         history = self.variable(var)
@@ -278,8 +437,127 @@ class VariableHistory(object):
         return lines
 
     def del_var_history(self, var):
-        if var in self.variables:
-            self.variables[var] = []
+        varid = self.values.add(var)
+        # The reset takes a row of its own so that it sorts strictly
+        # before the length of the log any later copy chains onto
+        pos = len(self.log[0])
+        for column in self.log:
+            column.append(0)
+        if varid not in self.resets:
+            self.resets[varid] = array('I')
+        self.resets[varid].append(pos)
+
+class DataLayer(object):
+    """
+    The key bookkeeping for one layer of a createCopy() chain: the layer's
+    own variable dict, the layer it was copied from and counters bumped
+    whenever the layer changes. A copy holds on to its parent's layer
+    rather than to the parent DataSmart, so a short-lived datastore's
+    history and caches can go away while its copies are still in use.
+
+    Each layer only caches its local delta, the keys it adds and the keys
+    it deletes (empty entries, which delVar leaves as tombstones), and the
+    visible keys are merged from the deltas of the chain when asked for.
+    """
+    def __init__(self, vardict, parent = None):
+        self.dict = vardict
+        self.parent = parent
+        # Bumped whenever our local set of keys may have changed
+        self.generation = 0
+        # Bumped on every change to a variable or flag, see revision()
+        self.revision = 0
+        self.deltacache = None
+        self.lencache = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['deltacache'] = None
+        state['lencache'] = None
+        return state
+
+    def delta(self):
+        cache = self.deltacache
+        if cache and cache[0] == self.generation:
+            return cache[1], cache[2]
+
+        added = set()
+        removed = set()
+        for key, value in self.dict.iteritems():
+            if key == "_data":
+                continue
+            if value:
+                added.add(key)
+            else:
+                removed.add(key)
+
+        added = frozenset(added)
+        removed = frozenset(removed)
+        self.deltacache = (self.generation, added, removed)
+        return added, removed
+
+    def stamp(self):
+        stamp = []
+        layer = self
+        while layer is not None:
+            stamp.append(layer.generation)
+            layer = layer.parent
+        return tuple(stamp)
+
+    def __contains__(self, key):
+        layer = self
+        while layer is not None:
+            added, removed = layer.delta()
+            if key in added:
+                return True
+            if key in removed:
+                return False
+            layer = layer.parent
+        return False
+
+    def __iter__(self):
+        # Take the deltas up front so that changes made while iterating
+        # don't show up half way through
+        deltas = []
+        layer = self
+        while layer is not None:
+            deltas.append(layer.delta())
+            layer = layer.parent
+
+        hidden = set()
+        last = len(deltas) - 1
+        for i, (added, removed) in enumerate(deltas):
+            if not hidden:
+                for key in added:
+                    yield key
+            else:
+                for key in added:
+                    if key not in hidden:
+                        yield key
+            if i != last:
+                hidden.update(added)
+                hidden.update(removed)
+
+    def __len__(self):
+        stamp = self.stamp()
+        cache = self.lencache
+        if cache and cache[0] == stamp:
+            return cache[1]
+
+        added, removed = self.delta()
+        parent = self.parent
+        if parent is None:
+            length = len(added)
+        else:
+            length = len(parent)
+            for key in added:
+                if key not in parent:
+                    length += 1
+            for key in removed:
+                if key in parent:
+                    length -= 1
+
+        self.lencache = (stamp, length)
+        return length
 
 class DataSmart(MutableMapping):
     def __init__(self, special = COWDictBase.copy(), seen = COWDictBase.copy() ):
@@ -295,6 +573,15 @@ class DataSmart(MutableMapping):
 
         self.expand_cache = {}
 
+        # Key index and change counters, shared with our copies
+        self._layer = DataLayer(self.dict)
+
+    def __getstate__(self):
+        # The caches are cheap to rebuild and can hold a lot
+        state = self.__dict__.copy()
+        state['expand_cache'] = {}
+        return state
+
     def enableTracking(self):
         self._tracking = True
 
@@ -340,10 +627,14 @@ class DataSmart(MutableMapping):
         """Performs final steps upon the datastore, including application of overrides"""
 
         overrides = (self.getVar("OVERRIDES", True) or "").split(":") or []
-        finalize_caller = {
-            'op': 'finalize',
-        }
-        infer_caller_details(finalize_caller, parent = parent, varval = False)
+        overridesset = set(overrides)
+
+        # Only pay for inspecting the stack if history is being recorded
+        if self._tracking:
+            finalize_caller = {
+                'op': 'finalize',
+            }
+            infer_caller_details(finalize_caller, parent = parent, varval = False)
 
         #
         # Well let us see what breaks here. We used to iterate
@@ -376,38 +667,45 @@ class DataSmart(MutableMapping):
             for var in vars:
                 name = var[:-l]
                 try:
-                    # Report only once, even if multiple changes.
-                    if name not in finalizes_reported:
-                        finalizes_reported[name] = True
-                        finalize_caller['variable'] = name
-                        finalize_caller['detail'] = 'was: ' + str(self.getVar(name, False))
-                        self.varhistory.record(**finalize_caller)
-                    # Copy history of the override over.
-                    for event in self.varhistory.variable(var):
-                        loginfo = event.copy()
-                        loginfo['variable'] = name
-                        loginfo['op'] = 'override[%s]:%s' % (o, loginfo['op'])
-                        self.varhistory.record(**loginfo)
+                    if self._tracking:
+                        # Report only once, even if multiple changes.
+                        if name not in finalizes_reported:
+                            finalizes_reported[name] = True
+                            finalize_caller['variable'] = name
+                            finalize_caller['detail'] = 'was: ' + str(self.getVar(name, False))
+                            self.varhistory.record(**finalize_caller)
+                        # Copy history of the override over.
+                        for event in self.varhistory.variable(var):
+                            loginfo = event.copy()
+                            loginfo['variable'] = name
+                            loginfo['op'] = 'override[%s]:%s' % (o, loginfo['op'])
+                            self.varhistory.record(**loginfo)
                     self.setVar(name, self.getVar(var, False), op = 'finalize', file = 'override[%s]' % o, line = '')
                     self.delVar(var)
                 except Exception:
                     logger.info("Untracked delVar")
 
+        # Index of whether each conditional override string applies, which
+        # is the case when all of its components are in OVERRIDES. The same
+        # few override strings are shared by most appends.
+        applies = {}
+
         # now on to the appends and prepends, and stashing the removes
         for op in __setvar_keyword__:
             if op in self._special_values:
                 appends = self._special_values[op] or []
                 for append in appends:
                     keep = []
+                    applied = False
                     for (a, o) in self.getVarFlag(append, op) or []:
-                        match = True
                         if o:
-                            for o2 in o.split("_"):
-                                if not o2 in overrides:
-                                    match = False
-                        if not match:
-                            keep.append((a ,o))
-                            continue
+                            if o not in applies:
+                                applies[o] = overridesset.issuperset(o.split("_"))
+                            if not applies[o]:
+                                keep.append((a ,o))
+                                continue
+
+                        applied = True
 
                         if op == "_append":
                             sval = self.getVar(append, False) or ""
@@ -421,6 +719,10 @@ class DataSmart(MutableMapping):
                             removes.extend(a.split())
                             self.setVarFlag(append, "_removeactive", removes, ignore=True)
 
+                    # Nothing applied so the stored list is already correct
+                    if not applied:
+                        continue
+
                     # We save overrides that may be applied at some later stage
                     if keep:
                         self.setVarFlag(append, op, keep, ignore=True)
@@ -430,6 +732,8 @@ class DataSmart(MutableMapping):
     def initVar(self, var):
         self.expand_cache = {}
         if not var in self.dict:
+            self._layer.generation += 1
+            self._layer.revision += 1
             self.dict[var] = {}
 
     def _findVar(self, var):
@@ -449,6 +753,7 @@ class DataSmart(MutableMapping):
         local_var = self._findVar(var)
 
         if local_var:
+            self._layer.generation += 1
             self.dict[var] = copy.copy(local_var)
         else:
             self.initVar(var)
@@ -493,6 +798,9 @@ class DataSmart(MutableMapping):
             self._setvar_update_overrides(var)
 
         # setting var
+        if not self.dict[var]:
+            self._layer.generation += 1
+        self._layer.revision += 1
         self.dict[var]["_content"] = value
         self.varhistory.record(**loginfo)
 
@@ -560,6 +868,8 @@ class DataSmart(MutableMapping):
         loginfo['op'] = 'del'
         self.varhistory.record(**loginfo)
         self.expand_cache = {}
+        self._layer.generation += 1
+        self._layer.revision += 1
         self.dict[var] = {}
         if '_' in var:
             override = var[var.rfind('_')+1:]
@@ -573,6 +883,9 @@ class DataSmart(MutableMapping):
         self.varhistory.record(**loginfo)
         if not var in self.dict:
             self._makeShadowCopy(var)
+        if not self.dict[var]:
+            self._layer.generation += 1
+        self._layer.revision += 1
         self.dict[var][flag] = value
 
         if flag == "defaultval" and '_' in var:
@@ -608,6 +921,9 @@ class DataSmart(MutableMapping):
             self.varhistory.record(**loginfo)
 
             del self.dict[var][flag]
+            self._layer.revision += 1
+            if not self.dict[var]:
+                self._layer.generation += 1
 
     def appendVarFlag(self, var, flag, value, **loginfo):
         loginfo['op'] = 'append'
@@ -624,7 +940,8 @@ class DataSmart(MutableMapping):
         self.setVarFlag(var, flag, newvalue, ignore=True)
 
     def setVarFlags(self, var, flags, **loginfo):
-        infer_caller_details(loginfo)
+        if self._tracking:
+            infer_caller_details(loginfo)
         if not var in self.dict:
             self._makeShadowCopy(var)
 
@@ -634,6 +951,9 @@ class DataSmart(MutableMapping):
             loginfo['flag'] = i
             loginfo['detail'] = flags[i]
             self.varhistory.record(**loginfo)
+            if not self.dict[var]:
+                self._layer.generation += 1
+            self._layer.revision += 1
             self.dict[var][i] = flags[i]
 
     def getVarFlags(self, var):
@@ -660,6 +980,8 @@ class DataSmart(MutableMapping):
 
             loginfo['op'] = 'delete flags'
             self.varhistory.record(**loginfo)
+            self._layer.generation += 1
+            self._layer.revision += 1
 
             # try to save the content
             if "_content" in self.dict[var]:
@@ -677,14 +999,41 @@ class DataSmart(MutableMapping):
         # we really want this to be a DataSmart...
         data = DataSmart(seen=self._seen_overrides.copy(), special=self._special_values.copy())
         data.dict["_data"] = self.dict
+        data._layer.parent = self._layer
         data.varhistory = self.varhistory.copy()
-        data.varhistory.datasmart = data
+        data.varhistory.dataroot = data
         data.inchistory = self.inchistory.copy()
 
         data._tracking = self._tracking
 
         return data
 
+    def createFlatCopy(self):
+        """
+        Create a copy of self which doesn't share anything with the
+        datastores it was copied from, with their variables merged into
+        a single dictionary and no history. Meant for sending to another
+        process, where the layers and history would only add to the size
+        """
+        data = DataSmart(seen=self._seen_overrides.copy(), special=self._special_values.copy())
+        for key in self:
+            data.dict[key] = copy.copy(self._findVar(key))
+        return data
+
+    def revision(self):
+        """
+        Return a value which changes whenever a variable or flag visible
+        in this datastore may have changed, including in the datastores
+        it was copied from. Only comparable between calls on the same
+        datastore.
+        """
+        revision = []
+        layer = self._layer
+        while layer is not None:
+            revision.append(layer.revision)
+            layer = layer.parent
+        return tuple(revision)
+
     def expandVarref(self, variable, parents=False):
         """Find all references to variable in the data and expand it
            in place, optionally descending to parent datastores."""
@@ -707,25 +1056,10 @@ class DataSmart(MutableMapping):
                 yield key
 
     def __iter__(self):
-        def keylist(d):        
-            klist = set()
-            for key in d:
-                if key == "_data":
-                    continue
-                if not d[key]:
-                    continue
-                klist.add(key)
-
-            if "_data" in d:
-                klist |= keylist(d["_data"])
-
-            return klist
-
-        for k in keylist(self.dict):
-             yield k
+        return iter(self._layer)
 
     def __len__(self):
-        return len(frozenset(self))
+        return len(self._layer)
 
     def __getitem__(self, item):
         value = self.getVar(item, False)
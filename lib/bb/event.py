@@ -483,6 +483,16 @@ class DepTreeGenerated(Event):
         Event.__init__(self)
         self._depgraph = depgraph
 
+class DepTreeItems(Event):
+    """
+    Event carrying the next batch of records of a dependency tree being
+    generated, see BBCooker.generateTaskDepTreeItems()
+    """
+
+    def __init__(self, items):
+        Event.__init__(self)
+        self._items = items
+
 class TargetsTreeGenerated(Event):
     """
     Event when a set of buildable targets has been generated
@@ -17,13 +17,38 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
+import marshal
 from bb.utils import better_compile, better_exec
 
-def insert_method(modulename, code, fn):
+_recorded = None
+
+def insert_method(modulename, code, fn, compiled = None):
     """
     Add code of a module should be added. The methods
-    will be simply added, no checking will be done
+    will be simply added, no checking will be done.
+    compiled is the code as returned by marshal from
+    an earlier recording, and saves compiling it again
     """
-    comp = better_compile(code, modulename, fn )
+    if compiled is not None:
+        comp = marshal.loads(compiled)
+    else:
+        comp = better_compile(code, modulename, fn )
     better_exec(comp, None, code, fn)
+    if _recorded is not None:
+        _recorded.append((modulename, code, fn, marshal.dumps(comp)))
+
+def start_recording():
+    """
+    Keep a list of the methods inserted from now on so they can be
+    replayed into another process of the same python version with
+    insert_method()
+    """
+    global _recorded
+    _recorded = []
+
+def stop_recording():
+    global _recorded
+    recorded = _recorded
+    _recorded = None
+    return recorded
 
@@ -17,7 +17,7 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
-import os, logging, re, sys
+import os, logging, re, sys, time, threading
 import bb
 logger = logging.getLogger("BitBake.Monitor")
 
@@ -170,6 +170,98 @@ def getInterval(configuration):
             printErr("Invalid interval value in BB_DISKMON_WARNINTERVAL: %s" % interval)
             return None, None
 
+def getPeriod(configuration):
+
+    """ Get the number of seconds between two disk space samples """
+
+    period = configuration.getVar("BB_DISKMON_PERIOD", True)
+    if not period:
+        return 1.0
+    try:
+        period = float(period)
+    except ValueError:
+        period = 0
+    if period <= 0:
+        printErr("Invalid sampling period in BB_DISKMON_PERIOD: %s" % configuration.getVar("BB_DISKMON_PERIOD", True))
+        return None
+    return period
+
+class diskSampler:
+
+    """
+    Sample the free space and inodes of a set of directories from a
+    background thread, once every period seconds. Directories on the same
+    device are only sampled once. reading() returns the latest sample for
+    a directory along with the rate its free space and inodes are being
+    used up at, so a slow statvfs (e.g. on a network filesystem) never
+    holds up the caller.
+    """
+
+    # Weight of the newest sample in the smoothed consumption rates
+    smoothing = 0.3
+
+    def __init__(self, paths, period):
+        self.period = period
+        self.devices = {}
+        self.pathDev = {}
+        for path in paths:
+            dev = os.stat(path).st_dev
+            self.devices.setdefault(dev, path)
+            self.pathDev[path] = dev
+        self.samples = {}
+        self.rates = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.sample()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def sample(self):
+        for dev, path in self.devices.items():
+            try:
+                st = os.statvfs(path)
+            except OSError:
+                continue
+            now = time.time()
+            with self.lock:
+                if dev in self.samples:
+                    prevTime, prev = self.samples[dev]
+                    if now > prevTime:
+                        elapsed = now - prevTime
+                        spaceRate = (prev.f_bavail * prev.f_frsize - st.f_bavail * st.f_frsize) / elapsed
+                        inodeRate = (prev.f_favail - st.f_favail) / elapsed
+                        if dev in self.rates:
+                            oldSpace, oldInode = self.rates[dev]
+                            spaceRate = oldSpace + self.smoothing * (spaceRate - oldSpace)
+                            inodeRate = oldInode + self.smoothing * (inodeRate - oldInode)
+                        self.rates[dev] = (spaceRate, inodeRate)
+                self.samples[dev] = (now, st)
+
+    def _run(self):
+        while not self.stopped.wait(self.period):
+            self.sample()
+
+    def reading(self, path):
+
+        """
+        Return the latest statvfs result for path and the rates, per
+        second, its free space and free inodes are going down at, or None
+        if statvfs has not succeeded for it yet
+        """
+
+        dev = self.pathDev[path]
+        with self.lock:
+            if dev not in self.samples:
+                return None
+            st = self.samples[dev][1]
+            spaceRate, inodeRate = self.rates.get(dev, (0, 0))
+        return st, spaceRate, inodeRate
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
 class diskMonitor:
 
     """Prepare the disk space monitor data"""
@@ -178,13 +270,16 @@ class diskMonitor:
 
         self.enableMonitor = False
         self.configuration = configuration
+        self.sampler = None
+        self.nextCheck = 0
 
         BBDirs = configuration.getVar("BB_DISKMON_DIRS", True) or None
         if BBDirs:
             self.devDict = getDiskData(BBDirs, configuration)
             if self.devDict:
                 self.spaceInterval, self.inodeInterval = getInterval(configuration)
-                if self.spaceInterval and self.inodeInterval:
+                self.period = getPeriod(configuration)
+                if self.spaceInterval and self.inodeInterval and self.period:
                     self.enableMonitor = True
                     # These are for saving the previous disk free space and inode, we
                     # use them to avoid print too many warning messages
@@ -193,18 +288,35 @@ class diskMonitor:
                     # This is for STOPTASKS and ABORT, to avoid print the message repeatly
                     # during waiting the tasks to finish
                     self.checked = {}
+                    # These are for the warnings given when the free space or
+                    # inodes are being used up fast enough to reach the limit soon
+                    self.trendWarnedS = {}
+                    self.trendWarnedI = {}
                     for k in self.devDict:
                         self.preFreeS[k] = 0
                         self.preFreeI[k] = 0
                         self.checked[k] = False
+                        self.trendWarnedS[k] = False
+                        self.trendWarnedI[k] = False
                     if self.spaceInterval is None and self.inodeInterval is None:
                         self.enableMonitor = False
 
+    # Warn when the free space or inodes will reach their limit within this
+    # many seconds at the current rate of consumption
+    trendHorizon = 300
+
     def check(self, rq):
 
-        """ Take action for the monitor """
+        """ Take action for the monitor, at most once every sampling period """
 
         if self.enableMonitor:
+            now = time.time()
+            if now < self.nextCheck:
+                return
+            self.nextCheck = now + self.period
+            if not self.sampler:
+                self.sampler = diskSampler(set(os.path.dirname(k) for k in self.devDict), self.period)
+
             for k in self.devDict:
                 path = os.path.dirname(k)
                 action = os.path.basename(k)
@@ -212,11 +324,20 @@ class diskMonitor:
                 minSpace = self.devDict[k][1]
                 minInode = self.devDict[k][2]
 
-                st = os.statvfs(path)
+                reading = self.sampler.reading(path)
+                if reading is None:
+                    continue
+                st, spaceRate, inodeRate = reading
 
                 # The free space, float point number
                 freeSpace = st.f_bavail * st.f_frsize
 
+                if minSpace and freeSpace >= minSpace and not self.trendWarnedS[k]:
+                    if spaceRate > 0 and (freeSpace - minSpace) / spaceRate < self.trendHorizon:
+                        logger.warn("The free space of %s (%s) is going down by %.1fMB/s, %.3fGB are left before the monitor takes action" % \
+                                (path, dev, spaceRate / 1024 / 1024, (freeSpace - minSpace) / 1024 / 1024 / 1024.0))
+                        self.trendWarnedS[k] = True
+
                 if minSpace and freeSpace < minSpace:
                     # Always show warning, the self.checked would always be False if the action is WARN
                     if self.preFreeS[k] == 0 or self.preFreeS[k] - freeSpace > self.spaceInterval and not self.checked[k]:
@@ -238,6 +359,12 @@ class diskMonitor:
                 # The free inodes, float point number
                 freeInode = st.f_favail
 
+                if minInode and freeInode >= minInode and not self.trendWarnedI[k] and st.f_files:
+                    if inodeRate > 0 and (freeInode - minInode) / inodeRate < self.trendHorizon:
+                        logger.warn("The free inodes of %s (%s) are going down by %.1fK/s, %.3fK are left before the monitor takes action" % \
+                                (path, dev, inodeRate / 1024.0, (freeInode - minInode) / 1024.0))
+                        self.trendWarnedI[k] = True
+
                 if minInode and freeInode < minInode:
                     # Some fs formats' (e.g., btrfs) statvfs.f_files (inodes) is
                     # zero, this is a feature of the fs, we disable the inode
@@ -263,3 +390,12 @@ class diskMonitor:
                         rq.finish_runqueue(True)
                         bb.event.fire(bb.event.DiskFull(dev, 'inode', freeInode, path), self.configuration)
         return
+
+    def stop(self):
+
+        """ Stop sampling, check() starts again if it is called later """
+
+        if self.sampler:
+            self.sampler.stop()
+            self.sampler = None
+            self.nextCheck = 0
@@ -32,6 +32,7 @@ import logging
 import bb
 import bb.utils
 import bb.siggen
+from bb.cache import MultiProcessCache
 
 logger = logging.getLogger("BitBake.Parsing")
 
@@ -76,6 +77,92 @@ def mark_dependency(d, f):
     deps = (d.getVar('__depends') or []) + [(f, cached_mtime(f))]
     d.setVar('__depends', deps)
 
+class ParseRecorder(object):
+    """
+    What a parse depended on besides the files it read: the paths looked
+    at for includes, inherits and BBPATH lookups which did not exist
+    """
+    def __init__(self):
+        self.missing = set()
+
+_recorder = None
+
+def start_recording():
+    global _recorder
+    _recorder = ParseRecorder()
+
+def stop_recording():
+    global _recorder
+    recorder = _recorder
+    _recorder = None
+    return recorder
+
+def mark_missing(paths):
+    if _recorder is not None:
+        _recorder.missing.update(os.path.abspath(p) for p in paths)
+
+def mark_lookup(found, hist):
+    """Note the paths a bb.utils.which(..., history=True) looked at in vain"""
+    if found:
+        hist = hist[:-1]
+    mark_missing(hist)
+
+class StatementCache(MultiProcessCache):
+    """
+    Persistent cache of the statements parsed from each metadata file,
+    keyed by absolute filename and checked against the file's mtime and
+    size, so only changed files are read and tokenised again. The same file
+    may be reached by different relative names, the statements returned
+    carry the name they were asked for.
+
+    Each file's statements are kept serialised on their own, loading the
+    cache is then cheap and only the files actually parsed are restored.
+    """
+    cache_file_name = "bb_statements.dat"
+    CACHE_VERSION = 2
+
+    def get(self, fn, absfn):
+        entry = self.cachedata_extras[0].get(absfn) or self.cachedata[0].get(absfn)
+        if not entry:
+            return None
+        (mtime, size, dumped) = entry
+        try:
+            st = os.stat(absfn)
+        except OSError:
+            return None
+        if st.st_mtime != mtime or st.st_size != size:
+            logger.debug(2, "%s changed, parsing it again", absfn)
+            return None
+        return bb.parse.ast.StatementGroup.loads(dumped, fn)
+
+    def add(self, fn, absfn, st, statements):
+        if not self.cachefile:
+            return
+        dumped = statements.dumps()
+        self.cachedata_extras[0][absfn] = (st.st_mtime, st.st_size, dumped)
+
+    def merge_data(self, source, dest):
+        for h in source[0]:
+            if h not in dest[0] or source[0][h][0] >= dest[0][h][0]:
+                dest[0][h] = source[0][h]
+
+    def compress_keys(self, data):
+        # Forget files which have been removed
+        for h in data[0].keys():
+            if not os.path.exists(h):
+                del data[0][h]
+
+statementcache = StatementCache()
+
+def statement_cache_init(d):
+    statementcache.init_cache(d)
+
+def statement_cache_save(d):
+    statementcache.save_extras(d)
+
+def statement_cache_savemerge(d):
+    statementcache.save_merge(d)
+
 def supports(fn, data):
     """Returns true if we have a handler for this file, false otherwise"""
     for h in handlers:
@@ -102,12 +189,14 @@ def init_parser(d):
 def resolve_file(fn, d):
     if not os.path.isabs(fn):
         bbpath = d.getVar("BBPATH", True)
-        newfn = bb.utils.which(bbpath, fn)
+        newfn, hist = bb.utils.which(bbpath, fn, history=True)
+        mark_lookup(newfn, hist)
         if not newfn:
             raise IOError("file %s not found in %s" % (fn, bbpath))
         fn = newfn
 
     if not os.path.isfile(fn):
+        mark_missing([fn])
         raise IOError("file %s not found" % fn)
 
     logger.debug(2, "LOAD %s", fn)
@@ -23,8 +23,10 @@
 
 from __future__ import absolute_import
 from future_builtins import filter
+import os
 import re
 import string
+import marshal
 import logging
 import bb
 import itertools
@@ -38,6 +40,34 @@ class StatementGroup(list):
         for statement in self:
             statement.eval(data)
 
+    def dumps(self):
+        """
+        Serialise the statements for the statement cache. The nodes only
+        hold plain values, so marshal does this much faster than pickle
+        """
+        return marshal.dumps([(type(s).__name__, s.__dict__) for s in self])
+
+    @classmethod
+    def loads(cls, dumped, filename):
+        """
+        Restore statements serialised by dumps() as if they had been parsed
+        from filename, which is what includes are resolved against and what
+        anonymous functions, python method modules and EXPORT_FUNCTIONS
+        class names are named after
+        """
+        base_name = os.path.basename(filename)
+        statements = cls()
+        for name, state in marshal.loads(dumped):
+            statement = object.__new__(globals()[name])
+            state['filename'] = filename
+            if name == "PythonMethodNode":
+                state['modulename'] = base_name
+            elif name == "ExportFuncsNode" and state['classname']:
+                state['classname'] = os.path.splitext(base_name)[0]
+            statement.__dict__ = state
+            statements.append(statement)
+        return statements
+
 class AstNode(object):
     def __init__(self, filename, lineno):
         self.filename = filename
@@ -79,7 +109,9 @@ class DataNode(AstNode):
     """
     def __init__(self, filename, lineno, groupd):
         AstNode.__init__(self, filename, lineno)
-        self.groupd = groupd
+        # Most of the groups are None, leaving them out keeps the
+        # statements smaller in memory and in the statement cache
+        self.groupd = dict((k, v) for k, v in groupd.iteritems() if v is not None)
 
     def getFunc(self, key, data):
         if 'flag' in self.groupd and self.groupd['flag'] != None:
@@ -127,7 +159,7 @@ class DataNode(AstNode):
         flag = None
         if 'flag' in groupd and groupd['flag'] != None:
             flag = groupd['flag']
-        elif groupd["lazyques"]:
+        elif groupd.get("lazyques"):
             flag = "defaultval"
 
         loginfo['op'] = op
@@ -179,7 +211,8 @@ class MethodFlagsNode(AstNode):
     def __init__(self, filename, lineno, key, m):
         AstNode.__init__(self, filename, lineno)
         self.key = key
-        self.m = m
+        self.python = m.group("py")
+        self.fakeroot = m.group("fr")
 
     def eval(self, data):
         if data.getVar(self.key):
@@ -187,11 +220,11 @@ class MethodFlagsNode(AstNode):
             # flags could cause problems
             data.setVarFlag(self.key, 'python', None)
             data.setVarFlag(self.key, 'fakeroot', None)
-        if self.m.group("py") is not None:
+        if self.python is not None:
             data.setVarFlag(self.key, "python", "1")
         else:
             data.delVarFlag(self.key, "python")
-        if self.m.group("fr") is not None:
+        if self.fakeroot is not None:
             data.setVarFlag(self.key, "fakeroot", "1")
         else:
             data.delVarFlag(self.key, "fakeroot")
@@ -280,10 +313,10 @@ class InheritNode(AstNode):
         bb.parse.BBHandler.inherit(self.classes, self.filename, self.lineno, data)
 
 def handleInclude(statements, filename, lineno, m, force):
-    statements.append(IncludeNode(filename, lineno, m.group(1), force))
+    statements.append(IncludeNode(filename, lineno, m.group("incfile"), force))
 
 def handleExport(statements, filename, lineno, m):
-    statements.append(ExportNode(filename, lineno, m.group(1)))
+    statements.append(ExportNode(filename, lineno, m.group("expvar")))
 
 def handleData(statements, filename, lineno, groupd):
     statements.append(DataNode(filename, lineno, groupd))
@@ -77,7 +77,8 @@ def inherit(files, fn, lineno, d):
         if not os.path.isabs(file):
             dname = os.path.dirname(fn)
             bbpath = "%s:%s" % (dname, d.getVar("BBPATH", True))
-            abs_fn = bb.utils.which(bbpath, file)
+            abs_fn, hist = bb.utils.which(bbpath, file, history=True)
+            bb.parse.mark_lookup(abs_fn, hist)
             if abs_fn:
                 file = abs_fn
 
@@ -94,6 +95,13 @@ def get_statements(filename, absolute_filename, base_name):
     try:
         return cached_statements[absolute_filename]
     except KeyError:
+        statements = bb.parse.statementcache.get(filename, absolute_filename)
+        if statements is not None:
+            if filename.endswith(".bbclass") or filename.endswith(".inc"):
+                cached_statements[absolute_filename] = statements
+            return statements
+
+        st = os.stat(absolute_filename)
         file = open(absolute_filename, 'r')
         statements = ast.StatementGroup()
 
@@ -109,6 +117,7 @@ def get_statements(filename, absolute_filename, base_name):
             # add a blank line to close out any python definition
             feeder(IN_PYTHON_EOF, "", filename, base_name, statements)
 
+        bb.parse.statementcache.add(filename, absolute_filename, st, statements)
         if filename.endswith(".bbclass") or filename.endswith(".inc"):
             cached_statements[absolute_filename] = statements
         return statements
@@ -29,8 +29,10 @@ import logging
 import bb.utils
 from bb.parse import ParseError, resolve_file, ast, logger
 
-__config_regexp__  = re.compile( r"""
-    ^
+# All the statements a configuration file can hold, tried in this order
+# by a single match
+__statement_regexp__ = re.compile( r"""
+    ^ (?:
     (?P<exp>export\s*)?
     (?P<var>[a-zA-Z0-9\-~_+.${}/]+?)
     (\[(?P<flag>[a-zA-Z0-9\-_+.]+)\])?
@@ -52,10 +54,12 @@ __config_regexp__  = re.compile( r"""
     (?P<value>.*)
     (?P=apo)
     $
+    |
+    (?P<include>include|require) \s+ (?P<incfile>.+)
+    |
+    export \s+ (?P<expvar>[a-zA-Z0-9\-_+.${}/]+) $
+    )
     """, re.X)
-__include_regexp__ = re.compile( r"include\s+(.+)" )
-__require_regexp__ = re.compile( r"require\s+(.+)" )
-__export_regexp__ = re.compile( r"export\s+([a-zA-Z0-9\-_+.${}/]+)$" )
 
 def init(data):
     topdir = data.getVar('TOPDIR')
@@ -82,7 +86,8 @@ def include(oldfn, fn, lineno, data, error_out):
     if not os.path.isabs(fn):
         dname = os.path.dirname(oldfn)
         bbpath = "%s:%s" % (dname, data.getVar("BBPATH", True))
-        abs_fn = bb.utils.which(bbpath, fn)
+        abs_fn, hist = bb.utils.which(bbpath, fn, history=True)
+        bb.parse.mark_lookup(abs_fn, hist)
         if abs_fn:
             fn = abs_fn
 
@@ -102,20 +107,8 @@ def include(oldfn, fn, lineno, data, error_out):
 # parsing. This turns out to be a hard problem to solve any other way.
 confFilters = []
 
-def handle(fn, data, include):
-    init(data)
-
-    if include == 0:
-        oldfile = None
-    else:
-        oldfile = data.getVar('FILE')
-
-    abs_fn = resolve_file(fn, data)
-    f = open(abs_fn, 'r')
-
-    if include:
-        bb.parse.mark_dependency(data, abs_fn)
-
+def get_statements(filename, absolute_filename):
+    f = open(absolute_filename, 'r')
     statements = ast.StatementGroup()
     lineno = 0
     while True:
@@ -132,12 +125,28 @@ def handle(fn, data, include):
             s2 = f.readline().strip()
             lineno = lineno + 1
             if (not s2 or s2 and s2[0] != "#") and s[0] == "#" :
-                bb.fatal("There is a confusing multiline, partially commented expression on line %s of file %s (%s).\nPlease clarify whether this is all a comment or should be parsed." % (lineno, fn, s))
+                bb.fatal("There is a confusing multiline, partially commented expression on line %s of file %s (%s).\nPlease clarify whether this is all a comment or should be parsed." % (lineno, filename, s))
             s = s[:-1] + s2
         # skip comments
         if s[0] == '#':
             continue
-        feeder(lineno, s, fn, statements)
+        feeder(lineno, s, filename, statements)
+    f.close()
+    return statements
+
+def handle(fn, data, include):
+    init(data)
+
+    if include == 0:
+        oldfile = None
+    else:
+        oldfile = data.getVar('FILE')
+
+    abs_fn = resolve_file(fn, data)
+    statements = get_statements(fn, abs_fn)
+
+    if include:
+        bb.parse.mark_dependency(data, abs_fn)
 
     # DONE WITH PARSING... time to evaluate
     data.setVar('FILE', abs_fn)
@@ -145,33 +154,20 @@ def handle(fn, data, include):
     if oldfile:
         data.setVar('FILE', oldfile)
 
-    f.close()
-
     for f in confFilters:
         f(fn, data)
 
     return data
 
 def feeder(lineno, s, fn, statements):
-    m = __config_regexp__.match(s)
-    if m:
-        groupd = m.groupdict()
-        ast.handleData(statements, fn, lineno, groupd)
-        return
-
-    m = __include_regexp__.match(s)
-    if m:
-        ast.handleInclude(statements, fn, lineno, m, False)
-        return
-
-    m = __require_regexp__.match(s)
-    if m:
-        ast.handleInclude(statements, fn, lineno, m, True)
-        return
-
-    m = __export_regexp__.match(s)
+    m = __statement_regexp__.match(s)
     if m:
-        ast.handleExport(statements, fn, lineno, m)
+        if m.group("var") is not None:
+            ast.handleData(statements, fn, lineno, m.groupdict())
+        elif m.group("include") is not None:
+            ast.handleInclude(statements, fn, lineno, m, m.group("include") == "require")
+        else:
+            ast.handleExport(statements, fn, lineno, m)
         return
 
     raise ParseError("unparsed line: '%s'" % s, fn, lineno);
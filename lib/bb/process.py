@@ -1,8 +1,10 @@
 import logging
+import os
 import signal
 import subprocess
 import errno
 import select
+import collections
 
 logger = logging.getLogger('BitBake.Process')
 
@@ -64,53 +66,116 @@ class Popen(subprocess.Popen):
         options.update(kwargs)
         subprocess.Popen.__init__(self, *args, **options)
 
-def _logged_communicate(pipe, log, input):
+class OutputBuffer(object):
+    """
+    Collects the output of a command, keeping only its last limit bytes
+    when limit is set
+    """
+    def __init__(self, limit=None):
+        self.limit = limit
+        self.chunks = collections.deque()
+        self.size = 0
+
+    def append(self, data):
+        self.chunks.append(data)
+        self.size += len(data)
+        if self.limit is not None:
+            while self.size - len(self.chunks[0]) >= self.limit:
+                self.size -= len(self.chunks.popleft())
+
+    def getvalue(self):
+        data = ''.join(self.chunks)
+        if self.limit is not None:
+            data = data[-self.limit:]
+        return data
+
+def _log_writer(log, direct):
+    """
+    Return a function writing to log. With direct set, a log backed by a
+    file descriptor is written to directly, bypassing its buffering
+    """
+    if direct:
+        try:
+            fd = log.fileno()
+        except (AttributeError, IOError, ValueError):
+            pass
+        else:
+            log.flush()
+            def write(data):
+                while data:
+                    written = os.write(fd, data)
+                    data = data[written:]
+            return write
+    return log.write
+
+def _read_available(fd, buf, write, drain=False):
+    """
+    Read a chunk from fd, or everything up to the point it would block
+    when drain is set, returning False at end of file
+    """
+    while True:
+        try:
+            data = os.read(fd, 65536)
+        except OSError as e:
+            if e.errno in (errno.EAGAIN, errno.EINTR):
+                return True
+            raise
+        if not data:
+            return False
+        buf.append(data)
+        write(data)
+        if not drain:
+            return True
+
+def _logged_communicate(pipe, log, input, tail=None):
     if pipe.stdin:
         if input is not None:
             pipe.stdin.write(input)
         pipe.stdin.close()
 
-    outdata, errdata = [], []
-    rin = []
+    outdata, errdata = OutputBuffer(tail), OutputBuffer(tail)
+    write = _log_writer(log, tail is not None)
+    rin = {}
 
     if pipe.stdout is not None:
         bb.utils.nonblockingfd(pipe.stdout.fileno())
-        rin.append(pipe.stdout)
+        rin[pipe.stdout.fileno()] = outdata
     if pipe.stderr is not None:
         bb.utils.nonblockingfd(pipe.stderr.fileno())
-        rin.append(pipe.stderr)
+        rin[pipe.stderr.fileno()] = errdata
 
     try:
-        while pipe.poll() is None:
-            rlist = rin
+        while rin and pipe.poll() is None:
             try:
-                r,w,e = select.select (rlist, [], [])
-            except OSError as e:
-                if e.errno != errno.EINTR:
+                r,w,e = select.select (rin.keys(), [], [])
+            except select.error as e:
+                if e.args[0] != errno.EINTR:
                     raise
+                continue
+
+            for fd in r:
+                if not _read_available(fd, rin[fd], write):
+                    del rin[fd]
 
-            if pipe.stdout in r:
-                data = pipe.stdout.read()
-                if data is not None:
-                    outdata.append(data)
-                    log.write(data)
-
-            if pipe.stderr in r:
-                data = pipe.stderr.read()
-                if data is not None:
-                    errdata.append(data)
-                    log.write(data)
-    finally:    
+        # Pick up whatever was written just before the command exited
+        for fd in rin:
+            _read_available(fd, rin[fd], write, True)
+    finally:
         log.flush()
     if pipe.stdout is not None:
         pipe.stdout.close()
     if pipe.stderr is not None:
         pipe.stderr.close()
-    return ''.join(outdata), ''.join(errdata)
+    pipe.wait()
+    return outdata.getvalue(), errdata.getvalue()
 
-def run(cmd, input=None, log=None, **options):
+def run(cmd, input=None, log=None, tail=None, **options):
     """Convenience function to run a command and return its output, raising an
-    exception when the command fails"""
+    exception when the command fails.
+
+    When the output is logged and tail is set, it is streamed to the log
+    and only its last tail bytes are kept, for the return value and for
+    the exception"""
 
     if isinstance(cmd, basestring) and not "shell" in options:
         options["shell"] = True
@@ -124,7 +189,7 @@ def run(cmd, input=None, log=None, **options):
             raise CmdError(cmd, exc)
 
     if log:
-        stdout, stderr = _logged_communicate(pipe, log, input)
+        stdout, stderr = _logged_communicate(pipe, log, input, tail)
     else:
         stdout, stderr = pipe.communicate(input)
 
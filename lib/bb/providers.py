@@ -22,9 +22,14 @@
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
 import re
+import bisect
 import logging
+import hashlib
 from bb import data, utils
+from bb.cache import MultiProcessCache
 from collections import defaultdict
+from itertools import groupby
+from operator import itemgetter
 import bb
 
 logger = logging.getLogger("BitBake.Provider")
@@ -38,6 +43,112 @@ class NoRProvider(bb.BBHandledException):
 class MultipleRProvider(bb.BBHandledException):
     """Exception raised when multiple providers of a runtime dependency can be found"""
 
+class PreferredVersionCache(MultiProcessCache):
+    """
+    Remembers the PREFERRED_VERSION which applies to each PN. Finding it
+    means copying the datastore and applying the PN's overrides, which is
+    the bulk of the cost of resolving providers. The answer only depends on
+    the PREFERRED_* variables, the variables they reference and OVERRIDES,
+    so entries are keyed on a hash of those and kept on disk between runs.
+
+    The hash is taken from the cooker's configuration, which
+    provider_cache_init() is given, and only computed again once that has
+    changed. Without a configuration nothing is cached.
+    """
+    cache_file_name = "bb_providers.dat"
+    CACHE_VERSION = 2
+
+    def __init__(self):
+        MultiProcessCache.__init__(self)
+        self.data = None
+        self.revision = None
+        self.confighash = None
+
+    def set_config(self, d):
+        self.data = d
+        self.revision = None
+
+    def config_hash(self, d):
+        """
+        Hash the PREFERRED_* variables and every variable they reference,
+        directly or not. With OVERRIDES extended by pn-<pn> and <pn> any
+        override of those variables may apply to some PN, so the raw values
+        of all their override variants (VAR_<override>) are included too.
+        """
+        keys = sorted(d.keys())
+        state = {}
+        pending = [key for key in keys if key.startswith("PREFERRED_")]
+        while pending:
+            var = pending.pop()
+            if var in state:
+                continue
+            value = d.getVar(var, False)
+            flags = [d.getVarFlag(var, flag) for flag in ("_append", "_prepend", "_remove")]
+            state[var] = "%r\0%r" % (value, flags)
+
+            prefix = var + "_"
+            i = bisect.bisect_left(keys, prefix)
+            while i < len(keys) and keys[i].startswith(prefix):
+                pending.append(keys[i])
+                i += 1
+
+            values = [value]
+            for entries in flags:
+                values.extend(entry[0] for entry in entries or [])
+            for value in values:
+                if isinstance(value, basestring):
+                    pending.extend(d.expandWithRefs(value, var).references)
+
+        h = hashlib.md5()
+        h.update(d.getVar('OVERRIDES', True) or "")
+        for var in sorted(state):
+            h.update("\0%s\0%s" % (var, state[var]))
+            if var.startswith("PREFERRED_"):
+                h.update("\0%r" % d.getVar(var, True))
+        return h.hexdigest()
+
+    def get(self, pn, cfgData):
+        if self.data is None:
+            return self.lookup(pn, cfgData)
+
+        revision = self.data.revision()
+        if revision != self.revision:
+            self.revision = revision
+            self.confighash = self.config_hash(self.data)
+
+        key = (self.confighash, pn)
+        for cache in (self.cachedata[0], self.cachedata_extras[0]):
+            if key in cache:
+                return cache[key]
+
+        preferred_v = self.lookup(pn, cfgData)
+        self.cachedata_extras[0][key] = preferred_v
+        return preferred_v
+
+    def lookup(self, pn, cfgData):
+        localdata = data.createCopy(cfgData)
+        localdata.setVar('OVERRIDES', "%s:pn-%s:%s" % (data.getVar('OVERRIDES', localdata), pn, pn))
+        bb.data.update_data(localdata)
+        return localdata.getVar('PREFERRED_VERSION', True)
+
+    def compress_keys(self, data):
+        # Only the current configuration's entries are worth keeping
+        if self.confighash is None:
+            return
+        for key in data[0].keys():
+            if key[0] != self.confighash:
+                del data[0][key]
+
+preferred_version_cache = PreferredVersionCache()
+
+def provider_cache_init(d):
+    preferred_version_cache.init_cache(d)
+    preferred_version_cache.set_config(d)
+
+def provider_cache_save(d):
+    preferred_version_cache.exchange_extras(d)
+    preferred_version_cache.save_merge(d)
+
 def findProviders(cfgData, dataCache, pkg_pn = None):
     """
     Convenience function to get latest and preferred providers in pkg_pn
@@ -82,21 +193,17 @@ def sortPriorities(pn, dataCache, pkg_pn = None):
         pkg_pn = dataCache.pkg_pn
 
     files = pkg_pn[pn]
-    priorities = {}
-    for f in files:
-        priority = dataCache.bbfile_priority[f]
-        preference = dataCache.pkg_dp[f]
-        if priority not in priorities:
-            priorities[priority] = {}
-        if preference not in priorities[priority]:
-            priorities[priority][preference] = []
-        priorities[priority][preference].append(f)
+    if len(files) == 1:
+        return [list(files)]
+
+    # Highest file priority first, then lowest default preference, keeping
+    # the original order of files within each group
+    priority = dataCache.bbfile_priority
+    preference = dataCache.pkg_dp
+    files = sorted([(-priority[f], preference[f], i, f) for (i, f) in enumerate(files)])
     tmp_pn = []
-    for pri in sorted(priorities):
-        tmp_pref = []
-        for pref in sorted(priorities[pri]):
-            tmp_pref.extend(priorities[pri][pref])
-        tmp_pn = [tmp_pref] + tmp_pn
+    for _, group in groupby(files, itemgetter(0)):
+        tmp_pn.append([f for (_, _, _, f) in group])
 
     return tmp_pn
 
@@ -121,11 +228,7 @@ def findPreferredProvider(pn, cfgData, dataCache, pkg_pn = None, item = None):
     preferred_file = None
     preferred_ver = None
 
-    localdata = data.createCopy(cfgData)
-    localdata.setVar('OVERRIDES', "%s:pn-%s:%s" % (data.getVar('OVERRIDES', localdata), pn, pn))
-    bb.data.update_data(localdata)
-
-    preferred_v = localdata.getVar('PREFERRED_VERSION', True)
+    preferred_v = preferred_version_cache.get(pn, cfgData)
     if preferred_v:
         m = re.match('(\d+:)*(.*)(_.*)*', preferred_v)
         if m:
@@ -185,19 +288,16 @@ def findLatestProvider(pn, cfgData, dataCache, file_set):
     Return the highest version of the providers in file_set.
     Take default preferences into account.
     """
-    latest = None
-    latest_p = 0
-    latest_f = None
-    for file_name in file_set:
-        pe, pv, pr = dataCache.pkg_pepvpr[file_name]
-        dp = dataCache.pkg_dp[file_name]
-
-        if (latest is None) or ((latest_p == dp) and (utils.vercmp(latest, (pe, pv, pr)) < 0)) or (dp > latest_p):
-            latest = (pe, pv, pr)
-            latest_f = file_name
-            latest_p = dp
-
-    return (latest, latest_f)
+    if not file_set:
+        return (None, None)
+    if len(file_set) == 1:
+        latest_f = file_set[0]
+    else:
+        # The first of the files with the highest default preference and
+        # then the highest version
+        latest_f = max([(dataCache.pkg_dp[f], utils.vercmp_key(dataCache.pkg_pepvpr[f]), -i, f) for (i, f) in enumerate(file_set)])[-1]
+
+    return (dataCache.pkg_pepvpr[latest_f], latest_f)
 
 
 def findBestProvider(pn, cfgData, dataCache, pkg_pn = None, item = None):
@@ -28,8 +28,10 @@ import sys
 import signal
 import stat
 import fcntl
+import time
 import errno
 import logging
+from array import array
 import bb
 from bb import msg, data, event
 from bb import monitordisk
@@ -74,6 +76,122 @@ class RunQueueStats:
     def taskActive(self):
         self.active = self.active + 1
 
+class TaskSets(object):
+    """
+    An immutable list of sets of task IDs, packed into two arrays the way
+    a compressed sparse row matrix is. This takes a few bytes per entry
+    instead of a set object per task. Indexing returns the row as a
+    frozenset; rowlen(), iterrow() and rowissubset() work on the row without
+    building one.
+    """
+    def __init__(self, sets):
+        self.offsets = array('i', [0])
+        self.values = array('i')
+        for entries in sets:
+            self.values.extend(sorted(entries))
+            self.offsets.append(len(self.values))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, task):
+        if task < 0:
+            task += len(self)
+        return frozenset(self.values[self.offsets[task]:self.offsets[task + 1]])
+
+    def __iter__(self):
+        for task in xrange(len(self)):
+            yield self[task]
+
+    def rowlen(self, task):
+        return self.offsets[task + 1] - self.offsets[task]
+
+    def iterrow(self, task):
+        values = self.values
+        for i in xrange(self.offsets[task], self.offsets[task + 1]):
+            yield values[i]
+
+    def rowissubset(self, task, other):
+        values = self.values
+        for i in xrange(self.offsets[task], self.offsets[task + 1]):
+            if values[i] not in other:
+                return False
+        return True
+
+def iterbits(bits):
+    """
+    Yield the positions of the set bits in an integer bitset, lowest first
+    """
+    s = bin(bits)[:1:-1]
+    i = s.find('1')
+    while i != -1:
+        yield i
+        i = s.find('1', i + 1)
+
+def reachable_sets(roots, successors, label):
+    """
+    For each node in roots, return the union (an integer bitset) of label(n)
+    over every node n reachable from it through successors(), itself included.
+
+    Strongly connected components are collapsed with Tarjan's algorithm, so
+    each component's set is computed once, from its members' labels and the
+    already finished sets of the components it points at, instead of walking
+    the graph again for every root. Cycles are therefore harmless here.
+    """
+    index = {}
+    lowlink = {}
+    onstack = set()
+    stack = []
+    component = {}
+    compbits = []
+
+    for root in roots:
+        if root in index:
+            continue
+        index[root] = lowlink[root] = len(index)
+        stack.append(root)
+        onstack.add(root)
+        work = [(root, iter(successors(root)))]
+        while work:
+            node, succs = work[-1]
+            for succ in succs:
+                if succ not in index:
+                    index[succ] = lowlink[succ] = len(index)
+                    stack.append(succ)
+                    onstack.add(succ)
+                    work.append((succ, iter(successors(succ))))
+                    break
+                elif succ in onstack and index[succ] < lowlink[node]:
+                    lowlink[node] = index[succ]
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    if lowlink[node] < lowlink[parent]:
+                        lowlink[parent] = lowlink[node]
+                if lowlink[node] != index[node]:
+                    continue
+                # node is the root of a component; everything its members
+                # point at outside of it has already been finished
+                comp = len(compbits)
+                members = []
+                while True:
+                    member = stack.pop()
+                    onstack.discard(member)
+                    component[member] = comp
+                    members.append(member)
+                    if member == node:
+                        break
+                bits = 0
+                for member in members:
+                    bits |= label(member)
+                    for succ in successors(member):
+                        if component[succ] != comp:
+                            bits |= compbits[component[succ]]
+                compbits.append(bits)
+
+    return dict((root, compbits[component[root]]) for root in roots)
+
 # These values indicate the next step due to be run in the
 # runQueue state machine
 runQueuePrepare = 2
@@ -141,16 +259,8 @@ class RunQueueSchedulerSpeed(RunQueueScheduler):
         self.rq = runqueue
         self.rqdata = rqdata
 
-        sortweight = sorted(copy.deepcopy(self.rqdata.runq_weight))
-        copyweight = copy.deepcopy(self.rqdata.runq_weight)
-        self.prio_map = []
-
-        for weight in sortweight:
-            idx = copyweight.index(weight)
-            self.prio_map.append(idx)
-            copyweight[idx] = -1
-
-        self.prio_map.reverse()
+        weight = self.rqdata.runq_weight
+        self.prio_map = sorted(xrange(len(weight)), key=lambda task: (weight[task], task), reverse=True)
 
 class RunQueueSchedulerCompletion(RunQueueSchedulerSpeed):
     """
@@ -168,21 +278,15 @@ class RunQueueSchedulerCompletion(RunQueueSchedulerSpeed):
         #FIXME - whilst this groups all fnids together it does not reorder the
         #fnid groups optimally.
 
-        basemap = copy.deepcopy(self.prio_map)
-        self.prio_map = []
-        while (len(basemap) > 0):
-            entry = basemap.pop(0)
-            self.prio_map.append(entry)
+        fnid_tasks = {}
+        fnid_order = []
+        for entry in self.prio_map:
             fnid = self.rqdata.runq_fnid[entry]
-            todel = []
-            for entry in basemap:
-                entry_fnid = self.rqdata.runq_fnid[entry]
-                if entry_fnid == fnid:
-                    todel.append(basemap.index(entry))
-                    self.prio_map.append(entry)
-            todel.reverse()
-            for idx in todel:
-                del basemap[idx]
+            if fnid not in fnid_tasks:
+                fnid_tasks[fnid] = []
+                fnid_order.append(fnid)
+            fnid_tasks[fnid].append(entry)
+        self.prio_map = [entry for fnid in fnid_order for entry in fnid_tasks[fnid]]
 
 class RunQueueData:
     """
@@ -332,7 +436,7 @@ class RunQueueData:
         for listid in xrange(numTasks):
             task_done.append(False)
             weight.append(0)
-            deps_left.append(len(self.runq_revdeps[listid]))
+            deps_left.append(self.runq_revdeps.rowlen(listid))
 
         for listid in endpoints:
             weight[listid] = 1
@@ -341,7 +445,7 @@ class RunQueueData:
         while True:
             next_points = []
             for listid in endpoints:
-                for revdep in self.runq_depends[listid]:
+                for revdep in self.runq_depends.iterrow(listid):
                     weight[revdep] = weight[revdep] + weight[listid]
                     deps_left[revdep] = deps_left[revdep] - 1
                     if deps_left[revdep] == 0:
@@ -524,28 +628,44 @@ class RunQueueData:
         # e.g. do_sometask[recrdeptask] = "do_someothertask"
         # (makes sure sometask runs after someothertask of all DEPENDS, RDEPENDS and intertask dependencies, recursively)
         # We need to do this separately since we need all of self.runq_depends to be complete before this is processed
+        #
+        # A task picks up the named tasks of every recipe it can reach, where
+        # reaching a recipe also means reaching the dependencies of its named
+        # tasks. Rather than walking the graph from each recursive task, the
+        # reachable recipes are computed once per set of task names as bitsets
+        # of fnids (see reachable_sets()).
         extradeps = {}
+        groups = {}
         for task in recursivetasks:
-            extradeps[task] = set(self.runq_depends[task])
-            tasknames = recursivetasks[task]
-            seendeps = set()
-            seenfnid = []
-
-            def generate_recdeps(t):
-                newdeps = set()
-                add_resolved_dependencies([taskData.tasks_fnid[t]], tasknames, newdeps)
-                extradeps[task].update(newdeps)
-                seendeps.add(t)
-                newdeps.add(t)
-                for i in newdeps:
-                    for n in self.runq_depends[i]:
-                        if n not in seendeps:
-                            generate_recdeps(n)
-            generate_recdeps(task)
-
-            if task in recursiveitasks:
-                for dep in recursiveitasks[task]:
-                    generate_recdeps(dep)
+            groups.setdefault(tuple(recursivetasks[task]), []).append(task)
+
+        for tasknames, tasks in groups.iteritems():
+            namedtasks = {}
+            def fnid_tasks(fnid):
+                if fnid not in namedtasks:
+                    namedtasks[fnid] = set()
+                    add_resolved_dependencies([fnid], tasknames, namedtasks[fnid])
+                return namedtasks[fnid]
+
+            def successors(t):
+                return list(self.runq_depends[t]) + list(fnid_tasks(taskData.tasks_fnid[t]))
+
+            def label(t):
+                return 1 << taskData.tasks_fnid[t]
+
+            roots = list(tasks)
+            for task in tasks:
+                roots.extend(dep for dep in recursiveitasks.get(task, []) if dep is not None)
+            reachable = reachable_sets(roots, successors, label)
+
+            for task in tasks:
+                fnids = reachable[task]
+                for dep in recursiveitasks.get(task, []):
+                    if dep is not None:
+                        fnids |= reachable[dep]
+                extradeps[task] = set(self.runq_depends[task])
+                for fnid in iterbits(fnids):
+                    extradeps[task].update(fnid_tasks(fnid))
 
         # Remove circular references so that do_a[recrdeptask] = "do_a do_b" can work
         for task in recursivetasks:
@@ -618,19 +738,19 @@ class RunQueueData:
         # Once all active tasks are marked, prune the ones we don't need.
 
         maps = []
-        delcount = 0
+        keep = []
         for listid in xrange(len(self.runq_fnid)):
-            if runq_build[listid-delcount] == 1:
-                maps.append(listid-delcount)
+            if runq_build[listid] == 1:
+                maps.append(len(keep))
+                keep.append(listid)
             else:
-                del self.runq_fnid[listid-delcount]
-                del self.runq_task[listid-delcount]
-                del self.runq_depends[listid-delcount]
-                del runq_build[listid-delcount]
-                del self.runq_revdeps[listid-delcount]
-                del self.runq_hash[listid-delcount]
-                delcount = delcount + 1
                 maps.append(-1)
+        delcount = len(self.runq_fnid) - len(keep)
+        self.runq_fnid = [self.runq_fnid[listid] for listid in keep]
+        self.runq_task = [self.runq_task[listid] for listid in keep]
+        self.runq_depends = [self.runq_depends[listid] for listid in keep]
+        self.runq_revdeps = [self.runq_revdeps[listid] for listid in keep]
+        self.runq_hash = [self.runq_hash[listid] for listid in keep]
 
         #
         # Step D - Sanity checks and computation
@@ -663,15 +783,22 @@ class RunQueueData:
             for dep in self.runq_depends[listid]:
                 self.runq_revdeps[dep].add(listid)
 
+        # The graph is complete, pack it
+        self.runq_fnid = array('i', self.runq_fnid)
+        self.runq_task = [intern(taskname) for taskname in self.runq_task]
+        self.runq_depends = TaskSets(self.runq_depends)
+        self.runq_revdeps = TaskSets(self.runq_revdeps)
+
         # Identify tasks at the end of dependency chains
         # Error on circular dependency loops (length two)
         endpoints = []
         for listid in xrange(len(self.runq_fnid)):
             revdeps = self.runq_revdeps[listid]
+            depends = self.runq_depends[listid]
             if len(revdeps) == 0:
                 endpoints.append(listid)
             for dep in revdeps:
-                if dep in self.runq_depends[listid]:
+                if dep in depends:
                     #self.dump_data(taskData)
                     bb.msg.fatal("RunQueue", "Task %s (%s) has circular dependency on %s (%s)" % (taskData.fn_index[self.runq_fnid[dep]], self.runq_task[dep], taskData.fn_index[self.runq_fnid[listid]], self.runq_task[listid]))
 
@@ -683,12 +810,12 @@ class RunQueueData:
 
         # Sanity Check - Check for multiple tasks building the same provider
         prov_list = {}
-        seen_fn = []
+        seen_fn = set()
         for task in xrange(len(self.runq_fnid)):
             fn = taskData.fn_index[self.runq_fnid[task]]
             if fn in seen_fn:
                 continue
-            seen_fn.append(fn)
+            seen_fn.add(fn)
             for prov in self.dataCache.fn_provides[fn]:
                 if prov not in prov_list:
                     prov_list[prov] = [fn]
@@ -716,7 +843,7 @@ class RunQueueData:
         self.stampfnwhitelist = stampfnwhitelist
 
         # Iterate over the task list looking for tasks with a 'setscene' function
-        self.runq_setscene = []
+        self.runq_setscene = bb.taskdata.IdTable()
         if not self.cooker.configuration.nosetscene:
             for task in range(len(self.runq_fnid)):
                 setscene = taskData.gettask_id(self.taskData.fn_index[self.runq_fnid[task]], self.runq_task[task] + "_setscene", False)
@@ -749,18 +876,20 @@ class RunQueueData:
                 for st in self.cooker.configuration.invalidate_stamp.split(','):
                     invalidate_task(fn, "do_%s" % st, True)
 
-        # Interate over the task list and call into the siggen code
-        dealtwith = set()
-        todeal = set(range(len(self.runq_fnid)))
-        while len(todeal) > 0:
-            for task in todeal.copy():
-                if len(self.runq_depends[task] - dealtwith) == 0:
-                    dealtwith.add(task)
-                    todeal.remove(task)
-                    procdep = []
-                    for dep in self.runq_depends[task]:
-                        procdep.append(self.taskData.fn_index[self.runq_fnid[dep]] + "." + self.runq_task[dep])
-                    self.runq_hash[task] = bb.parse.siggen.get_taskhash(self.taskData.fn_index[self.runq_fnid[task]], self.runq_task[task], procdep, self.dataCache)
+        # Interate over the task list in dependency order and call into the
+        # siggen code
+        deps_left = [self.runq_depends.rowlen(task) for task in xrange(len(self.runq_fnid))]
+        todeal = [task for task in xrange(len(self.runq_fnid)) if deps_left[task] == 0]
+        while todeal:
+            task = todeal.pop()
+            procdep = []
+            for dep in self.runq_depends.iterrow(task):
+                procdep.append(self.taskData.fn_index[self.runq_fnid[dep]] + "." + self.runq_task[dep])
+            self.runq_hash[task] = bb.parse.siggen.get_taskhash(self.taskData.fn_index[self.runq_fnid[task]], self.runq_task[task], procdep, self.dataCache)
+            for revdep in self.runq_revdeps.iterrow(task):
+                deps_left[revdep] -= 1
+                if deps_left[revdep] == 0:
+                    todeal.append(revdep)
 
         self.hashes = {}
         self.hash_deps = {}
@@ -769,7 +898,7 @@ class RunQueueData:
                                     self.runq_task[task])
             self.hashes[identifier] = self.runq_hash[task]
             deps = []
-            for dep in self.runq_depends[task]:
+            for dep in self.runq_depends.iterrow(task):
                 depidentifier = '%s.%s' % (self.taskData.fn_index[self.runq_fnid[dep]],
                                            self.runq_task[dep])
                 deps.append(depidentifier)
@@ -855,6 +984,7 @@ class RunQueue:
         }
 
         worker.stdin.write("<cookerconfig>" + pickle.dumps(self.cooker.configuration) + "</cookerconfig>")
+        worker.stdin.write("<cookerdata>" + self.cooker.databuilder.workerConfiguration() + "</cookerdata>")
         worker.stdin.write("<workerdata>" + pickle.dumps(workerdata) + "</workerdata>")
         worker.stdin.flush()
 
@@ -944,7 +1074,7 @@ class RunQueue:
 
         iscurrent = True
         t1 = get_timestamp(stampfile)
-        for dep in self.rqdata.runq_depends[task]:
+        for dep in self.rqdata.runq_depends.iterrow(task):
             if iscurrent:
                 fn2 = self.rqdata.taskData.fn_index[self.rqdata.runq_fnid[dep]]
                 taskname2 = self.rqdata.runq_task[dep]
@@ -1011,16 +1141,25 @@ class RunQueue:
             retval = self.rqexe.execute()
 
         if self.state is runQueueCleanUp:
-           self.rqexe.finish()
+            retval = self.rqexe.finish()
 
         if self.state is runQueueComplete or self.state is runQueueFailed:
             self.teardown_workers()
+            self.dm.stop()
+            if self.rqexe.dispatched:
+                logger.debug(1, "Task dispatch latency after task exit: average %.1fms, maximum %.1fms over %d tasks",
+                             self.rqexe.dispatchtime * 1000 / self.rqexe.dispatched, self.rqexe.dispatchmax * 1000, self.rqexe.dispatched)
             if self.rqexe.stats.failed:
                 logger.info("Tasks Summary: Attempted %d tasks of which %d didn't need to be rerun and %d failed.", self.rqexe.stats.completed + self.rqexe.stats.failed, self.rqexe.stats.skipped, self.rqexe.stats.failed)
             else:
                 # Let's avoid the word "failed" if nothing actually did
                 logger.info("Tasks Summary: Attempted %d tasks of which %d didn't need to be rerun and all succeeded.", self.rqexe.stats.completed, self.rqexe.stats.skipped)
 
+            # Task processes only ever append to the signature data index
+            sigindex = bb.siggen.sigdata_index(self.cfgData)
+            if sigindex:
+                sigindex.tidy()
+
         if self.state is runQueueFailed:
             if not self.rqdata.taskData.tryaltconfigs:
                 raise bb.runqueue.TaskFailure(self.rqexe.failed_fnids)
@@ -1049,6 +1188,7 @@ class RunQueue:
                 self.teardown_workers()
             except:
                 pass
+            self.dm.stop()
             self.state = runQueueComplete
             raise
 
@@ -1087,20 +1227,28 @@ class RunQueueExecute:
         self.number_tasks = int(self.cfgData.getVar("BB_NUMBER_THREADS", True) or 1)
         self.scheduler = self.cfgData.getVar("BB_SCHEDULER", True) or "speed"
 
-        self.runq_buildable = []
-        self.runq_running = []
-        self.runq_complete = []
+        self.runq_buildable = bytearray(len(self.rqdata.runq_fnid))
+        self.runq_running = bytearray(len(self.rqdata.runq_fnid))
+        self.runq_complete = bytearray(len(self.rqdata.runq_fnid))
 
         self.build_stamps = {}
         self.failed_fnids = []
 
         self.stampcache = {}
 
+        # Time the last task exit was read from a worker, used to measure
+        # how long it takes the server to dispatch the next task
+        self.lastexit = None
+        self.dispatched = 0
+        self.dispatchtime = 0
+        self.dispatchmax = 0
+
         rq.workerpipe.setrunqueueexec(self)
         if rq.fakeworkerpipe:
             rq.fakeworkerpipe.setrunqueueexec(self)
 
     def runqueue_process_waitpid(self, task, status):
+        self.lastexit = time.time()
 
         # self.build_stamps[pid] may not exist when use shared work directory.
         if task in self.build_stamps:
@@ -1133,15 +1281,41 @@ class RunQueueExecute:
         if self.stats.active > 0:
             bb.event.fire(runQueueExitWait(self.stats.active), self.cfgData)
             self.rq.read_workers()
-
-            return
+            if self.stats.active > 0:
+                return self.rq.active_fds()
+            return True
 
         if len(self.failed_fnids) != 0:
             self.rq.state = runQueueFailed
-            return
+            return True
 
         self.rq.state = runQueueComplete
-        return
+        return True
+
+    def task_dispatched(self):
+        """
+        Record the delay between the last task exit and this dispatch
+        """
+        if self.lastexit is None:
+            return
+        latency = time.time() - self.lastexit
+        self.lastexit = None
+        self.dispatched += 1
+        self.dispatchtime += latency
+        self.dispatchmax = max(self.dispatchmax, latency)
+        logger.debug(2, "Dispatched task %.1fms after the last task exit", latency * 1000)
+
+    def wait_workers(self):
+        """
+        Read the workers while tasks are running. Returns True if a task
+        exited, so the caller can schedule again straight away, otherwise the
+        worker pipes to wait on.
+        """
+        active = self.stats.active
+        self.rq.read_workers()
+        if self.stats.active != active:
+            return True
+        return self.rq.active_fds()
 
     def check_dependencies(self, task, taskdeps, setscene = False):
         if not self.rq.depvalidate:
@@ -1167,10 +1341,11 @@ class RunQueueExecuteDummy(RunQueueExecute):
     def __init__(self, rq):
         self.rq = rq
         self.stats = RunQueueStats(0)
+        self.dispatched = 0
 
     def finish(self):
         self.rq.state = runQueueComplete
-        return
+        return True
 
 class RunQueueExecuteTasks(RunQueueExecute):
     def __init__(self, rq):
@@ -1182,13 +1357,9 @@ class RunQueueExecuteTasks(RunQueueExecute):
 
         # Mark initial buildable tasks
         for task in xrange(self.stats.total):
-            self.runq_running.append(0)
-            self.runq_complete.append(0)
-            if len(self.rqdata.runq_depends[task]) == 0:
-                self.runq_buildable.append(1)
-            else:
-                self.runq_buildable.append(0)
-            if len(self.rqdata.runq_revdeps[task]) > 0 and self.rqdata.runq_revdeps[task].issubset(self.rq.scenequeue_covered) and task not in self.rq.scenequeue_notcovered:
+            if self.rqdata.runq_depends.rowlen(task) == 0:
+                self.runq_buildable[task] = 1
+            if self.rqdata.runq_revdeps.rowlen(task) > 0 and self.rqdata.runq_revdeps.rowissubset(task, self.rq.scenequeue_covered) and task not in self.rq.scenequeue_notcovered:
                 self.rq.scenequeue_covered.add(task)
 
         found = True
@@ -1197,9 +1368,10 @@ class RunQueueExecuteTasks(RunQueueExecute):
             for task in xrange(self.stats.total):
                 if task in self.rq.scenequeue_covered:
                     continue
-                logger.debug(1, 'Considering %s (%s): %s' % (task, self.rqdata.get_user_idstring(task), str(self.rqdata.runq_revdeps[task])))
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(1, 'Considering %s (%s): %s', task, self.rqdata.get_user_idstring(task), self.rqdata.runq_revdeps[task])
 
-                if len(self.rqdata.runq_revdeps[task]) > 0 and self.rqdata.runq_revdeps[task].issubset(self.rq.scenequeue_covered) and task not in self.rq.scenequeue_notcovered:
+                if self.rqdata.runq_revdeps.rowlen(task) > 0 and self.rqdata.runq_revdeps.rowissubset(task, self.rq.scenequeue_covered) and task not in self.rq.scenequeue_notcovered:
                     found = True
                     self.rq.scenequeue_covered.add(task)
 
@@ -1283,13 +1455,13 @@ class RunQueueExecuteTasks(RunQueueExecute):
         completed dependencies as buildable
         """
         self.runq_complete[task] = 1
-        for revdep in self.rqdata.runq_revdeps[task]:
+        for revdep in self.rqdata.runq_revdeps.iterrow(task):
             if self.runq_running[revdep] == 1:
                 continue
             if self.runq_buildable[revdep] == 1:
                 continue
             alldeps = 1
-            for dep in self.rqdata.runq_depends[revdep]:
+            for dep in self.rqdata.runq_depends.iterrow(revdep):
                 if self.runq_complete[dep] != 1:
                     alldeps = 0
             if alldeps == 1:
@@ -1376,14 +1548,14 @@ class RunQueueExecuteTasks(RunQueueExecute):
                 self.rq.worker.stdin.flush()
 
             self.build_stamps[task] = bb.build.stampfile(taskname, self.rqdata.dataCache, fn)
+            self.task_dispatched()
             self.runq_running[task] = 1
             self.stats.taskActive()
             if self.stats.active < self.number_tasks:
                 return True
 
         if self.stats.active > 0:
-            self.rq.read_workers()
-            return self.rq.active_fds()
+            return self.wait_workers()
 
         if len(self.failed_fnids) != 0:
             self.rq.state = runQueueFailed
@@ -1427,22 +1599,17 @@ class RunQueueExecuteScenequeue(RunQueueExecute):
         # therefore aims to collapse the huge runqueue dependency tree into a smaller one
         # only containing the setscene functions.
 
-        for task in xrange(self.stats.total):
-            self.runq_running.append(0)
-            self.runq_complete.append(0)
-            self.runq_buildable.append(0)
-
         # First process the chains up to the first setscene task.
         endpoints = {}
         for task in xrange(len(self.rqdata.runq_fnid)):
-            sq_revdeps.append(copy.copy(self.rqdata.runq_revdeps[task]))
+            sq_revdeps.append(set(self.rqdata.runq_revdeps.iterrow(task)))
             sq_revdeps_new.append(set())
-            if (len(self.rqdata.runq_revdeps[task]) == 0) and task not in self.rqdata.runq_setscene:
+            if (self.rqdata.runq_revdeps.rowlen(task) == 0) and task not in self.rqdata.runq_setscene:
                 endpoints[task] = set()
 
         # Secondly process the chains between setscene tasks.
         for task in self.rqdata.runq_setscene:
-            for dep in self.rqdata.runq_depends[task]:
+            for dep in self.rqdata.runq_depends.iterrow(task):
                     if dep not in endpoints:
                         endpoints[dep] = set()
                     endpoints[dep].add(task)
@@ -1458,7 +1625,7 @@ class RunQueueExecuteScenequeue(RunQueueExecute):
                 sq_revdeps_new[point] = set()
                 if point in self.rqdata.runq_setscene:
                     sq_revdeps_new[point] = tasks
-                for dep in self.rqdata.runq_depends[point]:
+                for dep in self.rqdata.runq_depends.iterrow(point):
                     if point in sq_revdeps[dep]:
                         sq_revdeps[dep].remove(point)
                     if tasks:
@@ -1486,7 +1653,7 @@ class RunQueueExecuteScenequeue(RunQueueExecute):
                 sq_revdeps_new2[point] = set()
                 if point in self.rqdata.runq_setscene:
                     sq_revdeps_new2[point] = tasks
-                for dep in self.rqdata.runq_depends[point]:
+                for dep in self.rqdata.runq_depends.iterrow(point):
                     if point in sq_revdeps2[dep]:
                         sq_revdeps2[dep].remove(point)
                     if tasks:
@@ -1496,9 +1663,9 @@ class RunQueueExecuteScenequeue(RunQueueExecute):
             if len(newendpoints) != 0:
                 process_endpoints2(newendpoints)
         for task in xrange(len(self.rqdata.runq_fnid)):
-            sq_revdeps2.append(copy.copy(self.rqdata.runq_revdeps[task]))
+            sq_revdeps2.append(set(self.rqdata.runq_revdeps.iterrow(task)))
             sq_revdeps_new2.append(set())
-            if (len(self.rqdata.runq_revdeps[task]) == 0) and task not in self.rqdata.runq_setscene:
+            if (self.rqdata.runq_revdeps.rowlen(task) == 0) and task not in self.rqdata.runq_setscene:
                 endpoints2[task] = set()
         process_endpoints2(endpoints2)
         self.unskippable = []
@@ -1716,14 +1883,14 @@ class RunQueueExecuteScenequeue(RunQueueExecute):
                 self.rq.worker.stdin.write("<runtask>" + pickle.dumps((fn, realtask, taskname, True, self.cooker.collection.get_file_appends(fn))) + "</runtask>")
                 self.rq.worker.stdin.flush()
 
+            self.task_dispatched()
             self.runq_running[task] = 1
             self.stats.taskActive()
             if self.stats.active < self.number_tasks:
                 return True
 
         if self.stats.active > 0:
-            self.rq.read_workers()
-            return self.rq.active_fds()
+            return self.wait_workers()
 
         # Convert scenequeue_covered task numbers into full taskgraph ids
         oldcovered = self.scenequeue_covered
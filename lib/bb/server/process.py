@@ -30,6 +30,7 @@ import signal
 import sys
 import time
 import select
+import errno
 from Queue import Empty
 from multiprocessing import Event, Process, util, Queue, Pipe, queues
 
@@ -74,6 +75,86 @@ class EventAdapter():
             print("EventAdapter puked: %s" % str(err))
 
 
+class EventPoller():
+    """
+    Wait for any of a set of file objects to become readable and call the
+    callback registered for it. Uses epoll where the platform has it, so
+    the descriptor set is not rebuilt and rescanned on every wakeup, and
+    falls back to select() elsewhere.
+    """
+    def __init__(self):
+        self.handlers = {}
+        self.epoll = None
+        if hasattr(select, "epoll"):
+            self.epoll = select.epoll()
+
+    def register(self, fileobj, callback = None):
+        fd = fileobj if isinstance(fileobj, int) else fileobj.fileno()
+        if fd in self.handlers:
+            if self.handlers[fd][0] is fileobj:
+                self.handlers[fd] = (fileobj, callback)
+                return
+            # The descriptor number was closed and reused by another file
+            self.unregister(fd)
+        self.handlers[fd] = (fileobj, callback)
+        if self.epoll:
+            self.epoll.register(fd, select.EPOLLIN)
+
+    def unregister(self, fd):
+        if fd not in self.handlers:
+            return
+        del self.handlers[fd]
+        if self.epoll:
+            try:
+                self.epoll.unregister(fd)
+            except (IOError, OSError, ValueError):
+                # Closing a descriptor removes it from the epoll set already
+                pass
+
+    def update(self, fileobjs):
+        """
+        Make the set of file objects registered without a callback match
+        fileobjs, leaving the ones with callbacks alone
+        """
+        wanted = {}
+        for fileobj in fileobjs:
+            fd = fileobj if isinstance(fileobj, int) else fileobj.fileno()
+            wanted[fd] = fileobj
+        for fd, (fileobj, callback) in self.handlers.items():
+            if callback is None and wanted.get(fd) is not fileobj:
+                self.unregister(fd)
+        for fd, fileobj in wanted.items():
+            if fd not in self.handlers or self.handlers[fd][0] is not fileobj:
+                self.register(fileobj)
+
+    def poll(self, timeout):
+        """
+        Wait up to timeout seconds (forever if None), call the callbacks of
+        the readable file objects and return their descriptors
+        """
+        try:
+            if self.epoll:
+                if timeout is None:
+                    timeout = -1
+                ready = [fd for fd, mask in self.epoll.poll(timeout)]
+            else:
+                ready = select.select(self.handlers.keys(), [], [], timeout)[0]
+        except (IOError, OSError, select.error) as exc:
+            if exc.args[0] != errno.EINTR:
+                raise
+            return []
+        for fd in ready:
+            if fd in self.handlers:
+                fileobj, callback = self.handlers[fd]
+                if callback:
+                    callback(fileobj)
+        return ready
+
+    def close(self):
+        if self.epoll:
+            self.epoll.close()
+        self.handlers = {}
+
 class ProcessServer(Process, BaseImplServer):
     profile_filename = "profile.log"
     profile_processed_filename = "profile.log.processed"
@@ -85,6 +166,7 @@ class ProcessServer(Process, BaseImplServer):
         self.event_queue = event_queue
         self.event = EventAdapter(event_queue)
         self.quit = False
+        self.poller = None
 
         self.keep_running = Event()
         self.keep_running.set()
@@ -100,24 +182,33 @@ class ProcessServer(Process, BaseImplServer):
         # Ignore SIGINT within the server, as all SIGINT handling is done by
         # the UI and communicated to us
         signal.signal(signal.SIGINT, signal.SIG_IGN)
+        self.poller = EventPoller()
+        self.poller.register(self.command_channel, self.handleCommand)
         while self.keep_running.is_set():
             try:
-                if self.command_channel.poll():
-                    command = self.command_channel.recv()
-                    self.runCommand(command)
-
-                self.idle_commands(.1, [self.event_queue._reader, self.command_channel])
+                self.idle_commands(.1)
             except Exception:
-                logger.exception('Running command %s', command)
+                logger.exception('Running server main loop')
 
+        self.poller.unregister(self.command_channel.fileno())
         self.event_queue.close()
         bb.event.unregister_UIHhandler(self.event_handle.value)
         self.command_channel.close()
         self.cooker.stop()
         self.idle_commands(.1)
+        self.poller.close()
 
-    def idle_commands(self, delay, fds = []):
+    def idle_commands(self, delay):
+        """
+        Run the idle functions once, then wait for one of the file objects
+        they returned or a command to become readable. Functions which
+        returned True want to run again at once, so then we only collect
+        commands which are already waiting. The wait is capped at delay so
+        that idle functions doing periodic work and server shutdown are
+        still noticed when nothing is readable.
+        """
         nextsleep = delay
+        fds = []
 
         for function, data in self._idlefuns.items():
             try:
@@ -125,18 +216,28 @@ class ProcessServer(Process, BaseImplServer):
                 if retval is False:
                     del self._idlefuns[function]
                 elif retval is True:
-                    nextsleep = None
-                elif nextsleep is None:
-                    continue
+                    nextsleep = 0
                 else:
-                    fds = fds + retval
+                    fds.extend(retval)
             except SystemExit:
                 raise
             except Exception:
                 logger.exception('Running idle function')
 
-        if nextsleep is not None:
-            select.select(fds,[],[],nextsleep)
+        self.poller.update(fds)
+        self.poller.poll(nextsleep)
+
+    def handleCommand(self, channel):
+        try:
+            command = channel.recv()
+        except EOFError:
+            # The UI went away, nothing more will arrive on this channel
+            self.poller.unregister(channel.fileno())
+            return
+        try:
+            self.runCommand(command)
+        except Exception:
+            logger.exception('Running command %s', command)
 
     def runCommand(self, command):
         """
@@ -1,8 +1,12 @@
+import errno
 import hashlib
 import logging
 import os
 import re
+import sys
 import tempfile
+import threading
+import Queue
 import bb.data
 
 logger = logging.getLogger('BitBake.SigGen')
@@ -74,6 +78,10 @@ class SignatureGeneratorBasic(SignatureGenerator):
         self.pkgnameextract = re.compile("(?P<fn>.*)\..*")
         self.basewhitelist = set((data.getVar("BB_HASHBASE_WHITELIST", True) or "").split())
         self.taskwhitelist = None
+        self.sigarchive = data.getVar("BB_SIGDATA_ARCHIVE", True) == "1"
+        self.sigwriter = None
+        self.sigindex = sigdata_index(data)
+        self.pn = {}
         self.init_rundepcheck(data)
 
     def init_rundepcheck(self, data):
@@ -153,6 +161,8 @@ class SignatureGeneratorBasic(SignatureGenerator):
         for task in taskdeps:
             d.setVar("BB_BASEHASH_task-%s" % task, self.basehash[fn + "." + task])
 
+        self.pn[fn] = d.getVar("PN", True)
+
     def rundep_check(self, fn, recipename, task, dep, depname, dataCache):
         # Return True if we should keep the dependency, False to drop it
         # We only manipulate the dependencies for packages not in the whitelist
@@ -212,8 +222,10 @@ class SignatureGeneratorBasic(SignatureGenerator):
             sigfile = stampbase
         elif runtime and k in self.taskhash:
             sigfile = stampbase + "." + task + ".sigdata" + "." + self.taskhash[k]
+            indexentry = (self.pn.get(fn, fn), task, self.taskhash[k], sigfile)
         else:
             sigfile = stampbase + "." + task + ".sigbasedata" + "." + self.basehash[k]
+            indexentry = (self.pn.get(fn, fn), task, self.basehash[k], sigfile)
 
         bb.utils.mkdirhier(os.path.dirname(sigfile))
 
@@ -242,31 +254,30 @@ class SignatureGeneratorBasic(SignatureGenerator):
         if taint:
             data['taint'] = taint
 
-        fd, tmpfile = tempfile.mkstemp(dir=os.path.dirname(sigfile), prefix="sigtask.")
-        try:
-            with os.fdopen(fd, "wb") as stream:
-                p = pickle.dump(data, stream, -1)
-                stream.flush()
-                os.fsync(fd)
-            os.chmod(tmpfile, 0664)
-            os.rename(tmpfile, sigfile)
-        except (OSError, IOError) as err:
-            try:
-                os.unlink(tmpfile)
-            except OSError:
-                pass
-            raise err
+        if self.sigwriter and runtime != "customfile":
+            self.sigwriter.write(sigfile, data, stampbase, indexentry)
+            return
+
+        tmpfile = write_tmp_sigfile(sigfile, data)
+        os.rename(tmpfile, sigfile)
+        if self.sigindex and runtime != "customfile":
+            self.sigindex.add([indexentry])
 
     def dump_sigs(self, dataCache):
-        for fn in self.taskdeps:
-            for task in self.taskdeps[fn]:
-                k = fn + "." + task
-                if k not in self.taskhash:
-                    continue
-                if dataCache.basetaskhash[k] != self.basehash[k]:
-                    bb.error("Bitbake's cached basehash does not match the one we just generated (%s)!" % k)
-                    bb.error("The mismatched hashes were %s and %s" % (dataCache.basetaskhash[k], self.basehash[k]))
-                self.dump_sigtask(fn, task, dataCache.stamp[fn], True)
+        self.sigwriter = SigDataWriter(self.sigarchive, self.sigindex)
+        try:
+            for fn in self.taskdeps:
+                for task in self.taskdeps[fn]:
+                    k = fn + "." + task
+                    if k not in self.taskhash:
+                        continue
+                    if dataCache.basetaskhash[k] != self.basehash[k]:
+                        bb.error("Bitbake's cached basehash does not match the one we just generated (%s)!" % k)
+                        bb.error("The mismatched hashes were %s and %s" % (dataCache.basetaskhash[k], self.basehash[k]))
+                    self.dump_sigtask(fn, task, dataCache.stamp[fn], True)
+        finally:
+            writer, self.sigwriter = self.sigwriter, None
+            writer.close()
 
 class SignatureGeneratorBasicHash(SignatureGeneratorBasic):
     name = "basichash"
@@ -292,6 +303,336 @@ class SignatureGeneratorBasicHash(SignatureGeneratorBasic):
         bb.note("Tainting hash to force rebuild of task %s, %s" % (fn, task))
         bb.build.write_taint(task, d, fn)
 
+def write_tmp_sigfile(sigfile, data, sync=True):
+    """
+    Write data to a temporary file next to sigfile, ready to be renamed
+    over it, and return its name. Unless sync is False the file is flushed
+    to disk first.
+    """
+    fd, tmpfile = tempfile.mkstemp(dir=os.path.dirname(sigfile), prefix="sigtask.")
+    try:
+        with os.fdopen(fd, "wb") as stream:
+            pickle.dump(data, stream, -1)
+            stream.flush()
+            if sync:
+                os.fsync(fd)
+        os.chmod(tmpfile, 0664)
+    except (OSError, IOError) as err:
+        try:
+            os.unlink(tmpfile)
+        except OSError:
+            pass
+        raise err
+    return tmpfile
+
+class SigDataWriter(object):
+    """
+    Writes signature data files from a background thread. Each batch of
+    queued files is written out, fsynced and only then renamed into place,
+    so no file becomes visible before its contents are on disk. The
+    directories of the batch are fsynced once the renames are done.
+
+    With archive set, the signature data of each stamp base is instead
+    collected into one packed archive, <stampbase>.sigpack, which
+    load_sigfile() reads transparently. The files are added to index, if
+    given, once they have all been written.
+    """
+    batchsize = 512
+
+    def __init__(self, archive=False, index=None):
+        self.archive = archive
+        self.archives = {}
+        self.index = index
+        self.indexentries = []
+        self.queue = Queue.Queue()
+        self.error = None
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def write(self, sigfile, data, stampbase, indexentry=None):
+        if indexentry:
+            self.indexentries.append(indexentry)
+        if self.archive:
+            members = self.archives.setdefault(stampbase + ".sigpack", {})
+            members[os.path.basename(sigfile)] = data
+        else:
+            self.queue.put((sigfile, data))
+
+    def close(self):
+        for sigpack, members in self.archives.iteritems():
+            self.queue.put((sigpack, members))
+        self.archives = {}
+        self.queue.put(None)
+        self.thread.join()
+        if self.error:
+            raise self.error[0], self.error[1], self.error[2]
+        if self.index and self.indexentries:
+            self.index.add(self.indexentries)
+        self.indexentries = []
+
+    def _run(self):
+        done = False
+        while not done:
+            batch = [self.queue.get()]
+            while len(batch) < self.batchsize:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except Queue.Empty:
+                    break
+            if batch[-1] is None:
+                done = True
+                batch.pop()
+            if batch and not self.error:
+                try:
+                    self._write_batch(batch)
+                except Exception:
+                    self.error = sys.exc_info()
+
+    def _write_batch(self, batch):
+        written = []
+        try:
+            for sigfile, data in batch:
+                if self.archive and os.path.exists(sigfile):
+                    # Keep the signatures of earlier hashes, as separate
+                    # files would
+                    members = load_sigpack(sigfile)
+                    members.update(data)
+                    data = members
+                bb.utils.mkdirhier(os.path.dirname(sigfile))
+                written.append((write_tmp_sigfile(sigfile, data, False), sigfile))
+
+            # Write the whole batch before fsyncing any of it, so that its
+            # writeback overlaps
+            for tmpfile, _ in written:
+                self._sync(tmpfile, os.fsync)
+
+            dirs = set()
+            while written:
+                tmpfile, sigfile = written.pop()
+                os.rename(tmpfile, sigfile)
+                dirs.add(os.path.dirname(sigfile))
+            for dirname in dirs:
+                self._sync(dirname, os.fsync)
+        finally:
+            for tmpfile, _ in written:
+                try:
+                    os.unlink(tmpfile)
+                except OSError:
+                    pass
+
+    def _sync(self, path, sync):
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            return sync(fd)
+        finally:
+            os.close(fd)
+
+def load_sigpack(sigpack):
+    with open(sigpack, "rb") as f:
+        return pickle.load(f)
+
+def _sigpacks(sigfile):
+    """
+    Return the paths of the packed archives which could hold sigfile
+    """
+    dirname, basename = os.path.split(sigfile)
+    parts = basename.split(".")
+    for i in range(len(parts) - 1, 0, -1):
+        sigpack = os.path.join(dirname, ".".join(parts[:i]) + ".sigpack")
+        if os.path.exists(sigpack):
+            yield sigpack
+
+def load_sigfile(sigfile):
+    """
+    Load the signature data in sigfile. If there is no such file, the
+    packed archive of its stamp base is searched for it instead.
+    """
+    if os.path.exists(sigfile):
+        with open(sigfile, "rb") as f:
+            return pickle.load(f)
+
+    basename = os.path.basename(sigfile)
+    for sigpack in _sigpacks(sigfile):
+        members = load_sigpack(sigpack)
+        if basename in members:
+            return members[basename]
+    raise IOError(errno.ENOENT, os.strerror(errno.ENOENT), sigfile)
+
+def sigfile_mtime(sigfile):
+    """
+    Return the modification time of sigfile, or of the packed archive
+    holding it, or None if neither exists
+    """
+    try:
+        return os.stat(sigfile).st_mtime
+    except OSError:
+        pass
+    for sigpack in _sigpacks(sigfile):
+        return os.stat(sigpack).st_mtime
+    return None
+
+class SigDataIndex(object):
+    """
+    Persistent index of the signature data files written by the signature
+    generator, by recipe name, task and hash, so that they can be found
+    without scanning the stamp directories.
+
+    Task processes append their entries concurrently, each in a single
+    write under a shared lock. The index is rewritten without its stale
+    and repeated lines, under an exclusive lock, by tidy() once it has
+    doubled in size since it was last rewritten, and by readers once most
+    of its lines are stale. The first line of a rewritten index records
+    how large it was.
+    """
+    header = "#compacted"
+
+    # Bytes an index may grow by before tidy() rewrites it even when it
+    # was empty when last rewritten
+    slack = 256 * 1024
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.lockfile = filename + ".lock"
+        self.entries = None
+
+    def add(self, entries):
+        lines = "".join("%s\t%s\t%s\t%s\n" % entry for entry in entries)
+        lf = bb.utils.lockfile(self.lockfile, shared=True)
+        try:
+            fd = os.open(self.filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0664)
+            try:
+                os.write(fd, lines)
+            finally:
+                os.close(fd)
+        finally:
+            bb.utils.unlockfile(lf)
+
+    def read(self):
+        """
+        Return a dict of (pn, task, hash) to signature data file of the
+        entries whose files still exist, the number of lines read and the
+        size of the part of the index they were read from
+        """
+        entries = {}
+        try:
+            with open(self.filename, "r") as f:
+                data = f.read()
+        except IOError:
+            return entries, 0, 0
+
+        size = data.rfind("\n") + 1
+        lines = data[:size].splitlines()
+        for line in lines:
+            fields = line.split("\t")
+            if len(fields) == 4:
+                entries[tuple(fields[:3])] = fields[3]
+
+        for key, sigfile in entries.items():
+            if sigfile_mtime(sigfile) is None:
+                del entries[key]
+        return entries, len(lines), size
+
+    def load(self):
+        """
+        Return a dict of (pn, task, hash) to signature data file of the
+        entries whose files still exist
+        """
+        entries, lines, size = self.read()
+        if lines > 2 * len(entries) + 1000:
+            self.compact(entries, size)
+        return entries
+
+    def tidy(self):
+        """
+        Rewrite the index if it has grown to more than twice the size it
+        had when it was last rewritten
+        """
+        try:
+            with open(self.filename, "r") as f:
+                fields = f.readline().split("\t")
+                size = os.fstat(f.fileno()).st_size
+        except IOError:
+            return
+        compacted = 0
+        if len(fields) == 2 and fields[0] == self.header:
+            compacted = int(fields[1])
+        if size <= 2 * compacted + self.slack:
+            return
+        lf = bb.utils.lockfile(self.lockfile)
+        try:
+            entries, lines, size = self.read()
+            self.write(entries, size)
+        finally:
+            bb.utils.unlockfile(lf)
+
+    def compact(self, entries, size):
+        lf = bb.utils.lockfile(self.lockfile)
+        try:
+            self.write(entries, size)
+        finally:
+            bb.utils.unlockfile(lf)
+
+    def write(self, entries, size):
+        # Keep whatever was appended after the index was read
+        with open(self.filename, "r") as f:
+            f.seek(size)
+            appended = f.read()
+        data = "".join("%s\t%s\t%s\t%s\n" % (key + (sigfile,)) for key, sigfile in entries.iteritems())
+        with open(self.filename + ".new", "w") as f:
+            f.write("%s\t%d\n" % (self.header, len(data)))
+            f.write(data)
+            f.write(appended)
+        os.rename(self.filename + ".new", self.filename)
+
+    def find(self, pn, taskname, taskhashlist=None):
+        """
+        Look up signature data files in the same way as the metadata's
+        find_siginfo(): return a dict of file to modification time for pn
+        and taskname, or of hash to file for the hashes in taskhashlist.
+        The index is only read once per SigDataIndex object.
+        """
+        if self.entries is None:
+            self.entries = self.load()
+        entries = self.entries
+        if taskhashlist:
+            hashes = set(taskhashlist)
+            return dict((key[2], sigfile) for key, sigfile in entries.iteritems()
+                        if key[2] in hashes)
+        return dict((sigfile, sigfile_mtime(sigfile)) for key, sigfile in entries.iteritems()
+                    if key[0] == pn and key[1] == taskname)
+
+def sigdata_index(d):
+    """
+    Return the signature data index for the configuration d, or None when
+    there is no persistent directory to keep it in
+    """
+    cachedir = d.getVar("PERSISTENT_DIR", True) or d.getVar("CACHE", True)
+    if not cachedir:
+        return None
+    return SigDataIndex(os.path.join(cachedir, "bb_sigdata_index"))
+
+def find_sigdata(pn, taskname, taskhashlist, d, index=None):
+    """
+    Find signature data files like the metadata's find_siginfo(), looking
+    in the signature data index first. Hashes the index does not know
+    about are passed on to find_siginfo(). The files for pn and taskname
+    always come from both, since files written elsewhere (such as the
+    sstate siginfo files) are not indexed.
+    """
+    if index is None:
+        index = sigdata_index(d)
+    found = index.find(pn, taskname, taskhashlist) if index else {}
+    if 'find_siginfo' not in globals():
+        return found
+    if taskhashlist:
+        missing = [h for h in taskhashlist if h not in found]
+        if missing:
+            found.update(find_siginfo(pn, taskname, missing, d))
+    else:
+        found.update(find_siginfo(pn, taskname, None, d))
+    return found
+
 def dump_this_task(outfile, d):
     import bb.parse
     fn = d.getVar("BB_FILENAME", True)
@@ -311,13 +652,16 @@ def clean_basepaths(a):
         b[clean_basepath(x)] = a[x]
     return b
 
-def compare_sigfiles(a, b, recursecb = None):
+def compare_sigfiles(a, b, recursecb = None, loadcb = load_sigfile, prefetchcb = None):
+    """
+    Compare the signature data files a and b. Changed task dependencies are
+    passed to recursecb, after they have all been handed to prefetchcb as a
+    list of (task, hash in a, hash in b). Files are loaded with loadcb.
+    """
     output = []
 
-    p1 = pickle.Unpickler(open(a, "rb"))
-    a_data = p1.load()
-    p2 = pickle.Unpickler(open(b, "rb"))
-    b_data = p2.load()
+    a_data = loadcb(a)
+    b_data = loadcb(b)
 
     def dict_diff(a, b, whitelist=set()):
         sa = set(a.keys())
@@ -402,6 +746,8 @@ def compare_sigfiles(a, b, recursecb = None):
                             adep_found = True
                 if not adep_found:
                     output.append("Dependency on task %s was removed with hash %s" % (clean_basepath(dep), b[dep]))
+        if changed and callable(recursecb) and callable(prefetchcb):
+            prefetchcb([(dep, a[dep], b[dep]) for dep in changed])
         if changed:
             for dep in changed:
                 output.append("Hash for dependent task %s changed from %s to %s" % (clean_basepath(dep), a[dep], b[dep]))
@@ -421,8 +767,7 @@ def compare_sigfiles(a, b, recursecb = None):
 def dump_sigfile(a):
     output = []
 
-    p1 = pickle.Unpickler(open(a, "rb"))
-    a_data = p1.load()
+    a_data = load_sigfile(a)
 
     output.append("basewhitelist: %s" % (a_data['basewhitelist']))
 
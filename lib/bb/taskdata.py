@@ -37,19 +37,70 @@ def re_match_strings(target, strings):
     return any(name == target or re.match(name, target)
                for name in strings)
 
+class IdTable(object):
+    """
+    A table of unique items whose positions serve as their IDs, with a
+    reverse index so that finding the ID of an item does not scan the table.
+    Items can only be added at the end, so the IDs handed out stay valid.
+    """
+    def __init__(self, items = ()):
+        self.items = []
+        self.ids = {}
+        for item in items:
+            self.append(item)
+
+    def getid(self, item):
+        """
+        Return the ID of item, adding it to the table if needed
+        """
+        itemid = self.ids.get(item)
+        if itemid is None:
+            itemid = self.ids[item] = len(self.items)
+            self.items.append(item)
+        return itemid
+
+    def append(self, item):
+        if item in self.ids:
+            raise ValueError("%s is already in the table" % item)
+        self.getid(item)
+
+    def index(self, item):
+        try:
+            return self.ids[item]
+        except KeyError:
+            raise ValueError("%s is not in the table" % item)
+
+    def __getitem__(self, itemid):
+        return self.items[itemid]
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __contains__(self, item):
+        return item in self.ids
+
+    def __repr__(self):
+        return "IdTable(%r)" % self.items
+
+    def __reduce__(self):
+        return (IdTable, (self.items,))
+
 class TaskData:
     """
     BitBake Task Data implementation
     """
     def __init__(self, abort = True, tryaltconfigs = False, skiplist = None):
-        self.build_names_index = []
-        self.run_names_index = []
-        self.fn_index = []
+        self.build_names_index = IdTable()
+        self.run_names_index = IdTable()
+        self.fn_index = IdTable()
 
         self.build_targets = {}
         self.run_targets = {}
 
-        self.external_targets = []
+        self.external_targets = set()
 
         self.tasks_fnid = []
         self.tasks_name = []
@@ -64,9 +115,9 @@ class TaskData:
 
         self.consider_msgs_cache = []
 
-        self.failed_deps = []
-        self.failed_rdeps = []
-        self.failed_fnids = []
+        self.failed_deps = set()
+        self.failed_rdeps = set()
+        self.failed_fnids = set()
 
         self.abort = abort
         self.tryaltconfigs = tryaltconfigs
@@ -78,33 +129,21 @@ class TaskData:
         Return an ID number for the build target name.
         If it doesn't exist, create one.
         """
-        if not name in self.build_names_index:
-            self.build_names_index.append(name)
-            return len(self.build_names_index) - 1
-
-        return self.build_names_index.index(name)
+        return self.build_names_index.getid(name)
 
     def getrun_id(self, name):
         """
         Return an ID number for the run target name.
         If it doesn't exist, create one.
         """
-        if not name in self.run_names_index:
-            self.run_names_index.append(name)
-            return len(self.run_names_index) - 1
-
-        return self.run_names_index.index(name)
+        return self.run_names_index.getid(name)
 
     def getfn_id(self, name):
         """
         Return an ID number for the filename.
         If it doesn't exist, create one.
         """
-        if not name in self.fn_index:
-            self.fn_index.append(name)
-            return len(self.fn_index) - 1
-
-        return self.fn_index.index(name)
+        return self.fn_index.getid(name)
 
     def gettask_ids(self, fnid):
         """
@@ -168,7 +207,7 @@ class TaskData:
             bb.msg.fatal("TaskData", "Trying to re-add a failed file? Something is broken...")
 
         # Check if we've already seen this fn
-        if fnid in self.tasks_fnid:
+        if fnid in self.tasks_lookup:
             return
 
         for task in task_deps['tasks']:
@@ -291,8 +330,7 @@ class TaskData:
         """
         targetid = self.getbuild_id(item)
 
-        if targetid not in self.external_targets:
-            self.external_targets.append(targetid)
+        self.external_targets.add(targetid)
 
     def get_unresolved_build_targets(self, dataCache):
         """
@@ -300,10 +338,10 @@ class TaskData:
         are unknown.
         """
         unresolved = []
-        for target in self.build_names_index:
-            if re_match_strings(target, dataCache.ignored_dependencies):
+        for targetid, target in enumerate(self.build_names_index):
+            if targetid in self.failed_deps:
                 continue
-            if self.build_names_index.index(target) in self.failed_deps:
+            if re_match_strings(target, dataCache.ignored_dependencies):
                 continue
             if not self.have_build_target(target):
                 unresolved.append(target)
@@ -315,10 +353,10 @@ class TaskData:
         are unknown.
         """
         unresolved = []
-        for target in self.run_names_index:
-            if re_match_strings(target, dataCache.ignored_dependencies):
+        for targetid, target in enumerate(self.run_names_index):
+            if targetid in self.failed_rdeps:
                 continue
-            if self.run_names_index.index(target) in self.failed_rdeps:
+            if re_match_strings(target, dataCache.ignored_dependencies):
                 continue
             if not self.have_runtime_target(target):
                 unresolved.append(target)
@@ -517,7 +555,7 @@ class TaskData:
         if fnid in self.failed_fnids:
             return
         logger.debug(1, "File '%s' is unbuildable, removing...", self.fn_index[fnid])
-        self.failed_fnids.append(fnid)
+        self.failed_fnids.add(fnid)
         for target in self.build_targets:
             if fnid in self.build_targets[target]:
                 self.build_targets[target].remove(fnid)
@@ -539,7 +577,7 @@ class TaskData:
         else:
             missing_list = [self.build_names_index[targetid]] + missing_list
         logger.verbose("Target '%s' is unbuildable, removing...\nMissing or unbuildable dependency chain was: %s", self.build_names_index[targetid], missing_list)
-        self.failed_deps.append(targetid)
+        self.failed_deps.add(targetid)
         dependees = self.get_dependees(targetid)
         for fnid in dependees:
             self.fail_fnid(fnid, missing_list)
@@ -565,7 +603,7 @@ class TaskData:
             missing_list = [self.run_names_index[targetid]] + missing_list
 
         logger.info("Runtime target '%s' is unbuildable, removing...\nMissing or unbuildable dependency chain was: %s", self.run_names_index[targetid], missing_list)
-        self.failed_rdeps.append(targetid)
+        self.failed_rdeps.add(targetid)
         dependees = self.get_rdependees(targetid)
         for fnid in dependees:
             self.fail_fnid(fnid, missing_list)
@@ -264,6 +264,15 @@ be. These unit tests are testing snippets."""
         self.assertExecs(set(["testget"]))
         del self.context["testget"]
 
+    def test_cached_parse(self):
+        code = "d.getVar('CACHEDFOO', True)\nbb.cacheme()"
+        bb.codeparser.codeparsercache.reset_stats()
+        self.parseExpression(code)
+        self.parseExpression(code)
+        self.assertReferences(set(["CACHEDFOO"]))
+        self.assertExecs(set(["bb.cacheme"]))
+        self.assertEqual(bb.codeparser.codeparsercache.stats["python"], [1, 1])
+
 
 class DependencyReferenceTest(ReferenceTest):
 
@@ -134,3 +134,91 @@ class COWTestCase(unittest.TestCase):
         self.assertEquals(1028, copy['123'])
         self.assertEquals(4712, copy['other'])
         self.assertEquals({'abc':20, 'bcd':20}, copy['d'])
+
+    def testOriginalChanged(self):
+        from bb.COW import COWDictBase
+        a = COWDictBase.copy()
+        a['a'] = 1
+        b = a.copy()
+        c = b.copy()
+        a['a'] = 2
+        a['b'] = 3
+        b['b'] = 4
+        del a['a']
+
+        self.assertEquals(False, c.has_key('a'))
+        self.assertEquals(4, c['b'])
+        self.assertEquals(3, a['b'])
+        c['a'] = 5
+        a['a'] = 6
+        self.assertEquals(5, c['a'])
+        self.assertEquals(6, b['a'])
+
+    def testDeepCopy(self):
+        from bb.COW import COWDictBase
+        c = COWDictBase.copy()
+        c['s'] = set()
+        levels = [c]
+        for i in range(50):
+            c = c.copy()
+            c['key%d' % i] = i
+            c['s'].add(i)
+            if i % 2:
+                del c['key%d' % (i - 1)]
+            levels.append(c)
+
+        self.assertEquals(False, c.has_key('key0'))
+        self.assertEquals(49, c['key49'])
+        self.assertEquals(set(range(50)), c['s'])
+        self.assertEquals(26, len(c))
+        self.assertEquals(set(), levels[0]['s'])
+        self.assertEquals(set(range(10)), levels[10]['s'])
+        self.assertEquals(True, levels[9].has_key('key8'))
+        self.assertEquals(False, levels[10].has_key('key8'))
+
+    def testSet(self):
+        from bb.COW import COWSetBase
+        a = COWSetBase.copy()
+        a.add('o1')
+        a.add('o2')
+        b = a.copy()
+        b.add('o3')
+        b.remove('o1')
+
+        self.assertEquals(set(['o1', 'o2']), set(a.itervalues()))
+        self.assertEquals(set(['o2', 'o3']), set(b.itervalues()))
+        self.assertEquals(True, 'o1' in a)
+        self.assertEquals(False, 'o1' in b)
+
+    def testDeepOriginalChanged(self):
+        from bb.COW import COWDictBase
+        a = COWDictBase.copy()
+        a['a'] = 1
+        a['b'] = 2
+        c = a
+        for i in range(3 * c.maxdepth):
+            c = c.copy()
+        self.assertEquals(1, c['a'])
+
+        a['a'] = 3
+        del a['b']
+        a['c'] = 4
+        self.assertEquals(3, c['a'])
+        self.assertEquals(False, c.has_key('b'))
+        self.assertEquals(4, c['c'])
+        self.assertEquals(set(['a', 'c']), set(c.iterkeys()))
+
+    def testWarn(self):
+        from StringIO import StringIO
+        from bb.COW import COWDictBase
+        warn = StringIO()
+        COWDictBase.__warn__ = warn
+        try:
+            a = COWDictBase.copy()
+            a['d'] = {}
+            b = a.copy()
+            b['d']['a'] = 1
+        finally:
+            COWDictBase.__warn__ = False
+        self.assertEquals(False, COWDictBase.__warn__)
+        self.assertIn("Doing a copy because d is a mutable type", warn.getvalue())
@@ -120,6 +120,29 @@ class DataExpansions(unittest.TestCase):
         keys = self.d.keys()
         self.assertEqual(keys, ['value of foo', 'foo', 'bar'])
 
+    def test_keys_deletion(self):
+        self.d.delVar("foo")
+        self.assertEqual(sorted(self.d.keys()), ['bar', 'value of foo'])
+
+    def test_keys_copy(self):
+        d = self.d.createCopy()
+        self.assertEqual(len(d), 3)
+        d.delVar("bar")
+        d.setVar("baz", "value of baz")
+        self.assertEqual(sorted(d.keys()), ['baz', 'foo', 'value of foo'])
+        self.d.setVar("qux", "value of qux")
+        self.assertEqual(sorted(d.keys()), ['baz', 'foo', 'qux', 'value of foo'])
+        self.assertEqual(len(self.d), 4)
+
+    def test_keys_copy_chain(self):
+        d = self.d.createCopy()
+        d.setVar("baz", "value of baz")
+        d = d.createCopy()
+        d.delVar("foo")
+        self.d.setVar("qux", "value of qux")
+        self.assertEqual(sorted(d.keys()), ['bar', 'baz', 'qux', 'value of foo'])
+        self.assertEqual(len(d), 4)
+
 class TestNestedExpansions(unittest.TestCase):
     def setUp(self):
         self.d = bb.data.init()
@@ -234,6 +257,12 @@ class TestOverrides(unittest.TestCase):
         bb.data.update_data(self.d)
         self.assertEqual(self.d.getVar("TEST", True), "testvalue3")
 
+    def test_override_after_copy(self):
+        d = self.d.createCopy()
+        self.d.setVar("TEST_bar", "testvalue2")
+        bb.data.update_data(d)
+        self.assertEqual(d.getVar("TEST", True), "testvalue2")
+
 
 class TestFlags(unittest.TestCase):
     def setUp(self):
@@ -251,4 +280,42 @@ class TestFlags(unittest.TestCase):
         self.assertEqual(self.d.getVarFlag("foo", "flag1"), "value of flag1")
         self.assertEqual(self.d.getVarFlag("foo", "flag2"), None)
 
-
+class TestFuncEnv(unittest.TestCase):
+    def setUp(self):
+        self.d = bb.data.init()
+        self.d.setVar("foo", "value of foo")
+        self.d.setVarFlag("foo", "export", "1")
+
+    def test_func_env(self):
+        self.assertEqual(bb.data.func_env(self.d), 'export foo="value of foo"\n')
+        d = self.d.createCopy()
+        self.assertEqual(bb.data.func_env(d), 'export foo="value of foo"\n')
+        d.setVar("foo", "new value of foo")
+        self.assertEqual(bb.data.func_env(d), 'export foo="new value of foo"\n')
+        d.delVarFlag("foo", "export")
+        self.assertEqual(bb.data.func_env(d), '')
+
+class TestHistory(unittest.TestCase):
+    def setUp(self):
+        self.d = bb.data.init()
+        self.d.enableTracking()
+        self.d.setVar("FOO", "foo", file="a.conf", line=1)
+
+    def test_copy(self):
+        d = self.d.createCopy()
+        d.setVar("FOO", "bar", file="b.bb", line=True)
+        self.d.setVar("FOO", "baz", file="a.conf", line=1.0)
+        self.assertEqual([(e['file'], e['line']) for e in d.varhistory.variable("FOO")],
+                         [("a.conf", 1), ("b.bb", True)])
+        self.assertEqual([type(e['line']) for e in self.d.varhistory.variable("FOO")],
+                         [int, float])
+
+    def test_reset(self):
+        self.d.varhistory.del_var_history("FOO")
+        d = self.d.createCopy()
+        self.assertEqual(d.varhistory.variable("FOO"), [])
+        d.setVar("FOO", "bar", file="b.bb", line=2)
+        copy = d.createCopy()
+        d.varhistory.del_var_history("FOO")
+        self.assertEqual(d.varhistory.variable("FOO"), [])
+        self.assertEqual(len(copy.varhistory.variable("FOO")), 1)
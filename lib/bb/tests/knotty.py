@@ -0,0 +1,89 @@
+# ex:ts=4:sw=4:sts=4:et
+# -*- tab-width: 4; c-basic-offset: 4; indent-tabs-mode: nil -*-
+#
+# BitBake Tests for the knotty UI's footer (ui/knotty.py)
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+import unittest
+import sys
+import StringIO
+import bb.ui.knotty
+
+class FakeCurses(object):
+    def tparm(self, cap, *args):
+        return "<%s%s>" % (cap, "".join(str(arg) for arg in args))
+
+class FakeTerminalFilter(bb.ui.knotty.TerminalFilter):
+    columns = 10
+
+    def __init__(self):
+        self.curses = FakeCurses()
+        self.cuu = "cuu"
+        self.ed = "ed"
+        self.el = "el"
+        self.footer_present = False
+        self.footer_lines = []
+
+class FooterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stdout = sys.stdout
+        sys.stdout = StringIO.StringIO()
+        self.tf = FakeTerminalFilter()
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+
+    def draw(self, lines):
+        sys.stdout.seek(0)
+        sys.stdout.truncate()
+        self.tf.drawFooter(lines)
+        return sys.stdout.getvalue()
+
+    def test_wrapped_rows(self):
+        output = self.draw(["head", "x" * 15, "y" * 25])
+        self.assertEqual("head\n" + "x" * 15 + "\n" + "y" * 25 + "\n", output)
+        self.assertEqual(6, self.tf.footer_present)
+
+    def test_unchanged_lines_skipped(self):
+        self.draw(["head", "x" * 15, "y"])
+        output = self.draw(["head", "x" * 15, "z"])
+        self.assertEqual("<cuu4>\n\n\nz<el>\n<ed>", output)
+        self.assertEqual(4, self.tf.footer_present)
+
+    def test_unchanged_footer(self):
+        self.draw(["head", "x" * 15])
+        self.assertEqual("", self.draw(["head", "x" * 15]))
+        self.assertEqual(3, self.tf.footer_present)
+
+    def test_height_change(self):
+        self.draw(["head", "short", "tail"])
+        output = self.draw(["head", "x" * 15, "tail"])
+        self.assertEqual("<cuu3>\n<ed>" + "x" * 15 + "\ntail\n", output)
+        self.assertEqual(4, self.tf.footer_present)
+
+        output = self.draw(["head", "short", "tail"])
+        self.assertEqual("<cuu4>\n<ed>short\ntail\n", output)
+        self.assertEqual(3, self.tf.footer_present)
+
+    def test_lines_removed(self):
+        self.draw(["head", "x" * 15, "y"])
+        output = self.draw(["head", "x" * 15])
+        self.assertEqual("<cuu4>\n\n\n<ed>", output)
+        self.assertEqual(3, self.tf.footer_present)
+
+        self.assertEqual("<cuu3><ed>", self.draw([]))
+        self.assertFalse(self.tf.footer_present)
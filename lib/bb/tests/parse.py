@@ -0,0 +1,73 @@
+# ex:ts=4:sw=4:sts=4:et
+# -*- tab-width: 4; c-basic-offset: 4; indent-tabs-mode: nil -*-
+#
+# BitBake Tests for the parser's statement cache (parse/__init__.py)
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+import unittest
+import tempfile
+import shutil
+import os
+import bb
+
+recipe = """\
+python () {
+    d.setVar("ANON", "1")
+}
+
+def recipe_helper(d):
+    return "helper"
+"""
+
+class StatementCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.fn = os.path.join(self.tempdir, "recipe.bb")
+        with open(self.fn, "w") as f:
+            f.write(recipe)
+        self.cache = bb.parse.StatementCache()
+        self.cache.init_cache(self.data())
+        self.origcache = bb.parse.statementcache
+        bb.parse.statementcache = self.cache
+
+    def tearDown(self):
+        bb.parse.statementcache = self.origcache
+        shutil.rmtree(self.tempdir)
+
+    def data(self):
+        d = bb.data.init()
+        d.setVar("PERSISTENT_DIR", self.tempdir)
+        d.setVar("BBPATH", self.tempdir)
+        return d
+
+    def test_other_name(self):
+        bb.parse.handle("recipe.bb", self.data(), True)
+        self.assertIn(self.fn, self.cache.cachedata_extras[0])
+
+        d = self.data()
+        bb.parse.handle(self.fn, d, True)
+        anonfunc = "__anon_3_%s" % self.fn.replace("/", "_").replace(".", "_")
+        self.assertEqual([anonfunc], d.getVar("__BBANONFUNCS"))
+        statements = self.cache.get(self.fn, self.fn)
+        self.assertEqual(set([self.fn]), set(s.filename for s in statements))
+
+    def test_changed(self):
+        bb.parse.handle(self.fn, self.data(), True)
+        self.assertNotEqual(None, self.cache.get(self.fn, self.fn))
+        with open(self.fn, "a") as f:
+            f.write('A = "1"\n')
+        self.assertEqual(None, self.cache.get(self.fn, self.fn))
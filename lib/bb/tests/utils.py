@@ -36,6 +36,13 @@ class VerCmpString(unittest.TestCase):
         result = bb.utils.vercmp_string('1.1', '1_p2')
         self.assertTrue(result < 0)
 
+    def test_vercmp_key(self):
+        versions = [(0, '1.0', 'r1'), (0, '1~rc1', 'r0'), (0, '1', 'r0'), ('1', '0.1', 'r0'), (0, '1.0', 'r0'), (0, '1a', 'r0')]
+        ordered = sorted(versions, key=bb.utils.vercmp_key)
+        self.assertEqual(ordered, [(0, '1~rc1', 'r0'), (0, '1', 'r0'), (0, '1a', 'r0'), (0, '1.0', 'r0'), (0, '1.0', 'r1'), ('1', '0.1', 'r0')])
+        for a, b in zip(ordered, ordered[1:]):
+            self.assertTrue(bb.utils.vercmp(a, b) < 0)
+
     def test_explode_dep_versions(self):
         correctresult = {"foo" : ["= 1.10"]}
         result = bb.utils.explode_dep_versions2("foo (= 1.10)")
@@ -51,3 +58,15 @@ class VerCmpString(unittest.TestCase):
         result = bb.utils.explode_dep_versions2("foo ( =1.10 )")
         self.assertEqual(result, correctresult)
 
+
+class CodeCache(unittest.TestCase):
+
+    def test_codecache(self):
+        cache = bb.utils.CodeCache(maxsize = 2)
+        first = cache.compile("1 + 1", "<expansion>", "eval")
+        self.assertIs(cache.compile("1 + 1", "<expansion>", "eval"), first)
+        self.assertIsNot(cache.compile("1 + 1", "FOO", "eval"), first)
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+        cache.compile("2 + 2", "<expansion>", "eval")
+        self.assertEqual(len(cache.code), 1)
+        self.assertEqual(eval(cache.compile("1 + 1", "<expansion>", "eval")), 2)
@@ -73,14 +73,29 @@ class Tinfoil:
 
         self.cooker_data = self.cooker.recipecache
 
-    def prepare(self, config_only = False):
+    def prepare(self, config_only = False, query_only = False):
+        """
+        Set up cooker_data. With query_only, it is loaded from the recipe
+        cache index where possible, which is enough to look up recipes,
+        their versions, build and runtime providers, packages, inherits and
+        appends but has no dependency or task data.
+        """
         if not self.cooker_data:
             if config_only:
                 self.cooker.parseConfiguration()
                 self.cooker_data = self.cooker.recipecache
+            elif query_only and self.loadRecipeIndex():
+                self.cooker_data = self.cooker.recipecache
             else:
                 self.parseRecipes()
 
+    def loadRecipeIndex(self):
+        self.logger.setLevel(logging.WARNING)
+        try:
+            return self.cooker.loadRecipeIndex()
+        finally:
+            self.logger.setLevel(logging.INFO)
+
 class TinfoilConfigParameters(ConfigParameters):
 
     def __init__(self, **options):
@@ -175,6 +175,17 @@ class DepExplorer(gtk.Window):
             for rdepend in depgraph["rdepends-pn"][package]:
                 self.depends_model.insert (0, (TYPE_RDEP, package, rdepend))
 
+    def parse_items(self, items):
+        for (kind, key, value) in items:
+            if kind == "pn":
+                self.pkg_model.insert(0, (key,))
+            elif kind == "depends":
+                for depend in value:
+                    self.depends_model.insert (0, (TYPE_DEP, key, depend))
+            elif kind == "rdepends-pn":
+                for rdepend in value:
+                    self.depends_model.insert (0, (TYPE_RDEP, key, rdepend))
+
 
 class gtkthread(threading.Thread):
     quit = threading.Event()
@@ -204,7 +215,7 @@ def main(server, eventHandler, params):
         if not cmdline or cmdline[0] != "generateDotGraph":
             print("This UI is only compatible with the -g option")
             return 1
-        ret, error = server.runCommand(["generateDepTreeEvent", cmdline[1], cmdline[2]])
+        ret, error = server.runCommand(["generateDepTreeItems", cmdline[1], cmdline[2]])
         if error:
             print("Error running command '%s': %s" % (cmdline, error))
             return 1
@@ -290,6 +301,11 @@ def main(server, eventHandler, params):
                 dep.parse(event._depgraph)
                 gtk.gdk.threads_leave()
 
+            if isinstance(event, bb.event.DepTreeItems):
+                gtk.gdk.threads_enter()
+                dep.parse_items(event._items)
+                gtk.gdk.threads_leave()
+
             if isinstance(event, bb.command.CommandCompleted):
                 continue
 
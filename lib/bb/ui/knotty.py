@@ -48,17 +48,29 @@ class BBProgress(progressbar.ProgressBar):
             self._resize_default = None
         progressbar.ProgressBar.__init__(self, maxval, [self.msg + ": "] + widgets)
 
+    def start(self):
+        # Log output is buffered in stdout, get it out ahead of the bar
+        sys.stdout.flush()
+        return progressbar.ProgressBar.start(self)
+
+    def update(self, value=None):
+        sys.stdout.flush()
+        progressbar.ProgressBar.update(self, value)
+
     def _handle_resize(self, signum, frame):
         progressbar.ProgressBar._handle_resize(self, signum, frame)
         if self._resize_default:
             self._resize_default(signum, frame)
     def finish(self):
+        sys.stdout.flush()
         progressbar.ProgressBar.finish(self)
         if self._resize_default:
             signal.signal(signal.SIGWINCH, self._resize_default)
 
 class NonInteractiveProgress(object):
-    fobj = sys.stdout
+    @property
+    def fobj(self):
+        return sys.stdout
 
     def __init__(self, msg, maxval):
         self.msg = msg
@@ -103,6 +115,9 @@ class InteractConsoleLogFilter(logging.Filter):
 class TerminalFilter(object):
     columns = 80
 
+    # Minimum interval in seconds between redraws of the footer
+    update_interval = 0.1
+
     def sigwinch_handle(self, signum, frame):
         self.columns = self.getTerminalColumns()
         if self._sigwinch_default:
@@ -137,7 +152,8 @@ class TerminalFilter(object):
         self.stdinbackup = None
         self.interactive = sys.stdout.isatty()
         self.footer_present = False
-        self.lastpids = []
+        self.footer_lines = []
+        self.nextupdate = 0
 
         if not self.interactive:
             return
@@ -160,6 +176,7 @@ class TerminalFilter(object):
             if curses.tigetnum("colors") > 2:
                 format.enable_color()
             self.ed = curses.tigetstr("ed")
+            self.el = curses.tigetstr("el")
             if self.ed:
                 self.cuu = curses.tigetstr("cuu")
             try:
@@ -174,42 +191,89 @@ class TerminalFilter(object):
 
     def clearFooter(self):
         if self.footer_present:
+            # Output buffered since the footer was drawn has to reach the
+            # terminal before the cursor is moved back over it
+            sys.stdout.flush()
             lines = self.footer_present
             sys.stdout.write(self.curses.tparm(self.cuu, lines))
             sys.stdout.write(self.curses.tparm(self.ed))
         self.footer_present = False
+        self.footer_lines = []
 
-    def updateFooter(self):
+    def rows(self, line):
+        return 1 + int(len(line) / (self.columns + 1))
+
+    def updateDelay(self, delay):
+        """
+        How long the main loop may wait for an event before the next
+        redraw of the footer is due
+        """
         if not self.cuu:
+            return delay
+        return max(0, min(delay, self.nextupdate - time.time()))
+
+    def updateFooter(self):
+        """
+        Redraw the footer, at most once per update_interval, and push out
+        whatever output has been buffered since the last redraw
+        """
+        now = time.time()
+        if now < self.nextupdate:
             return
+        self.nextupdate = now + self.update_interval
+
+        if self.cuu:
+            self.drawFooter(self.footerLines())
+        sys.stdout.flush()
+
+    def footerLines(self):
         activetasks = self.helper.running_tasks
-        failedtasks = self.helper.failed_tasks
         runningpids = self.helper.running_pids
-        if self.footer_present and (self.lastcount == self.helper.tasknumber_current) and (self.lastpids == runningpids):
+        if (not self.helper.tasknumber_total or self.helper.tasknumber_current == self.helper.tasknumber_total) and not len(activetasks):
+            return []
+
+        if self.main.shutdown and len(activetasks):
+            lines = ["Waiting for %s running tasks to finish:" % len(activetasks)]
+        elif not len(activetasks):
+            lines = ["No currently running tasks (%s of %s)" % (self.helper.tasknumber_current, self.helper.tasknumber_total)]
+        else:
+            lines = ["Currently %s running tasks (%s of %s):" % (len(activetasks), self.helper.tasknumber_current, self.helper.tasknumber_total)]
+        for tasknum, t in enumerate(runningpids):
+            lines.append("%s: %s (pid %s)" % (tasknum, activetasks[t]["title"], t))
+        return lines
+
+    def drawFooter(self, lines):
+        if lines == self.footer_lines and (self.footer_present or not lines):
             return
-        if self.footer_present:
+        if not lines:
             self.clearFooter()
-        if (not self.helper.tasknumber_total or self.helper.tasknumber_current == self.helper.tasknumber_total) and not len(activetasks):
             return
-        tasks = []
-        for t in runningpids:
-            tasks.append("%s (pid %s)" % (activetasks[t]["title"], t))
 
-        if self.main.shutdown:
-            content = "Waiting for %s running tasks to finish:" % len(activetasks)
-        elif not len(activetasks):
-            content = "No currently running tasks (%s of %s)" % (self.helper.tasknumber_current, self.helper.tasknumber_total)
+        if self.footer_present and self.el:
+            # Only rewrite the lines which changed: go back to the top of
+            # the footer and step over the others. Once a line's height
+            # changes everything below it moves, so from there on clear and
+            # write out the rest.
+            output = [self.curses.tparm(self.cuu, self.footer_present)]
+            old = self.footer_lines
+            rest = []
+            for i, line in enumerate(lines):
+                if i >= len(old) or self.rows(old[i]) != self.rows(line):
+                    rest = lines[i:]
+                    break
+                if line == old[i]:
+                    output.append("\n" * self.rows(line))
+                else:
+                    output.append(line + self.curses.tparm(self.el) + "\n")
+            output.append(self.curses.tparm(self.ed))
+            output.extend(line + "\n" for line in rest)
         else:
-            content = "Currently %s running tasks (%s of %s):" % (len(activetasks), self.helper.tasknumber_current, self.helper.tasknumber_total)
-        print(content)
-        lines = 1 + int(len(content) / (self.columns + 1))
-        for tasknum, task in enumerate(tasks):
-            content = "%s: %s" % (tasknum, task)
-            print(content)
-            lines = lines + 1 + int(len(content) / (self.columns + 1))
-        self.footer_present = lines
-        self.lastpids = runningpids[:]
-        self.lastcount = self.helper.tasknumber_current
+            self.clearFooter()
+            output = [line + "\n" for line in lines]
+
+        sys.stdout.write("".join(output))
+        self.footer_present = sum(self.rows(line) for line in lines)
+        self.footer_lines = lines
 
     def finish(self):
         if self.stdinbackup:
@@ -241,7 +305,52 @@ _evt_list = [ "bb.runqueue.runQueueExitWait", "bb.event.LogExecTTY", "logging.Lo
               "bb.runqueue.runQueueTaskStarted", "bb.runqueue.runQueueTaskFailed", "bb.runqueue.sceneQueueTaskFailed",
               "bb.event.BuildBase", "bb.build.TaskStarted", "bb.build.TaskSucceeded", "bb.build.TaskFailedSilent"]
 
+class BatchedStreamHandler(logging.StreamHandler):
+    """
+    A StreamHandler which leaves flushing the stream to the main loop, so
+    that a burst of log records goes out in one write
+    """
+    def flush(self):
+        pass
+
+class StdoutFlushingStream(object):
+    """
+    Wraps a stream such as stderr so that anything buffered in stdout is
+    written out ahead of it
+    """
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, data):
+        sys.stdout.flush()
+        self.stream.write(data)
+
+    def writelines(self, lines):
+        sys.stdout.flush()
+        self.stream.writelines(lines)
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
 def main(server, eventHandler, params, tf = TerminalFilter):
+    # Write through a block buffered copy of stdout which the main loop
+    # flushes when the footer is redrawn or cleared or it runs out of
+    # events, rather than once per line. Writes to stderr flush it first.
+    stdout = sys.stdout
+    stderr = sys.stderr
+    try:
+        sys.stdout = os.fdopen(os.dup(stdout.fileno()), "w", 65536)
+    except (AttributeError, OSError):
+        return _main(server, eventHandler, params, tf)
+    sys.stderr = StdoutFlushingStream(stderr)
+    try:
+        return _main(server, eventHandler, params, tf)
+    finally:
+        sys.stdout.flush()
+        sys.stdout = stdout
+        sys.stderr = stderr
+
+def _main(server, eventHandler, params, tf):
 
     includelogs, loglines, consolelogfile = _log_settings_from_server(server)
 
@@ -252,7 +361,7 @@ def main(server, eventHandler, params, tf = TerminalFilter):
 
     helper = uihelper.BBUIHelper()
 
-    console = logging.StreamHandler(sys.stdout)
+    console = BatchedStreamHandler(sys.stdout)
     format_str = "%(levelname)s: %(message)s"
     format = bb.msg.BBLogFormatter(format_str)
     bb.msg.addDefaultlogFilter(console)
@@ -307,9 +416,13 @@ def main(server, eventHandler, params, tf = TerminalFilter):
     while True:
         try:
             termfilter.updateFooter()
-            event = eventHandler.waitEvent(0.25)
+            event = eventHandler.getEvent()
+            if event is None:
+                sys.stdout.flush()
+                event = eventHandler.waitEvent(termfilter.updateDelay(0.25))
             if event is None:
                 if main.shutdown > 1:
+                    termfilter.updateFooter()
                     break
                 continue
             helper.eventHandler(event)
@@ -322,6 +435,7 @@ def main(server, eventHandler, params, tf = TerminalFilter):
                     tries = event.retries
                     while tries:
                         print("Trying to run: %s" % event.prog)
+                        sys.stdout.flush()
                         if os.system(event.prog) == 0:
                             break
                         time.sleep(event.sleep_delay)
@@ -53,28 +53,42 @@ def set_context(ctx):
 # Context used in better_exec, eval
 _context = clean_context()
 
-def explode_version(s):
+_version_re = re.compile(r'([0-9]+)|([a-zA-Z]+)|(.)', re.S)
+_version_keys = {}
+
+def _explode_version(s):
     r = []
-    alpha_regexp = re.compile('^([a-zA-Z]+)(.*)$')
-    numeric_regexp = re.compile('^(\d+)(.*)$')
-    while (s != ''):
-        if s[0] in string.digits:
-            m = numeric_regexp.match(s)
-            r.append((0, int(m.group(1))))
-            s = m.group(2)
-            continue
-        if s[0] in string.letters:
-            m = alpha_regexp.match(s)
-            r.append((1, m.group(1)))
-            s = m.group(2)
-            continue
-        if s[0] == '~':
-            r.append((-1, s[0]))
+    for (numeric, alpha, other) in _version_re.findall(s):
+        if numeric:
+            r.append((0, int(numeric)))
+        elif alpha:
+            r.append((1, alpha))
+        elif other == '~':
+            r.append((-1, other))
         else:
-            r.append((2, s[0]))
-        s = s[1:]
+            r.append((2, other))
     return r
 
+def explode_version(s):
+    return list(version_key(s)[:-1])
+
+def version_key(s):
+    """
+    Return a key for a version string (a PV or PR) which orders the same
+    way vercmp_part() does. Keys are cached per string.
+    """
+    try:
+        return _version_keys[s]
+    except KeyError:
+        pass
+    if len(_version_keys) > 100000:
+        _version_keys.clear()
+    # vercmp_part() pads the shorter version with (0, None), which sorts
+    # before any digits but after a '~', so terminate the key with it
+    key = tuple(_explode_version(s)) + ((0, None),)
+    _version_keys[s] = key
+    return key
+
 def split_version(s):
     """Split a version string into its constituent parts (PE, PV, PR)"""
     s = s.strip(" <>=")
@@ -90,27 +104,15 @@ def split_version(s):
     return (e, v, r)
 
 def vercmp_part(a, b):
-    va = explode_version(a)
-    vb = explode_version(b)
-    while True:
-        if va == []:
-            (oa, ca) = (0, None)
-        else:
-            (oa, ca) = va.pop(0)
-        if vb == []:
-            (ob, cb) = (0, None)
-        else:
-            (ob, cb) = vb.pop(0)
-        if (oa, ca) == (0, None) and (ob, cb) == (0, None):
-            return 0
-        if oa < ob:
-            return -1
-        elif oa > ob:
-            return 1
-        elif ca < cb:
-            return -1
-        elif ca > cb:
-            return 1
+    return cmp(version_key(a), version_key(b))
+
+def vercmp_key(ta):
+    """
+    Return a key for a (PE, PV, PR) tuple such that comparing the keys of
+    two versions agrees with vercmp() on them, for use with sorted()/max().
+    """
+    (e, v, r) = ta
+    return (int(e or 0), version_key(v), version_key(r))
 
 def vercmp(ta, tb):
     (ea, va, ra) = ta
@@ -261,13 +263,51 @@ def _print_trace(body, line):
             error.append('     %.4d:%s' % (i, body[i-1].rstrip()))
     return error
 
+class CodeCache(object):
+    """
+    Process-wide cache of compiled code objects keyed by their source text,
+    filename and mode. The same expansions, anonymous functions and class
+    methods are compiled for every recipe, and code objects can be shared.
+    The cache is emptied when it grows past maxsize entries.
+    """
+    def __init__(self, maxsize = 8192):
+        self.maxsize = maxsize
+        self.code = {}
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+
+    def compile(self, text, file, mode = "exec"):
+        key = (text, file, mode)
+        code = self.code.get(key)
+        if code is not None:
+            self.hits += 1
+            return code
+
+        self.misses += 1
+        code = compile(text, file, mode)
+        if len(self.code) >= self.maxsize:
+            self.code.clear()
+        self.code[key] = code
+        return code
+
+    def log_stats(self):
+        total = self.hits + self.misses
+        if total:
+            logger.debug(1, "Code cache: %d lookups, %d hits (%.1f%%)",
+                         total, self.hits, 100.0 * self.hits / total)
+
+codecache = CodeCache()
+
 def better_compile(text, file, realfile, mode = "exec"):
     """
     A better compile method. This method
     will print  the offending lines.
     """
     try:
-        return compile(text, file, mode)
+        return codecache.compile(text, file, mode)
     except Exception as e:
         error = []
         # split the text into lines again
@@ -791,22 +831,29 @@ def copyfile(src, dest, newmtime = None, sstat = None):
         newmtime = sstat[stat.ST_MTIME]
     return newmtime
 
-def which(path, item, direction = 0):
+def which(path, item, direction = 0, history = False):
     """
-    Locate a file in a PATH
+    Locate a file in a PATH. With history, also return the list of
+    paths looked at, up to and including the one found
     """
 
+    hist = []
     paths = (path or "").split(':')
     if direction != 0:
         paths.reverse()
 
     for p in paths:
         next = os.path.join(p, item)
+        hist.append(next)
         if os.path.exists(next):
             if not os.path.isabs(next):
                 next = os.path.abspath(next)
+            if history:
+                return next, hist
             return next
 
+    if history:
+        return "", hist
     return ""
 
 def to_boolean(string, default=None):